@@ -1,103 +1,254 @@
-from flask import Flask,render_template,request, redirect, flash,url_for,json,abort,send_file
+from flask import Flask,Blueprint,current_app,render_template,request, redirect, flash,url_for,json,abort,send_file,session
+from flask.cli import AppGroup
 from flask import Markup,escape
-from flask_security.decorators import roles_accepted,roles_required
+from flask_security.decorators import roles_accepted,roles_required,auth_required
 from flask_security.utils import hash_password,current_user
-from models import db,User,Role,Game,ControlConfig
-from forms import GameUploadForm
+from werkzeug.local import LocalProxy
+from models import db,User,Role,Game,ControlConfig,Job,PlayTally,SaveState,HighScore,newline_to_p
+from cache import create_cache,LRUCache
+from pagination import KeysetPagination,ApproximateCounter
+from search import GameSearch,SearchPagination
+from jobs import JobQueue
+from telemetry import PlayTelemetry,parse_play_event,roll_up_plays,MAX_EVENTS_PER_REQUEST
+from uploads import UploadRequest
+from storage import create_storage,current_storage,write_atomic
+from instrumentation import Instrumentation,io_timer
+from assets import StaticAssets,build_assets
+from chip8 import smoke_test,SMOKE_TEST_CYCLES
+from game_snapshots import GameSnapshots
+from save_states import parse_state,serialize_state,encode_state,decode_state
+from leaderboards import Leaderboards,MAX_SCORE
+from game_bundle import read_fonts,bundle_etag,encode_bundle,MIMETYPE as BUNDLE_MIMETYPE
 from flask_wtf.file import FileRequired
 from flask_wtf.csrf import CSRFProtect
-from sqlalchemy.exc import SQLAlchemyError
-from flask_migrate import Migrate
+from sqlalchemy.exc import SQLAlchemyError,IntegrityError
 from flask_security import Security,SQLAlchemyUserDatastore
+from functools import partial
+import atexit
 import os
 import uuid
+import hashlib
+import string
+import click
+import time
 
-app = Flask(__name__)
-app.config.from_pyfile('config.cfg')
-csrf = CSRFProtect(app)
-
-db.init_app(app)
-migrate = Migrate(app,db)
+#routes, error handlers and commands, registered on every application create_app builds
+arcade = Blueprint('arcade',__name__,cli_group=None)
+csrf = CSRFProtect()
 user_datastore = SQLAlchemyUserDatastore(db,User, Role)
-security = Security(app,user_datastore)
+security = Security()
+game_search = GameSearch(db,Game.__table__)
+jobs = JobQueue(db,Job)
+
+'''
+:returns Proxy to the object create_app stored under name in the extensions of the current application.
+'''
+def app_extension(name):
+    return LocalProxy(lambda:current_app.extensions[name])
+
+#sized from the configuration of each application by create_app
+storage = LocalProxy(current_storage)
+game_counter = app_extension('game_counter')
+game_config_cache = app_extension('game_config_cache')
+page_cache = app_extension('page_cache')
+rom_cache = app_extension('rom_cache')
+game_snapshots = app_extension('game_snapshots')
+leaderboards = app_extension('leaderboards')
+instrumentation = app_extension('instrumentation')
+static_assets = app_extension('static_assets')
+telemetry = app_extension('telemetry')
+
+'''
+Application factory and the entry point for servers and the flask command, for example
+gunicorn "app:create_app()" or FLASK_APP=app.  Importing this module only defines the
+routes, tasks and commands, every call builds a new application from its settings.
 
-#create test user
-#TODO remove once signup is created
-@app.before_first_request
-def create_test_user():
+:param settings Path of the settings file, CHIP8_ARCADE_SETTINGS or config.cfg by default.
+'''
+def create_app(settings=None):
+    app = Flask(__name__)
+    app.request_class = UploadRequest
+    #roms are at most a few kilobytes, so refuse larger bodies from their content length
+    app.config['MAX_CONTENT_LENGTH'] = 64 * 2**10
+    app.config.from_pyfile(settings or os.environ.get('CHIP8_ARCADE_SETTINGS','config.cfg'))
+    csrf.init_app(app)
+    db.init_app(app)
+    create_storage(app)
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        #alembic is slow to import and only the flask db commands need it
+        from flask_migrate import Migrate
+        Migrate(app,db)
+    security.init_app(app,user_datastore)
+    app.extensions['game_counter'] = ApproximateCounter(app.config.get('APPROXIMATE_TOTAL_TTL',300))
+    app.extensions['game_config_cache'] = create_cache(app,'game_config',app.config.get('GAME_CONFIG_CACHE_SIZE',1024))
+    app.extensions['page_cache'] = create_cache(app,'page',app.config.get('PAGE_CACHE_SIZE',512))
+    #roms for game bundles, kept by content hash so entries never go stale
+    app.extensions['rom_cache'] = LRUCache(app.config.get('ROM_CACHE_SIZE',256))
+    app.extensions['game_snapshots'] = GameSnapshots(db,create_cache(app,'game_snapshot',app.config.get('GAME_SNAPSHOT_CACHE_SIZE',1024)),
+                                                     app.config.get('GAME_SNAPSHOT_TTL',300))
+    app.extensions['leaderboards'] = Leaderboards(db,create_cache(app,'leaderboard',app.config.get('LEADERBOARD_CACHE_SIZE',1024)),
+                                                  app.config.get('LEADERBOARD_SIZE',10),app.config.get('LEADERBOARD_TTL',60))
+    Instrumentation(app)
+    StaticAssets(app)
+    jobs.init_app(app)
+    PlayTelemetry(db,PlayTally,jobs,app=app)
+    #write out plays still buffered when the worker shuts down
+    atexit.register(flush_telemetry,app)
+    app.register_blueprint(arcade)
+    return app
+
+def flush_telemetry(app):
+    with app.app_context():
+        telemetry.flush()
+
+'''
+Creates the roles the application relies on and the test developer account.
+Run once against a new database, rows that already exist are left alone.
+'''
+@arcade.cli.command('seed',help='Create the roles and the test developer account.')
+def seed():
     role = user_datastore.find_or_create_role(name='Game Developer',role='game_dev',description="A chip 8 game developer that can add, edit, and remove their own chip8 games and supply game specific configurations for the chip 8 virtual machine.")
+    #TODO remove the test user once signup is created
     if not user_datastore.find_user(name="test_dev"):
         user = user_datastore.create_user(name='test_dev',email='test_dev@test.com',password=hash_password('password'))
         user_datastore.add_role_to_user(user,role)
+    user_datastore.find_or_create_role(name='Admin',role='admin',description="A site administrator that can view the application metrics.")
     db.session.commit()
+    click.echo('Seeded the roles and the test developer.')
+
+'''
+Serves a page to anonymous visitors from the page cache, rendering it on a miss.
+Logged in users and visitors with pending flash messages always get a fresh render,
+since their page differs from the cached copy.
+
+:param key Cache key, which must change whenever the content of the page does.
+:param render Callable returning the rendered page.
+:param last_modified When the content of the page last changed.
+:param ttl Seconds to keep the page for, when the key does not follow every change.
+'''
+def cached_page(key,render,last_modified=None,ttl=None):
+    if current_user.is_authenticated or session.get('_flashes'):
+        return render()
+    #pages link to hashed static files, which a new build renames
+    key = f"{static_assets.version}:{key}"
+    entry = page_cache.get(key)
+    if entry is None or (entry['expires'] is not None and entry['expires'] < time.time()):
+        body = render()
+        entry = {
+            'body':body,
+            'etag':hashlib.sha1(body.encode()).hexdigest(),
+            'expires':time.time() + ttl if ttl else None
+        }
+        page_cache.set(key,entry)
+    response = current_app.response_class(entry['body'],mimetype='text/html')
+    response.set_etag(entry['etag'])
+    if last_modified is not None:
+        response.last_modified = last_modified
+    #logged in users get a different page from the same url
+    response.vary.add('Cookie')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
-@app.route("/")
+'''
+:returns Token that changes whenever a game is added, changed or removed, for keying listings.
+'''
+def catalogue_version():
+    version = page_cache.get('catalogue_version')
+    if version is None:
+        version = invalidate_catalogue()
+    return version
+
+def invalidate_catalogue():
+    version = uuid.uuid4().hex
+    page_cache.set('catalogue_version',version)
+    return version
+
+'''
+Forgets the cached snapshot and configuration of a game once it has been changed or deleted.
+'''
+def invalidate_game(id):
+    game_snapshots.invalidate(id)
+    game_config_cache.delete(id)
+
+@arcade.route("/")
 def index():
-    return render_template('base.html')
+    return cached_page('index',lambda:render_template('base.html'))
 
 #TODO Create a proper 404 page
-@app.route("/game/play/<int:id>")
+@arcade.route("/game/play/<int:id>")
+@db.use_replica
 def play_game(id):
-    game = Game.query.get(id)
+    game = game_snapshots.get(id)
     if game is None:
         flash('The game you are looking for could not be found.')
         return "The game you are searching for could not be found",404
-    return render_template("play.html",game=game)
+    render = lambda:render_template("play.html",game=game)
+    return cached_page(f"play:{id}:{game.version}",render,game.last_modified)
 
-@app.route('/game/new',methods=['GET','POST'])
+@arcade.route('/game/new',methods=['GET','POST'])
 @roles_accepted('Game Developer')
 def upload_new_game():
+    #wtforms and the rom analysis tables are only loaded once a developer uploads or edits a game
+    from forms import GameUploadForm
     form = GameUploadForm()
     if request.method == 'POST' and form.validate(extra_validators={'game_rom':[FileRequired()]}):
         try:
-            #convert file to hex text format
-            rom_binary = form.game_rom.data.stream.read()
+            #streamed to the upload store while the request was parsed
+            rom_file = form.game_rom.data.stream
             title = form.title.data
             description = form.description.data
             instructions = form.instructions.data
             emulator_speed = form.emulator_speed.data
-            game_entry = Game(title=title,description=description,instructions=instructions,file=rom_binary,user=current_user)
+            game_entry = Game(title=title,description=description,instructions=instructions,file=rom_file,user=current_user)
+            game_entry.apply_analysis(form.game_rom.analysis)
             game_entry.control_config.append(ControlConfig(key_mapping=form.key_configuration,emulator_speed=emulator_speed))
             db.session.add(game_entry)
+            db.session.flush()
+            jobs.enqueue('smoke_test_game',game_entry.id)
+            jobs.enqueue('index_game',game_entry.id)
             db.session.commit()
+            game_counter.invalidate('games')
+            invalidate_catalogue()
         except IOError:
             flash("Failed to save file.")
         except SQLAlchemyError:
             flash('Failed to store file in database.')
-            #remove saved file
         else:
             flash('Your game has been successfully uploaded.')
-            return redirect(url_for('game_profile',id=game_entry.id))
+            return redirect(url_for('arcade.game_profile',id=game_entry.id))
         
     return render_template('upload_form.html',form=form)
 
 #TODO add in code to handle admins as well
-@app.route('/game/update/<int:id>',methods=['GET','POST'])
+@arcade.route('/game/update/<int:id>',methods=['GET','POST'])
 @roles_accepted('Game Developer')
 def update_game(id):
     game = Game.query.get(id)
     #handle case game not found
     if game is None:
         flash('The game you are trying to edit could not be found.')
-        return redirect(url_for('index'))
+        return redirect(url_for('arcade.index'))
     #redirect user if not owner
     if game.user.id != current_user.id:
         flash('You do not have permission to edit this game.')
         return redirect(url_for("/"))
     error_message = None
+    from forms import GameUploadForm
     form = GameUploadForm(obj=game)
 
     if request.method == 'POST':
         if form.validate():
             try:
-                #convert file to hex text format
-                rom_binary = None
+                rom_file = None
                 if form.game_rom.data:
-                    rom_binary = form.game_rom.data.stream.read()
+                    rom_file = form.game_rom.data.stream
+                    game.apply_analysis(form.game_rom.analysis)
+                    game.clear_smoke_test()
+                    jobs.enqueue('smoke_test_game',game.id)
                 game.title = form.title.data
                 game.description = form.description.data
                 game.instructions = form.instructions.data
-                game.file = rom_binary
+                game.file = rom_file
 
                 #update control configuration
                 #add new configuration if prior config not specified
@@ -108,15 +259,17 @@ def update_game(id):
                 else:
                     game.control_config.append(ControlConfig(key_mapping=form.key_configuration,emulator_speed=form.emulator_speed.data))
                 
+                jobs.enqueue('index_game',game.id)
                 db.session.commit()
+                invalidate_game(id)
+                invalidate_catalogue()
             except IOError:
                 flash("Failed to save file.")
             except SQLAlchemyError:
                 flash('Failed to store file in database.')
-                #remove saved file
             else:
                 flash("Your game has been successfully updated.")
-                return redirect(url_for('game_profile',id=game.id))
+                return redirect(url_for('arcade.game_profile',id=game.id))
     #populate form with data from database       
     else:
         #form.title.data = game.title
@@ -127,78 +280,654 @@ def update_game(id):
 
     return render_template('upload_form.html',form=form,id=game.id)
 
-@app.route('/game/config/<int:id>')
-def game_json(id):
-    game = Game.query.get(id)
+'''
+Builds the emulator configuration for a game from its snapshot.
+:returns Dictionary with the serialized json body, its etag and the rom filename
+    or None if the game does not exist.
+'''
+def build_game_config(id):
+    game = game_snapshots.get(id)
     if game is None:
-        return json.jsonify({"error":"The game could not be found."})
-    control_config = game.control_config.first()
-    if control_config is None:
-        return json.jsonify({"error":"Could not find control configuration for the game."})
+        return None
+    if game.key_config is None:
+        return {'error':"Could not find control configuration for the game."}
     game_info = {}
-    game_info['rom'] = url_for('send_rom',id=id)
+    game_info['rom'] = url_for('arcade.send_rom',id=id)
     game_info['chip8_font'] = url_for('static',filename="javascript/emulator/fonts/chip8.cft")
     game_info['super_chip_font'] = url_for('static',filename="javascript/emulator/fonts/chip8super.sft")
-    game_info['emulator_speed'] = control_config.emulator_speed
-    #reverse keymapping to fit with emulator standard of hex_value:key
-    keys_remapped = {control_config.key_mapping[key_code]:key_code for key_code in control_config.key_mapping}
-    game_info['key_config'] = keys_remapped
-    return json.jsonify(game_info)
+    game_info['emulator_speed'] = game.emulator_speed
+    game_info['schip_required'] = game.schip_required
+    game_info['instruction_count'] = game.instruction_count
+    game_info['key_config'] = game.key_config
+    body = json.dumps(game_info)
+    return {'body':body,'etag':hashlib.sha1(body.encode()).hexdigest(),'filename':game.filename,'assets':static_assets.version}
+
+'''
+Entries are kept for GAME_SNAPSHOT_TTL, like the snapshots they are built from.
+:returns The configuration built by build_game_config from the cache, None if the
+    game does not exist or a dictionary with an error if it has no configuration.
+'''
+def cached_game_config(id):
+    config = game_config_cache.get(id)
+    #entries shared through redis by older releases lack the filename or expiry, or link to fonts of another build
+    if config is None or 'expires' not in config or config['expires'] < time.time() \
+            or config.get('assets',static_assets.version) != static_assets.version:
+        config = build_game_config(id)
+        if config is not None and 'error' not in config:
+            #invalidate_game only reaches this worker's cache, so other workers converge once the entry expires
+            config['expires'] = time.time() + game_snapshots.ttl
+            game_config_cache.set(id,config)
+    return config
+
+@arcade.route('/game/config/<int:id>')
+@db.use_replica
+def game_json(id):
+    config = cached_game_config(id)
+    if config is None:
+        return json.jsonify({"error":"The game could not be found."})
+    if 'error' in config:
+        return json.jsonify(config)
+    response = current_app.response_class(config['body'],mimetype='application/json')
+    response.set_etag(config['etag'])
+    #let browsers keep the config but check back with the etag on every launch
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
     
-@app.route('/game/rom/<int:id>')
+#rom filenames are content hashes, so the file behind a filename never changes
+ROM_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+'''
+Sends a file from storage, or redirects to the storage backend when it serves files itself.
+Files are stored by content hash, which doubles as their etag.
+'''
+def send_stored_file(key,etag,mimetype):
+    url = storage.url(key)
+    if url is not None:
+        response = redirect(url)
+        response.headers['Cache-Control'] = storage.url_cache_control
+        return response
+    try:
+        with io_timer():
+            data = storage.read(key)
+    except IOError:
+        abort(404)
+    response = current_app.response_class(data,mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = ROM_CACHE_CONTROL
+    #handles If-None-Match and Range headers
+    return response.make_conditional(request,accept_ranges=True,complete_length=len(data))
+
+@arcade.route('/game/rom/<int:id>')
+@db.use_replica
 def send_rom(id):
-    game = Game.query.get(id)
+    game = game_snapshots.get(id)
     if game is None:
         abort(404)
-    try:
-        return send_file(game.path)
-    except:
+    return send_stored_file(game.key,game.filename,'application/octet-stream')
+
+'''
+Reads a rom by its content hash through the rom cache.
+:raises IOError if the rom is not in storage.
+'''
+def read_rom(filename):
+    rom = rom_cache.get(filename)
+    if rom is None:
+        with io_timer():
+            rom = storage.read(Game(filename=filename).key)
+        rom_cache.set(filename,rom)
+    return rom
+
+'''
+Sends the configuration, fonts and rom of a game in one response, see game_bundle.py.
+The etag is known before the rom is read, so revalidating a cached bundle touches no files.
+'''
+@arcade.route('/game/bundle/<int:id>')
+@db.use_replica
+def game_bundle(id):
+    config = cached_game_config(id)
+    if config is None or 'error' in config:
         abort(404)
-@app.route('/game/<int:id>')
+    chip8_font,super_chip_font,font_digest = read_fonts(current_app.static_folder)
+    etag = bundle_etag(config['etag'],config['filename'],font_digest)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        try:
+            rom = read_rom(config['filename'])
+        except IOError:
+            abort(404)
+        response = current_app.response_class(encode_bundle(config['body'],chip8_font,super_chip_font,rom),mimetype=BUNDLE_MIMETYPE)
+    response.set_etag(etag)
+    #the configuration can change, so browsers check back with the etag on every launch
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@arcade.route('/game/thumbnail/<int:id>')
+@db.use_replica
+def send_thumbnail(id):
+    game = game_snapshots.get(id)
+    if game is None or not game.has_thumbnail:
+        abort(404)
+    #thumbnails are stored by rom hash, so they never change either
+    return send_stored_file(game.thumbnail_key,game.filename,'image/png')
+
+@arcade.route('/game/<int:id>')
+@db.use_replica
 def game_profile(id):
-    game = Game.query.get(id)
-    if not game:
+    game = game_snapshots.get(id)
+    if game is None:
         #TODO Switch to redirect to listing page
         flash('The game you are searching for was not found.')
-        return render_template('profile.html',game=game),404
-    return render_template('profile.html',game=game)
+        return render_template('profile.html',game=None),404
+    render = lambda:render_template('profile.html',game=game)
+    return cached_page(f"profile:{id}:{game.version}",render,game.last_modified)
+
+'''
+Records play events posted by the emulator player, see telemetry.py.
+Expects json of the form {"events":[{"game_id":1,"event":"start"},{"game_id":1,"event":"end","duration":95.5}]}.
+The player posts with navigator.sendBeacon, which cannot send a csrf token.
+'''
+@arcade.route('/game/telemetry',methods=['POST'])
+@csrf.exempt
+def record_telemetry():
+    payload = request.get_json(force=True,silent=True)
+    events = payload.get('events') if isinstance(payload,dict) else None
+    if not isinstance(events,list) or len(events) > MAX_EVENTS_PER_REQUEST:
+        abort(400)
+    try:
+        events = [parse_play_event(event) for event in events]
+    except ValueError:
+        abort(400)
+    try:
+        for game_id,event,duration in events:
+            telemetry.record(game_id,event,duration)
+    except SQLAlchemyError:
+        #the totals stay buffered for the next flush
+        current_app.logger.exception('Could not flush play telemetry.')
+    return '',204
+
+'''
+Finds the save slot of the current user for a game, aborting with 404 when the game
+does not exist or the slot is out of range.
+:returns Tuple of (game,save) where save is None for an empty slot.
+'''
+def find_save_state(id,slot):
+    game = game_snapshots.get(id)
+    if game is None or slot >= current_app.config.get('SAVE_STATE_SLOTS',3):
+        abort(404)
+    save = SaveState.query.filter_by(user_id=current_user.id,game_id=id,slot=slot).first()
+    return game,save
+
+'''
+Lists the filled save slots of the current user for a game.
+Slots saved against a rom that has since been replaced are not current and cannot be loaded.
+'''
+@arcade.route('/game/<int:id>/saves')
+@auth_required()
+def list_save_states(id):
+    game = game_snapshots.get(id)
+    if game is None:
+        abort(404)
+    saves = SaveState.query.with_entities(SaveState.slot,SaveState.filename,SaveState.created_on,SaveState.last_updated)\
+        .filter_by(user_id=current_user.id,game_id=id).order_by(SaveState.slot).all()
+    return json.jsonify([{'slot':save.slot,'saved_on':(save.last_updated or save.created_on).isoformat(),
+                          'current':save.filename == game.filename} for save in saves])
+
+'''
+Sends a save state in the raw layout described in save_states.py.
+'''
+@arcade.route('/game/<int:id>/saves/<int:slot>')
+@auth_required()
+def download_save_state(id,slot):
+    game,save = find_save_state(id,slot)
+    if save is None:
+        abort(404)
+    if save.filename != game.filename:
+        return "The game has been updated since this state was saved.",409
+    try:
+        state = decode_state(bytes(save.data),read_rom(save.filename))
+    except IOError:
+        abort(404)
+    response = current_app.response_class(serialize_state(state),mimetype='application/octet-stream')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+'''
+Stores a save state sent in the raw layout described in save_states.py, replacing the slot.
+'''
+@arcade.route('/game/<int:id>/saves/<int:slot>',methods=['PUT'])
+@auth_required()
+def upload_save_state(id,slot):
+    game,save = find_save_state(id,slot)
+    try:
+        state = parse_state(request.get_data())
+    except ValueError as e:
+        return str(e),400
+    try:
+        data = encode_state(state,read_rom(game.filename))
+    except IOError:
+        abort(404)
+    if save is None:
+        save = SaveState(user_id=current_user.id,game_id=id,slot=slot)
+        db.session.add(save)
+    save.filename = game.filename
+    save.data = data
+    try:
+        db.session.commit()
+    except IntegrityError:
+        #another request filled the slot first
+        db.session.rollback()
+        return "The slot was saved to by another request.",409
+    return '',204
+
+@arcade.route('/game/<int:id>/saves/<int:slot>',methods=['DELETE'])
+@auth_required()
+def delete_save_state(id,slot):
+    game,save = find_save_state(id,slot)
+    if save is not None:
+        db.session.delete(save)
+        db.session.commit()
+    return '',204
+
+'''
+The top scores of a game, see leaderboards.py.
+'''
+@arcade.route('/game/<int:id>/scores')
+@db.use_replica
+def game_leaderboard(id):
+    if game_snapshots.get(id) is None:
+        abort(404)
+    return json.jsonify(leaderboards.get(id))
+
+'''
+Records a score of the current user, expecting json of the form {"score":1200}.
+Responds with the user's high score for the game and whether this score improved it.
+'''
+@arcade.route('/game/<int:id>/scores',methods=['POST'])
+@auth_required()
+def submit_score(id):
+    if game_snapshots.get(id) is None:
+        abort(404)
+    payload = request.get_json(silent=True)
+    score = payload.get('score') if isinstance(payload,dict) else None
+    if type(score) != int or not 0 <= score <= MAX_SCORE:
+        return f"Scores must be whole numbers from 0 to {MAX_SCORE}.",400
+    best,improved = leaderboards.record(id,current_user.id,score)
+    if improved:
+        leaderboards.invalidate(id)
+    return json.jsonify(best=best,improved=improved)
 
-@app.route('/game/mygames')
+@arcade.route('/game/mygames')
 @roles_accepted('Game Developer')
 def list_games_developer():
-    page = request.args.get('page',default=1,type=int)
-    posts_per_page = app.config['POSTS_PER_PAGE']
-    games = Game.query.filter(User.id == current_user.id).order_by(Game.created_on.desc()).paginate(page,posts_per_page,False)
+    cursor = request.args.get('cursor')
+    posts_per_page = current_app.config['POSTS_PER_PAGE']
+    query = Game.query.filter(Game.user_id == current_user.id)
+    games = KeysetPagination(query,Game,cursor,posts_per_page)
     return render_template('game_list_dev.html',games=games.items,paginator=games)
 
-@app.route('/game/delete',methods=["POST"])
+@arcade.route('/game/delete',methods=["POST"])
 @roles_accepted('Game Developer')
 def delete_games():
     try:
         ids = request.form.getlist('game_ids')
-        games = Game.query.filter(Game.id.in_(ids),User.id==current_user.id).all()
+        games = Game.query.filter(Game.id.in_(ids),Game.user_id == current_user.id).all()
+        deleted_ids = [game.id for game in games]
         for game in games:
             db.session.delete(game)
+        game_search.remove_games(deleted_ids)
+        if deleted_ids:
+            SaveState.query.filter(SaveState.game_id.in_(deleted_ids)).delete(synchronize_session=False)
+            HighScore.query.filter(HighScore.game_id.in_(deleted_ids)).delete(synchronize_session=False)
         db.session.commit()
+        for game_id in deleted_ids:
+            invalidate_game(game_id)
+            leaderboards.invalidate(game_id)
+        game_counter.invalidate('games')
+        invalidate_catalogue()
         flash('Your games have been deleted.')
     except SQLAlchemyError:
         flash('The games could not be deleted from the database.')
     finally:
-        return redirect(url_for('list_games_developer'))
+        return redirect(url_for('arcade.list_games_developer'))
 
-@app.route('/games')
+@arcade.route('/games')
+@db.use_replica
 def list_games():
+    cursor = request.args.get('cursor')
+    sort = 'popular' if request.args.get('sort') == 'popular' else None
+    def render():
+        posts_per_page = current_app.config['POSTS_PER_PAGE']
+        total = None
+        if current_app.config.get('SHOW_APPROXIMATE_TOTALS'):
+            total = game_counter.count('games',Game.query)
+        games = KeysetPagination(Game.query,Game,cursor,posts_per_page,total,'play_count' if sort else 'created_on')
+        return render_template('game_list.html',games=games.items,paginator=games,sort=sort)
+    #background jobs change thumbnails and play counts without invalidating, so listings also expire
+    return cached_page(f"games:{catalogue_version()}:{sort}:{cursor}",render,ttl=current_app.config.get('PAGE_CACHE_TTL',60))
+
+@arcade.route('/games/search')
+def search_games():
+    query = request.args.get('q',default='').strip()
+    #search results are ranked, so they are paged by number rather than by keyset cursor
     page = request.args.get('page',default=1,type=int)
-    posts_per_page = app.config['POSTS_PER_PAGE']
-    games = Game.query.order_by(Game.created_on.desc()).paginate(page,posts_per_page,False)
-    return render_template('game_list.html',games=games.items,paginator=games)
+    posts_per_page = current_app.config['POSTS_PER_PAGE']
+    games = SearchPagination(game_search,Game,query,page,posts_per_page)
+    return render_template('game_search.html',games=games.items,paginator=games,query=query)
+
+@arcade.app_errorhandler(413)
+def upload_too_large(error):
+    return f"The upload is too large. Requests may be at most {current_app.config['MAX_CONTENT_LENGTH']} bytes.",413
+
+'''
+Request histograms of this worker process in the Prometheus text format.
+Only available when INSTRUMENTATION_ENABLED is set.
+'''
+@arcade.route('/metrics')
+@roles_required('Admin')
+def metrics():
+    if not instrumentation.enabled:
+        abort(404)
+    return current_app.response_class(instrumentation.render_metrics(),mimetype='text/plain; version=0.0.4')
 
-@app.template_filter('newline_to_p')
+@arcade.app_template_filter('newline_to_p')
 def newLineToParagragh(string):
-    lines_raw = string.splitlines()
-    lines_sanitized = [Markup.escape(line) for line in lines_raw]
-    return Markup(f"<p>{'</p><p>'.join(lines_sanitized)}</p>")
+    return newline_to_p(string)
+
+roms_cli = AppGroup('roms',help='Manage stored game roms.')
+
+'''
+Returns the location of a rom saved before the content addressed store,
+when files were kept on local disk unsharded under their uuid filename.
+'''
+def legacy_rom_path(game):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'],game.key_prefix,str(game.filename))
+
+'''
+Writes the thumbnail rendered by a smoke test unless the rom already has one.
+'''
+def store_thumbnail(game,thumbnail):
+    if thumbnail and not storage.exists(game.thumbnail_key):
+        storage.write(game.thumbnail_key,thumbnail)
+
+'''
+Converts roms saved in the legacy hex text format into raw binary.
+Files that are already binary are left untouched, so the command is safe to rerun.
+'''
+@roms_cli.command('convert-hex')
+def convert_hex_roms():
+    hex_digits = set(string.hexdigits.encode())
+    converted = 0
+    for game in Game.query.all():
+        if storage.exists(game.key):
+            data = storage.read(game.key)
+            write = partial(storage.write,game.key)
+        else:
+            path = legacy_rom_path(game)
+            if not os.path.exists(path):
+                click.echo(f"Missing rom for game {game.id}: {game.key}")
+                continue
+            with open(path,'rb') as reader:
+                data = reader.read()
+            write = partial(write_atomic,path)
+        #legacy files are pairs of ascii hex digits
+        if not data or len(data) % 2 or not set(data) <= hex_digits:
+            continue
+        write(bytes.fromhex(data.decode('ascii')))
+        converted += 1
+    click.echo(f"Converted {converted} roms to binary.")
+
+'''
+Moves roms saved under uuid filenames into the content addressed store.
+Run after convert-hex so that identical roms hash to the same blob.
+'''
+@roms_cli.command('rehash')
+def rehash_roms():
+    moved = 0
+    for game in Game.query.all():
+        legacy_path = legacy_rom_path(game)
+        if not os.path.isfile(legacy_path):
+            continue
+        with open(legacy_path,'rb') as reader:
+            data = reader.read()
+        game.filename = hashlib.sha256(data).hexdigest()
+        if not storage.exists(game.key):
+            storage.write(game.key,data)
+        db.session.commit()
+        invalidate_game(game.id)
+        os.remove(legacy_path)
+        moved += 1
+    click.echo(f"Moved {moved} roms into the content addressed store.")
+
+'''
+Runs static analysis and smoke tests on stored roms, recording the results and
+thumbnails for each game.
+'''
+@roms_cli.command('analyze')
+@click.option('--all','analyze_all',is_flag=True,help='Reanalyze games that already have results.')
+def analyze_roms(analyze_all):
+    from rom_analysis import analyze_rom
+    query = Game.query
+    if not analyze_all:
+        query = query.filter(Game.instruction_count == None)
+    analyzed = 0
+    games = query.all()
+    for game in games:
+        try:
+            rom = storage.read(game.key)
+        except IOError:
+            click.echo(f"Missing rom for game {game.id}: {game.key}")
+            continue
+        analysis = analyze_rom(rom)
+        game.apply_analysis(analysis)
+        if analysis.fatal_opcode is not None:
+            click.echo(f"Game {game.id} executes an invalid instruction at {hex(analysis.fatal_opcode[0])}.")
+        result = smoke_test(rom)
+        game.apply_smoke_test(result)
+        if result.error:
+            click.echo(f"Game {game.id} failed its smoke test. {result.error}")
+        store_thumbnail(game,result.thumbnail)
+        analyzed += 1
+    db.session.commit()
+    for game in games:
+        invalidate_game(game.id)
+    click.echo(f"Analyzed {analyzed} roms.")
+
+'''
+Replays every stored rom through the batch interpreter for a fixed number of cycles,
+recording whether it passed.  Run after changing the interpreter to find games it breaks.
+'''
+@roms_cli.command('revalidate')
+@click.option('--batch-size',default=500,show_default=True,help='Roms emulated in lockstep at a time.')
+@click.option('--cycles',default=SMOKE_TEST_CYCLES,show_default=True,help='Instructions each rom runs for.')
+def revalidate_roms(batch_size,cycles):
+    #numpy is only needed here, so keep it out of the web workers
+    from batch_chip8 import batch_smoke_test
+    games = Game.query.order_by(Game.id).all()
+    failed = 0
+    for start in range(0,len(games),batch_size):
+        batch = []
+        roms = []
+        for game in games[start:start + batch_size]:
+            try:
+                roms.append(storage.read(game.key))
+            except IOError:
+                click.echo(f"Missing rom for game {game.id}: {game.key}")
+                continue
+            batch.append(game)
+        for game,result in zip(batch,batch_smoke_test(roms,cycles)):
+            game.apply_smoke_test(result)
+            if result.error:
+                failed += 1
+                click.echo(f"Game {game.id} failed its smoke test. {result.error}")
+            store_thumbnail(game,result.thumbnail)
+        db.session.commit()
+        for game in batch:
+            invalidate_game(game.id)
+    click.echo(f"Revalidated {len(games)} roms, {failed} failed.")
+
+arcade.cli.add_command(roms_cli)
+
+database_cli = AppGroup('database',help='Manage the database connections.')
+
+'''
+Copies the sqlite primary over the sqlite replica, standing in for replication
+when DATABASE_REPLICA_URI points at a second sqlite file.
+'''
+@database_cli.command('sync-replica')
+def sync_replica():
+    if not db.has_replica():
+        raise click.UsageError('DATABASE_REPLICA_URI is not configured.')
+    try:
+        db.sync_sqlite_replica()
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    click.echo('Replica synced.')
+
+arcade.cli.add_command(database_cli)
+
+search_cli = AppGroup('search',help='Manage the game search index.')
+
+@search_cli.command('rebuild')
+def rebuild_search_index():
+    game_search.rebuild()
+    db.session.commit()
+    click.echo("Rebuilt the game search index.")
+
+arcade.cli.add_command(search_cli)
+
+'''
+Smoke tests the current rom of a game, recording the result and writing its thumbnail.
+'''
+@jobs.task('smoke_test_game')
+def smoke_test_game(id):
+    game = Game.query.get(id)
+    #the game was deleted after the job was queued
+    if game is None:
+        return
+    result = smoke_test(storage.read(game.key))
+    game.apply_smoke_test(result)
+    store_thumbnail(game,result.thumbnail)
+    #web workers without a shared cache see the result once GAME_SNAPSHOT_TTL passes
+    jobs.after_commit(partial(invalidate_game,id))
+
+@jobs.task('index_game')
+def index_game(id):
+    game = Game.query.get(id)
+    if game is not None:
+        game_search.index_game(game)
+
+'''
+Folds the tallies flushed by telemetry into the play counters of their games.
+The key is unused, flushes queue a single job under key 0.
+'''
+@jobs.task('roll_up_plays')
+def roll_up_plays_task(key):
+    roll_up_plays(db,PlayTally,Game)
+
+telemetry_cli = AppGroup('telemetry',help='Manage game play telemetry.')
+
+@telemetry_cli.command('rollup')
+def roll_up_telemetry():
+    games = roll_up_plays(db,PlayTally,Game)
+    db.session.commit()
+    click.echo(f"Rolled up plays for {games} games.")
+
+arcade.cli.add_command(telemetry_cli)
+
+assets_cli = AppGroup('assets',help='Build fingerprinted static files.')
+
+'''
+Writes hashed and compressed copies of the static files and their manifest, see assets.py.
+Workers serve the new build once restarted.
+'''
+@assets_cli.command('build')
+def build_static_assets():
+    try:
+        manifest = build_assets(current_app.static_folder)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    files = manifest['files'].values()
+    compressed = {encoding:sum(encoding in entry['encodings'] for entry in files) for encoding in ('gzip','br')}
+    click.echo(f"Built {len(files)} static files, {compressed['gzip']} gzipped and {compressed['br']} brotli compressed.")
+    if not compressed['br']:
+        click.echo('Install the brotli package to write brotli variants.')
+
+arcade.cli.add_command(assets_cli)
+
+jobs_cli = AppGroup('jobs',help='Run queued background jobs.')
+
+@jobs_cli.command('work')
+@click.option('--processes',default=1,show_default=True,help='Worker processes to run.')
+@click.option('--burst',is_flag=True,help='Exit once no job is due instead of waiting for more.')
+@click.option('--poll-interval',default=1.0,show_default=True,help='Seconds to wait between checks of an empty queue.')
+def work_jobs(processes,burst,poll_interval):
+    jobs.work_pool(current_app._get_current_object(),processes,burst,poll_interval)
+
+@jobs_cli.command('retry-failed')
+def retry_failed_jobs():
+    retried = jobs.retry_failed()
+    db.session.commit()
+    click.echo(f"Queued {retried} failed jobs for another run.")
+
+arcade.cli.add_command(jobs_cli)
+
+games_cli = AppGroup('games',help='Import and export games in bulk.')
+
+def find_developer(email):
+    user = user_datastore.find_user(email=email)
+    if user is None:
+        raise click.BadParameter(f"No user has the email {email}.",param_hint='--developer')
+    return user
+
+def echo_report(action,report):
+    rate = report.games / report.seconds if report.seconds else 0
+    click.echo(f"{action} {report.games} games and {report.rom_bytes} bytes of roms in {report.seconds:.1f}s "
+               f"({rate:.0f} games/s). {report.skipped} skipped, {report.failed} failed.")
+
+'''
+Imports a directory of roms, a zip archive or a manifest.jsonl file, see bulk_games.py.
+Rerunning an interrupted import skips the games it already stored.
+'''
+@games_cli.command('import')
+@click.argument('source',type=click.Path(exists=True))
+@click.option('--developer','email',required=True,help='Email of the developer who will own the games.')
+@click.option('--batch-size',default=500,show_default=True,help='Games inserted per transaction.')
+@click.option('--workers',default=8,show_default=True,help='Threads writing roms to the upload store.')
+def import_games_command(source,email,batch_size,workers):
+    from bulk_games import import_games
+    user = find_developer(email)
+    report = import_games(db,jobs,source,user,batch_size,workers,echo=click.echo)
+    game_counter.invalidate('games')
+    invalidate_catalogue()
+    echo_report('Imported',report)
+
+'''
+Exports games to a directory, or a zip archive when the destination ends in .zip.
+'''
+@games_cli.command('export')
+@click.argument('destination',type=click.Path())
+@click.option('--developer','email',help='Only export the games of this developer.')
+@click.option('--batch-size',default=500,show_default=True,help='Games read per query batch.')
+@click.option('--workers',default=8,show_default=True,help='Threads reading roms from the upload store.')
+def export_games_command(destination,email,batch_size,workers):
+    from bulk_games import export_games
+    user = find_developer(email) if email else None
+    report = export_games(db,destination,user,batch_size,workers,echo=click.echo)
+    echo_report('Exported',report)
+
+arcade.cli.add_command(games_cli)
 
+'''
+Builds the application from the default settings the first time app is looked up, so
+servers started as gunicorn app:app keep working while importing the module stays cheap.
+'''
+def __getattr__(name):
+    global app
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    app = create_app()
+    return app
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
\ No newline at end of file
@@ -0,0 +1,181 @@
+from flask import current_app,request,send_from_directory
+from storage import write_atomic,IMMUTABLE_CACHE_CONTROL
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+
+'''
+Fingerprinted, precompressed static files.
+
+flask assets build copies every file of the static folder into static/build under a
+name carrying a hash of its content, such as javascript/emulator/chip8.3f2a9c1d04be.js,
+writes gzip and, when the brotli package is installed, brotli variants next to it and
+records the hashed names in static/build/manifest.json.  Relative imports between
+javascript modules are rewritten to the hashed names, so a changed module also changes
+the hash of every module importing it.
+
+With a manifest present url_for('static',filename=...) resolves to the hashed file,
+which is served with far future caching in the best encoding the browser accepts.
+Without one, or with STATIC_ASSETS_ENABLED unset, static files are served as before,
+so the build step is only needed for deployments.  Earlier builds are left in place,
+so pages cached before a deployment keep working.
+'''
+
+BUILD_DIR = 'build'
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 12
+#module specifiers of static imports and re-exports that are relative to the module
+IMPORT_PATTERN = re.compile(r'''(\b(?:from|import)\s*)(["'])(\.{1,2}/[^"']+)\2''')
+#encodings in order of preference and the suffix of their variant
+ENCODINGS = (('br','.br'),('gzip','.gz'))
+
+'''
+:returns The data in the encoding or None if the encoding is not available.
+'''
+def compress(data,encoding):
+    if encoding == 'gzip':
+        #a fixed mtime keeps rebuilds byte for byte identical
+        return gzip.compress(data,9,mtime=0)
+    try:
+        #brotli is only required for br variants
+        import brotli
+    except ImportError:
+        return None
+    return brotli.compress(data,quality=11)
+
+def _read_sources(static_folder):
+    sources = {}
+    for directory,subdirectories,filenames in os.walk(static_folder):
+        if directory == static_folder and BUILD_DIR in subdirectories:
+            subdirectories.remove(BUILD_DIR)
+        for filename in filenames:
+            source = os.path.join(directory,filename)
+            sources[os.path.relpath(source,static_folder).replace(os.sep,'/')] = source
+    return sources
+
+'''
+Builds hashed and compressed copies of the static files and their manifest.
+
+:returns The manifest, a dictionary with a version that changes with any file and the
+    hashed path and available encodings of every file by its path in the static folder.
+:raises ValueError if javascript modules import each other in a cycle.
+'''
+def build_assets(static_folder):
+    build_folder = os.path.join(static_folder,BUILD_DIR)
+    sources = _read_sources(static_folder)
+    files = {}
+
+    def build(path,importers=()):
+        if path in files:
+            return files[path]['path']
+        if path in importers:
+            raise ValueError(f"The modules importing {path} form a cycle, which cannot be fingerprinted.")
+        with open(sources[path],'rb') as reader:
+            data = reader.read()
+        directory = posixpath.dirname(path)
+        if path.endswith('.js'):
+            def rewrite(match):
+                dependency = posixpath.normpath(posixpath.join(directory,match.group(3)))
+                if dependency not in sources:
+                    return match.group(0)
+                target = posixpath.relpath(build(dependency,importers + (path,)),directory)
+                if not target.startswith('.'):
+                    target = './' + target
+                return f"{match.group(1)}{match.group(2)}{target}{match.group(2)}"
+            data = IMPORT_PATTERN.sub(rewrite,data.decode('utf-8')).encode('utf-8')
+        stem,extension = posixpath.splitext(path)
+        hashed_path = f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{extension}"
+        target = os.path.join(build_folder,*hashed_path.split('/'))
+        #names are content hashes, so an existing file is already up to date
+        if not os.path.exists(target):
+            write_atomic(target,data)
+        encodings = []
+        for encoding,suffix in ENCODINGS:
+            if os.path.exists(target + suffix):
+                encodings.append(encoding)
+                continue
+            compressed = compress(data,encoding)
+            #tiny files such as the fonts only grow when compressed
+            if compressed is not None and len(compressed) < len(data):
+                write_atomic(target + suffix,compressed)
+                encodings.append(encoding)
+        files[path] = {'path':hashed_path,'encodings':encodings}
+        return hashed_path
+
+    for path in sorted(sources):
+        build(path)
+    version = hashlib.sha1(json.dumps(files,sort_keys=True).encode()).hexdigest()
+    manifest = {'version':version,'files':files}
+    write_atomic(os.path.join(build_folder,MANIFEST),json.dumps(manifest,indent=1,sort_keys=True).encode())
+    return manifest
+
+
+class StaticAssets:
+
+    def __init__(self,app=None):
+        #path in the static folder -> manifest entry
+        self.files = {}
+        #path of a hashed file in the static folder -> manifest entry
+        self.built = {}
+        #changes whenever a build changes any file, for cache keys of pages linking to them
+        self.version = ''
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self,app):
+        app.extensions['static_assets'] = self
+        self.build_folder = os.path.join(app.static_folder,BUILD_DIR)
+        if app.config.get('STATIC_ASSETS_ENABLED',True):
+            self.load(os.path.join(self.build_folder,MANIFEST))
+        app.url_defaults(self._hashed_url)
+        app.view_functions['static'] = self.send_static_file
+
+    '''
+    Reads a manifest written by build_assets, if there is one.
+    '''
+    def load(self,manifest_path):
+        try:
+            with open(manifest_path,'rb') as reader:
+                manifest = json.load(reader)
+        except FileNotFoundError:
+            return
+        self.files = manifest['files']
+        self.built = {f"{BUILD_DIR}/{entry['path']}":entry for entry in self.files.values()}
+        self.version = manifest['version']
+
+    def _hashed_url(self,endpoint,values):
+        if endpoint == 'static' and self.files:
+            entry = self.files.get(values.get('filename'))
+            if entry is not None:
+                values['filename'] = f"{BUILD_DIR}/{entry['path']}"
+
+    '''
+    :returns The most preferred of the encodings the request accepts or None for the file as is.
+    '''
+    def choose_encoding(self,encodings):
+        for encoding,suffix in ENCODINGS:
+            if encoding in encodings and request.accept_encodings[encoding]:
+                return encoding
+        return None
+
+    '''
+    The static view, sending built files in the best accepted encoding and other
+    files the way flask does.
+    '''
+    def send_static_file(self,filename):
+        entry = self.built.get(filename)
+        if entry is None:
+            return current_app.send_static_file(filename)
+        encoding = self.choose_encoding(entry['encodings'])
+        path = entry['path'] + dict(ENCODINGS)[encoding] if encoding else entry['path']
+        mimetype = mimetypes.guess_type(entry['path'])[0] or 'application/octet-stream'
+        response = send_from_directory(self.build_folder,path,mimetype=mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        return response
@@ -0,0 +1,400 @@
+import numpy as np
+from rom_analysis import DECODE_TABLE,INSTRUCTION_IDS
+from chip8 import (CHIP_8_FONT,SUPER_CHIP_FONT,CHIP_8_FONT_SIZE,SUPER_CHIP_FONT_SIZE,PROGRAM_START,MEMORY_SIZE,
+                   STACK_SIZE,SUPER_HEIGHT,RAM_WIDTH_BYTES,SMOKE_TEST_CYCLES,SmokeTestResult,encode_png)
+
+'''
+Vectorized chip 8 interpreter that runs many roms in lockstep.
+
+Machine state is held as arrays with one row per machine, so a tick fetches and decodes
+the next opcode of every running machine at once and executes each kind of instruction
+for all machines that share it in a single numpy operation.  Behaviour matches chip8.py,
+except that random numbers come from numpy's generator.
+'''
+
+#machine status
+RUNNING = 0
+HALTED = 1
+IDLE = 2
+WAITING = 3
+ERROR = 4
+
+_DECODE = np.frombuffer(DECODE_TABLE,dtype=np.uint8)
+_SPRITE_ROWS = np.arange(16)
+_REGISTERS = np.arange(16)
+_WINDOW_BYTES = np.arange(3)
+_WINDOW_SHIFTS = np.array([16,8,0])
+
+
+class BatchChip8:
+
+    def __init__(self,roms,seed=0):
+        count = len(roms)
+        self.count = count
+        self.memory = np.zeros((count,MEMORY_SIZE),dtype=np.uint8)
+        self.memory[:,:CHIP_8_FONT_SIZE] = np.frombuffer(CHIP_8_FONT[:CHIP_8_FONT_SIZE],dtype=np.uint8)
+        self.memory[:,CHIP_8_FONT_SIZE:CHIP_8_FONT_SIZE + SUPER_CHIP_FONT_SIZE] = np.frombuffer(SUPER_CHIP_FONT[:SUPER_CHIP_FONT_SIZE],dtype=np.uint8)
+        for machine,rom in enumerate(roms):
+            rom = rom[:MEMORY_SIZE - PROGRAM_START]
+            self.memory[machine,PROGRAM_START:PROGRAM_START + len(rom)] = np.frombuffer(rom,dtype=np.uint8)
+        self.v = np.zeros((count,16),dtype=np.uint8)
+        self.rpl = np.zeros((count,16),dtype=np.uint8)
+        self.keys = np.zeros((count,16),dtype=bool)
+        self.i = np.zeros(count,dtype=np.int32)
+        self.pc = np.full(count,PROGRAM_START,dtype=np.int32)
+        self.sp = np.zeros(count,dtype=np.int32)
+        self.stack = np.zeros((count,STACK_SIZE),dtype=np.int32)
+        self.dt = np.zeros(count,dtype=np.int32)
+        self.st = np.zeros(count,dtype=np.int32)
+        #packed bitplanes, 16 bytes per row like chip8.py
+        self.vram = np.zeros((count,SUPER_HEIGHT,RAM_WIDTH_BYTES),dtype=np.uint8)
+        self.extended = np.zeros(count,dtype=bool)
+        self.status = np.zeros(count,dtype=np.int8)
+        self.errors = [None] * count
+        self.cycles = np.zeros(count,dtype=np.int64)
+        self.draw_count = np.zeros(count,dtype=np.int64)
+        #pngs of the first frame that drew anything and left pixels set, like Chip8.thumbnail
+        self.thumbnails = [None] * count
+        self.captured = np.zeros(count,dtype=bool)
+        self.frame_draw_count = np.zeros(count,dtype=np.int64)
+        self.random = np.random.default_rng(seed)
+        handlers = {
+            'INVALID':self._invalid,'CLS':self._clear,'RET':self._return,'SYS addr':self._system,'JP addr':self._jump,'CALL addr':self._call,
+            'SE Vx, byte':self._skip_equal_value,'SNE Vx, byte':self._skip_not_equal_value,
+            'SE Vx, Vy':self._skip_equal_registers,'SNE Vx, Vy':self._skip_not_equal_registers,
+            'LD Vx, byte':self._load_byte,'ADD Vx, byte':self._add_byte,
+            'LD Vx, Vy':self._alu_load,'OR Vx, Vy':self._alu_or,'AND Vx, Vy':self._alu_and,'XOR Vx, Vy':self._alu_xor,
+            'ADD Vx, Vy':self._alu_add,'SUB Vx, Vy':self._alu_sub,'SHR Vx':self._alu_shift_right,
+            'SUBN Vx, Vy':self._alu_sub_negative,'SHL Vx':self._alu_shift_left,
+            'LD I, addr':self._load_i,'JP V0, addr':self._jump_v0,'RND Vx, byte':self._random,
+            'DRW Vx, Vy, nibble':self._draw,'DRW Vx, Vy, 0':self._draw,
+            'SKP Vx':self._skip_key_pressed,'SKNP Vx':self._skip_key_not_pressed,
+            'LD Vx, DT':self._load_delay_timer,'LD Vx, K':self._wait_key,'LD DT, Vx':self._set_delay_timer,
+            'LD ST, Vx':self._set_sound_timer,'ADD I, Vx':self._add_i,'LD F, Vx':self._font,'LD HF, Vx':self._super_font,
+            'LD B, Vx':self._bcd,'LD [I], Vx':self._store_registers,'LD Vx, [I]':self._load_registers,
+            'LD R, Vx':self._store_rpl,'LD Vx, R':self._load_rpl,
+            'SCD nibble':self._scroll_down,'SCR':self._scroll_right,'SCL':self._scroll_left,
+            'EXIT':self._exit,'LOW':self._low,'HIGH':self._high,
+        }
+        #dispatch table indexed by the instruction ids of rom_analysis.DECODE_TABLE
+        self._dispatch = [None] * len(INSTRUCTION_IDS)
+        for mnemonic,handler in handlers.items():
+            self._dispatch[INSTRUCTION_IDS[mnemonic]] = handler
+
+    '''
+    Executes one instruction on every running machine.
+    :returns False once no machine is running.
+    '''
+    def step(self):
+        active = np.flatnonzero(self.status == RUNNING)
+        if not active.size:
+            return False
+        pc = self.pc[active]
+        opcodes = self.memory[active,pc].astype(np.int32) << 8 | self.memory[active,(pc + 1) & 0xFFF]
+        self.pc[active] = (pc + 2) & 0xFFF
+        self.cycles[active] += 1
+        #group the machines by instruction so each handler runs once per tick
+        ids = _DECODE[opcodes]
+        order = np.argsort(ids,kind='stable')
+        ids = ids[order]
+        active = active[order]
+        opcodes = opcodes[order]
+        bounds = np.flatnonzero(ids[1:] != ids[:-1]) + 1
+        dispatch = self._dispatch
+        for start,end in zip(np.concatenate(([0],bounds)).tolist(),np.concatenate((bounds,[ids.size])).tolist()):
+            dispatch[ids[start]](active[start:end],opcodes[start:end])
+        return True
+
+    '''
+    Executes up to the given number of ticks, decrementing the timers every
+    cycles_per_frame ticks.  Machines stop early once they halt, idle or wait for a key.
+    '''
+    def run(self,cycles,cycles_per_frame=16):
+        for cycle in range(1,cycles + 1):
+            if not self.step():
+                break
+            if cycle % cycles_per_frame == 0:
+                self._end_frame()
+                np.maximum(self.dt - 1,0,out=self.dt)
+                np.maximum(self.st - 1,0,out=self.st)
+        self._end_frame()
+
+    '''
+    Captures the thumbnails of machines at the end of the first frame that drew anything
+    and left pixels set, see Chip8._end_frame.
+    '''
+    def _end_frame(self):
+        machines = np.flatnonzero(~self.captured & (self.draw_count != self.frame_draw_count))
+        if machines.size:
+            machines = machines[self.vram[machines].any(axis=(1,2))]
+            for machine in machines.tolist():
+                width,height = (128,64) if self.extended[machine] else (64,32)
+                self.thumbnails[machine] = encode_png(self.vram[machine].tobytes(),width,height)
+            self.captured[machines] = True
+        self.frame_draw_count[:] = self.draw_count
+
+    def _fail(self,machines,opcodes,message):
+        self.status[machines] = ERROR
+        for machine,opcode in zip(machines.tolist(),opcodes.tolist()):
+            address = (int(self.pc[machine]) - 2) & 0xFFF
+            self.errors[machine] = f"{message.format(opcode=opcode)} at address {hex(address)}."
+
+    def _skip_where(self,machines,condition):
+        skipped = machines[condition]
+        self.pc[skipped] = (self.pc[skipped] + 2) & 0xFFF
+
+    def _invalid(self,machines,opcodes):
+        self._fail(machines,opcodes,"Invalid instruction {opcode:04x}")
+
+    #SYS calls into machine code are ignored, as the player does
+    def _system(self,machines,opcodes):
+        pass
+
+    def _clear(self,machines,opcodes):
+        self.vram[machines] = 0
+
+    def _return(self,machines,opcodes):
+        empty = self.sp[machines] == 0
+        self._fail(machines[empty],opcodes[empty],"Return with an empty stack")
+        machines = machines[~empty]
+        self.sp[machines] -= 1
+        self.pc[machines] = self.stack[machines,self.sp[machines]]
+
+    def _jump(self,machines,opcodes):
+        address = opcodes & 0xFFF
+        self.status[machines[address == (self.pc[machines] - 2) & 0xFFF]] = IDLE
+        self.pc[machines] = address
+
+    def _call(self,machines,opcodes):
+        full = self.sp[machines] == STACK_SIZE
+        self._fail(machines[full],opcodes[full],"Call stack overflow")
+        machines,opcodes = machines[~full],opcodes[~full]
+        self.stack[machines,self.sp[machines]] = self.pc[machines]
+        self.sp[machines] += 1
+        self.pc[machines] = opcodes & 0xFFF
+
+    def _skip_equal_value(self,machines,opcodes):
+        self._skip_where(machines,self.v[machines,opcodes >> 8 & 0xF] == opcodes & 0xFF)
+
+    def _skip_not_equal_value(self,machines,opcodes):
+        self._skip_where(machines,self.v[machines,opcodes >> 8 & 0xF] != opcodes & 0xFF)
+
+    def _skip_equal_registers(self,machines,opcodes):
+        self._skip_where(machines,self.v[machines,opcodes >> 8 & 0xF] == self.v[machines,opcodes >> 4 & 0xF])
+
+    def _skip_not_equal_registers(self,machines,opcodes):
+        self._skip_where(machines,self.v[machines,opcodes >> 8 & 0xF] != self.v[machines,opcodes >> 4 & 0xF])
+
+    def _load_byte(self,machines,opcodes):
+        self.v[machines,opcodes >> 8 & 0xF] = opcodes & 0xFF
+
+    def _add_byte(self,machines,opcodes):
+        x = opcodes >> 8 & 0xF
+        self.v[machines,x] = (self.v[machines,x] + (opcodes & 0xFF)) & 0xFF
+
+    def _registers(self,machines,opcodes):
+        x = opcodes >> 8 & 0xF
+        y = opcodes >> 4 & 0xF
+        return x,self.v[machines,x].astype(np.int32),self.v[machines,y].astype(np.int32)
+
+    def _alu_load(self,machines,opcodes):
+        x,vx,vy = self._registers(machines,opcodes)
+        self.v[machines,x] = vy
+
+    def _alu_or(self,machines,opcodes):
+        x,vx,vy = self._registers(machines,opcodes)
+        self.v[machines,x] = vx | vy
+
+    def _alu_and(self,machines,opcodes):
+        x,vx,vy = self._registers(machines,opcodes)
+        self.v[machines,x] = vx & vy
+
+    def _alu_xor(self,machines,opcodes):
+        x,vx,vy = self._registers(machines,opcodes)
+        self.v[machines,x] = vx ^ vy
+
+    def _alu_add(self,machines,opcodes):
+        x,vx,vy = self._registers(machines,opcodes)
+        self.v[machines,x] = (vx + vy) & 0xFF
+        self.v[machines,0xF] = vx + vy > 0xFF
+
+    def _alu_sub(self,machines,opcodes):
+        x,vx,vy = self._registers(machines,opcodes)
+        self.v[machines,x] = (vx - vy) & 0xFF
+        self.v[machines,0xF] = vx >= vy
+
+    def _alu_shift_right(self,machines,opcodes):
+        x,vx,vy = self._registers(machines,opcodes)
+        self.v[machines,x] = vx >> 1
+        self.v[machines,0xF] = vx & 1
+
+    def _alu_sub_negative(self,machines,opcodes):
+        x,vx,vy = self._registers(machines,opcodes)
+        self.v[machines,x] = (vy - vx) & 0xFF
+        self.v[machines,0xF] = vy >= vx
+
+    def _alu_shift_left(self,machines,opcodes):
+        x,vx,vy = self._registers(machines,opcodes)
+        self.v[machines,x] = (vx << 1) & 0xFF
+        self.v[machines,0xF] = vx >> 7
+
+    def _load_i(self,machines,opcodes):
+        self.i[machines] = opcodes & 0xFFF
+
+    def _jump_v0(self,machines,opcodes):
+        self.pc[machines] = ((opcodes & 0xFFF) + self.v[machines,0]) & 0xFFF
+
+    def _random(self,machines,opcodes):
+        values = self.random.integers(0,256,size=machines.size)
+        self.v[machines,opcodes >> 8 & 0xF] = values & opcodes & 0xFF
+
+    '''
+    XORs the sprites of every drawing machine into vram at once.  Sprite rows are widened to
+    16 bits and shifted into a 24 bit window covering the three screen bytes a row can touch,
+    then all rows are gathered, XORed and scattered back with a single index per machine.
+    Rows past the sprite height are zero so XORing them changes nothing.
+    '''
+    def _draw(self,machines,opcodes):
+        extended = self.extended[machines]
+        width = np.where(extended,128,64)
+        height = np.where(extended,64,32)
+        x = self.v[machines,opcodes >> 8 & 0xF].astype(np.int32) % width
+        y = self.v[machines,opcodes >> 4 & 0xF].astype(np.int32)
+        shift = (8 - (x & 7))[:,None]
+        large = ((opcodes & 0xF) == 0) & extended
+        rows = np.where(large,16,opcodes & 0xF)[:,None]
+        row = _SPRITE_ROWS[None,:]
+        address = self.i[machines][:,None]
+        memory_rows = machines[:,None]
+        high_address = np.where(large[:,None],address + row * 2,address + row) & 0xFFF
+        data = self.memory[memory_rows,high_address].astype(np.int32) << 8
+        data |= np.where(large[:,None],self.memory[memory_rows,(address + row * 2 + 1) & 0xFFF],0)
+        data = np.where(row < rows,data,0) << shift
+        values = (data[:,:,None] >> _WINDOW_SHIFTS & 0xFF).astype(np.uint8)
+        screen_rows = ((y[:,None] + row) % height[:,None])[:,:,None]
+        screen_columns = (((x >> 3)[:,None] + _WINDOW_BYTES) % (width >> 3)[:,None])[:,None,:]
+        index = (machines[:,None,None],screen_rows,screen_columns)
+        old = self.vram[index]
+        self.v[machines,0xF] = (old & values).any(axis=(1,2))
+        self.vram[index] = old ^ values
+        self.draw_count[machines] += 1
+
+    def _scroll_down(self,machines,opcodes):
+        for machine,rows in zip(machines.tolist(),(opcodes & 0xF).tolist()):
+            height = 64 if self.extended[machine] else 32
+            width_bytes = 16 if self.extended[machine] else 8
+            screen = self.vram[machine,:height,:width_bytes]
+            screen[rows:] = screen[:height - rows].copy()
+            screen[:rows] = 0
+
+    def _scroll_horizontal(self,machines,pixels):
+        for machine in machines.tolist():
+            height = 64 if self.extended[machine] else 32
+            width_bytes = 16 if self.extended[machine] else 8
+            bits = np.unpackbits(self.vram[machine,:height,:width_bytes],axis=1)
+            shifted = np.zeros_like(bits)
+            if pixels > 0:
+                shifted[:,pixels:] = bits[:,:-pixels]
+            else:
+                shifted[:,:pixels] = bits[:,-pixels:]
+            self.vram[machine,:height,:width_bytes] = np.packbits(shifted,axis=1)
+
+    def _scroll_right(self,machines,opcodes):
+        self._scroll_horizontal(machines,4)
+
+    def _scroll_left(self,machines,opcodes):
+        self._scroll_horizontal(machines,-4)
+
+    def _exit(self,machines,opcodes):
+        self.status[machines] = HALTED
+
+    def _low(self,machines,opcodes):
+        self.extended[machines] = False
+
+    def _high(self,machines,opcodes):
+        self.extended[machines] = True
+
+    def _skip_key_pressed(self,machines,opcodes):
+        self._skip_where(machines,self.keys[machines,self.v[machines,opcodes >> 8 & 0xF] & 0xF])
+
+    def _skip_key_not_pressed(self,machines,opcodes):
+        self._skip_where(machines,~self.keys[machines,self.v[machines,opcodes >> 8 & 0xF] & 0xF])
+
+    def _load_delay_timer(self,machines,opcodes):
+        self.v[machines,opcodes >> 8 & 0xF] = self.dt[machines]
+
+    def _wait_key(self,machines,opcodes):
+        keys = self.keys[machines]
+        pressed = keys.any(axis=1)
+        self.v[machines[pressed],(opcodes >> 8 & 0xF)[pressed]] = keys[pressed].argmax(axis=1)
+        #repeat this instruction until a key is pressed
+        waiting = machines[~pressed]
+        self.pc[waiting] = (self.pc[waiting] - 2) & 0xFFF
+        self.status[waiting] = WAITING
+
+    def _set_delay_timer(self,machines,opcodes):
+        self.dt[machines] = self.v[machines,opcodes >> 8 & 0xF]
+
+    def _set_sound_timer(self,machines,opcodes):
+        self.st[machines] = self.v[machines,opcodes >> 8 & 0xF]
+
+    def _add_i(self,machines,opcodes):
+        self.i[machines] = (self.i[machines] + self.v[machines,opcodes >> 8 & 0xF]) & 0xFFFF
+
+    def _font(self,machines,opcodes):
+        self.i[machines] = (self.v[machines,opcodes >> 8 & 0xF] & 0xF).astype(np.int32) * 5
+
+    def _super_font(self,machines,opcodes):
+        self.i[machines] = CHIP_8_FONT_SIZE + (self.v[machines,opcodes >> 8 & 0xF] & 0xF).astype(np.int32) * 10
+
+    def _bcd(self,machines,opcodes):
+        value = self.v[machines,opcodes >> 8 & 0xF]
+        address = self.i[machines]
+        self.memory[machines,address & 0xFFF] = value // 100
+        self.memory[machines,(address + 1) & 0xFFF] = value // 10 % 10
+        self.memory[machines,(address + 2) & 0xFFF] = value % 10
+
+    def _register_span(self,machines,opcodes,count=16):
+        selected = _REGISTERS[None,:count] <= (opcodes >> 8 & (count - 1))[:,None]
+        address = (self.i[machines][:,None] + _REGISTERS[None,:count]) & 0xFFF
+        return selected,address
+
+    def _store_registers(self,machines,opcodes):
+        selected,address = self._register_span(machines,opcodes)
+        rows = machines[:,None]
+        self.memory[rows,address] = np.where(selected,self.v[machines],self.memory[rows,address])
+
+    def _load_registers(self,machines,opcodes):
+        selected,address = self._register_span(machines,opcodes)
+        self.v[machines] = np.where(selected,self.memory[machines[:,None],address],self.v[machines])
+
+    def _store_rpl(self,machines,opcodes):
+        selected,_ = self._register_span(machines,opcodes,8)
+        self.rpl[machines,:8] = np.where(selected,self.v[machines,:8],self.rpl[machines,:8])
+
+    def _load_rpl(self,machines,opcodes):
+        selected,_ = self._register_span(machines,opcodes,8)
+        self.v[machines,:8] = np.where(selected,self.rpl[machines,:8],self.v[machines,:8])
+
+    '''
+    :returns SmokeTestResult for every machine, in the order the roms were given.
+    '''
+    def results(self):
+        results = []
+        for machine in range(self.count):
+            error = self.errors[machine]
+            draw_count = int(self.draw_count[machine])
+            if error is None and self.status[machine] == IDLE and not draw_count:
+                error = "The rom loops forever without drawing anything."
+            results.append(SmokeTestResult(int(self.cycles[machine]),draw_count,error,self.thumbnails[machine]))
+        return results
+
+
+'''
+Smoke tests many roms at once, see chip8.smoke_test.
+:returns List of SmokeTestResult in the order of the roms.
+'''
+def batch_smoke_test(roms,cycles=SMOKE_TEST_CYCLES,speed=1000):
+    machines = BatchChip8(roms)
+    machines.run(cycles,max(speed // 60,1))
+    return machines.results()
@@ -0,0 +1,76 @@
+'''
+Regression benchmark for the developer dashboard and bulk delete.
+
+Seeds thousands of developers and games, then checks that listing one
+developer's games and deleting a batch of them issue a bounded number of
+queries and finish within a latency budget, regardless of catalogue size.
+
+Run from the repository root:
+    python -m benchmarks.developer_dashboard [--users 2000] [--games 10000]
+'''
+import argparse
+import sys
+from benchmarks.harness import create_app,seed_catalogue,login,QueryCounter,timer
+
+#queries for loading the session user, their roles and one page of games
+MAX_DASHBOARD_QUERIES = 6
+MAX_DASHBOARD_SECONDS = 0.25
+#fixed overhead plus at most a few statements per deleted game
+MAX_DELETE_FIXED_QUERIES = 6
+MAX_DELETE_QUERIES_PER_GAME = 3
+MAX_DELETE_SECONDS = 1.0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users',type=int,default=2000)
+    parser.add_argument('--games',type=int,default=10000)
+    args = parser.parse_args(argv)
+
+    app = create_app()
+    emails = seed_catalogue(app,args.users,args.games)
+    from models import db,Game,User
+
+    client = app.test_client()
+    login(client,emails[0])
+    #warm up lazy setup such as template compilation
+    client.get('/game/mygames')
+
+    failures = []
+    with app.app_context():
+        engine = db.engine
+        user_id = User.query.filter_by(email=emails[0]).one().id
+        game_ids = [row.id for row in db.session.query(Game.id).filter(Game.user_id == user_id)]
+
+    with QueryCounter(engine) as counter,timer() as elapsed:
+        response = client.get('/game/mygames')
+    print(f"dashboard: {counter.count} queries, {elapsed['seconds']*1000:.1f} ms")
+    if response.status_code != 200:
+        failures.append(f"dashboard returned {response.status_code}")
+    if counter.count > MAX_DASHBOARD_QUERIES:
+        failures.append(f"dashboard ran {counter.count} queries, expected at most {MAX_DASHBOARD_QUERIES}")
+    if elapsed['seconds'] > MAX_DASHBOARD_SECONDS:
+        failures.append(f"dashboard took {elapsed['seconds']:.3f}s, expected at most {MAX_DASHBOARD_SECONDS}s")
+
+    with QueryCounter(engine) as counter,timer() as elapsed:
+        response = client.post('/game/delete',data={'game_ids':game_ids})
+    max_queries = MAX_DELETE_FIXED_QUERIES + MAX_DELETE_QUERIES_PER_GAME * len(game_ids)
+    print(f"bulk delete of {len(game_ids)} games: {counter.count} queries, {elapsed['seconds']*1000:.1f} ms")
+    if counter.count > max_queries:
+        failures.append(f"bulk delete ran {counter.count} queries, expected at most {max_queries}")
+    if elapsed['seconds'] > MAX_DELETE_SECONDS:
+        failures.append(f"bulk delete took {elapsed['seconds']:.3f}s, expected at most {MAX_DELETE_SECONDS}s")
+
+    with app.app_context():
+        remaining = Game.query.filter(Game.user_id == user_id).count()
+        others = Game.query.count()
+    if remaining:
+        failures.append(f"bulk delete left {remaining} games behind")
+    if others != args.games - len(game_ids):
+        failures.append(f"bulk delete removed games owned by other developers")
+
+    for failure in failures:
+        print(f"FAIL: {failure}",file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+from contextlib import contextmanager
+from datetime import datetime,timedelta
+import hashlib
+import os
+import tempfile
+import time
+
+'''
+Shared setup for benchmarks.  create_app hands a throwaway configuration to the
+application factory, so call it before using anything the factory sets up.
+'''
+
+BENCH_PASSWORD = 'password'
+
+CONFIG_TEMPLATE = """
+SECRET_KEY = 'benchmark'
+SQLALCHEMY_DATABASE_URI = {database_uri!r}
+SQLALCHEMY_TRACK_MODIFICATIONS = False
+UPLOAD_FOLDER = {upload_folder!r}
+POSTS_PER_PAGE = 20
+WTF_CSRF_ENABLED = False
+SECURITY_PASSWORD_HASH = 'plaintext'
+SECURITY_PASSWORD_SALT = 'benchmark'
+SECURITY_EMAIL_VALIDATOR_ARGS = {{'check_deliverability':False}}
+"""
+
+'''
+Writes a throwaway configuration using a sqlite database in a temporary directory.
+
+:param database_uri Optional database to use instead of a temporary sqlite file.
+:param replica Simulate a read replica with a second sqlite file, synced by seed_catalogue.
+:param config Extra configuration values, such as PAGE_CACHE_SIZE=0.
+:returns Path of the settings file.
+'''
+def write_config(database_uri=None,replica=False,**config):
+    workdir = tempfile.mkdtemp(prefix='chip8_bench_')
+    upload_folder = os.path.join(workdir,'uploads')
+    os.mkdir(upload_folder)
+    if database_uri is None:
+        database_uri = 'sqlite:///' + os.path.join(workdir,'bench.db')
+    if replica:
+        config['DATABASE_REPLICA_URI'] = 'sqlite:///' + os.path.join(workdir,'replica.db')
+    config_path = os.path.join(workdir,'config.cfg')
+    with open(config_path,'w') as writer:
+        writer.write(CONFIG_TEMPLATE.format(database_uri=database_uri,upload_folder=upload_folder))
+        for key,value in config.items():
+            writer.write(f"{key} = {value!r}\n")
+    return config_path
+
+'''
+Creates the application with a throwaway configuration from write_config and creates the tables.
+Takes the arguments of write_config.
+
+:returns The flask application.
+'''
+def create_app(database_uri=None,replica=False,**config):
+    from app import create_app as create_application
+    from models import db
+    app = create_application(write_config(database_uri,replica,**config))
+    with app.app_context():
+        db.create_all()
+    return app
+
+'''
+Bulk inserts developers and games without going through the file save events.
+Games are spread round robin across developers with one minute between creation dates.
+A simulated sqlite replica is synced once seeding is done.
+
+:param rom Optional rom bytes stored once and shared by every game, so roms can be served.
+:returns List of developer emails.
+'''
+def seed_catalogue(app,num_users,num_games,batch_size=1000,rom=None):
+    from app import user_datastore
+    from models import db,User,Game,ControlConfig,encode_key_codes,newline_to_p
+    from storage import current_storage
+    emails = []
+    with app.app_context():
+        role = user_datastore.find_or_create_role(name='Game Developer',role='game_dev')
+        db.session.commit()
+        for n in range(num_users):
+            email = f"dev{n}@example.com"
+            user = user_datastore.create_user(name=f"dev{n}",email=email,password=BENCH_PASSWORD)
+            user_datastore.add_role_to_user(user,role)
+            emails.append(email)
+            if n % batch_size == batch_size - 1:
+                db.session.commit()
+        db.session.commit()
+        user_ids = [row.id for row in db.session.query(User.id).order_by(User.id)]
+
+        filename = None
+        if rom is not None:
+            filename = hashlib.sha256(rom).hexdigest()
+            current_storage().write(Game(filename=filename).key,rom)
+        start = datetime(2021,1,1)
+        key_codes = encode_key_codes({49:'1',50:'2',51:'3',52:'c'})
+        for batch_start in range(0,num_games,batch_size):
+            games = []
+            for n in range(batch_start,min(batch_start + batch_size,num_games)):
+                description = f"Description for game {n}.\nSecond line."
+                instructions = f"Instructions for game {n}."
+                games.append({
+                    'user_id':user_ids[n % len(user_ids)],
+                    'title':f"Game {n}",
+                    'description':description,
+                    'description_html':str(newline_to_p(description)),
+                    'instructions':instructions,
+                    'instructions_html':str(newline_to_p(instructions)),
+                    'filename':filename or f"{n:064x}",
+                    'created_on':start + timedelta(minutes=n),
+                })
+            db.session.bulk_insert_mappings(Game,games)
+            db.session.commit()
+        game_ids = [row.id for row in db.session.query(Game.id)]
+        db.session.bulk_insert_mappings(ControlConfig,[{'game_id':id,'emulator_speed':1000,'key_codes':key_codes} for id in game_ids])
+        db.session.commit()
+        if db.has_replica():
+            db.sync_sqlite_replica()
+    return emails
+
+'''
+Logs a test client in through the flask-security login view.
+'''
+def login(client,email,password=BENCH_PASSWORD):
+    response = client.post('/login',data={'email':email,'password':password})
+    if response.status_code not in (200,302):
+        raise RuntimeError(f"Login failed for {email}: {response.status_code}")
+
+'''
+Counts statements sent to the database while the context is open.
+'''
+class QueryCounter:
+
+    def __init__(self,engine):
+        self.engine = engine
+        self.count = 0
+
+    def _before_cursor_execute(self,*args):
+        self.count += 1
+
+    def __enter__(self):
+        from sqlalchemy import event
+        event.listen(self.engine,'before_cursor_execute',self._before_cursor_execute)
+        return self
+
+    def __exit__(self,*exc_info):
+        from sqlalchemy import event
+        event.remove(self.engine,'before_cursor_execute',self._before_cursor_execute)
+
+'''
+Yields a dictionary that receives the elapsed seconds as 'seconds' on exit.
+'''
+@contextmanager
+def timer():
+    result = {}
+    start = time.perf_counter()
+    yield result
+    result['seconds'] = time.perf_counter() - start
@@ -0,0 +1,105 @@
+'''
+Cold start benchmark for web workers.
+
+Starts fresh interpreters against a seeded catalogue and times importing the
+application, running the application factory and serving the first requests, the
+work a new gunicorn worker does before it is useful.  Fails when a cold start goes
+over budget or when modules only needed by the command line or by developers, such
+as alembic and the upload forms, are loaded to serve visitors.
+
+Run from the repository root:
+    python -m benchmarks.startup [--runs 10]
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from benchmarks.harness import write_config,seed_catalogue
+
+MAX_STARTUP_SECONDS = 1.5
+MAX_FIRST_REQUEST_SECONDS = 0.25
+#modules the factory defers, which visitors must not pull in
+DEFERRED_MODULES = ('flask_migrate','alembic','forms','rom_analysis')
+#paths requested by every started worker, the first one pays for lazy setup
+PATHS = ('/games','/game/1','/game/play/1')
+
+WORKER = """
+import json,sys,time
+start = time.perf_counter()
+import app as application
+imported = time.perf_counter()
+app = application.create_app()
+created = time.perf_counter()
+client = app.test_client()
+statuses = []
+for path in json.loads(sys.argv[1]):
+    statuses.append(client.get(path).status_code)
+    if len(statuses) == 1:
+        first_request = time.perf_counter()
+served = time.perf_counter()
+print(json.dumps({
+    'import':imported - start,
+    'create_app':created - imported,
+    'first_request':first_request - created,
+    'requests':served - created,
+    'statuses':statuses,
+    'loaded':[name for name in json.loads(sys.argv[2]) if name in sys.modules],
+}))
+"""
+
+'''
+Starts one worker interpreter and returns its timings, with the wall clock time
+from launching the interpreter to its exit as 'total'.
+'''
+def start_worker(config_path):
+    env = dict(os.environ,CHIP8_ARCADE_SETTINGS=config_path)
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable,'-c',WORKER,json.dumps(PATHS),json.dumps(DEFERRED_MODULES)],
+                            env=env,capture_output=True,text=True,check=True).stdout
+    total = time.perf_counter() - start
+    result = json.loads(output.splitlines()[-1])
+    result['total'] = total
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs',type=int,default=10)
+    parser.add_argument('--games',type=int,default=100)
+    args = parser.parse_args(argv)
+
+    config_path = write_config()
+    from app import create_app
+    from models import db
+    app = create_app(config_path)
+    with app.app_context():
+        db.create_all()
+    seed_catalogue(app,10,args.games)
+
+    results = [start_worker(config_path) for _ in range(args.runs)]
+    failures = []
+    for phase in ('import','create_app','first_request','requests','total'):
+        timings = [result[phase] for result in results]
+        print(f"{phase}: median {statistics.median(timings)*1000:.1f} ms, max {max(timings)*1000:.1f} ms")
+
+    startup = statistics.median(result['import'] + result['create_app'] for result in results)
+    if startup > MAX_STARTUP_SECONDS:
+        failures.append(f"importing and creating the application took {startup:.3f}s, expected at most {MAX_STARTUP_SECONDS}s")
+    first_request = statistics.median(result['first_request'] for result in results)
+    if first_request > MAX_FIRST_REQUEST_SECONDS:
+        failures.append(f"the first request took {first_request:.3f}s, expected at most {MAX_FIRST_REQUEST_SECONDS}s")
+    statuses = {status for result in results for status in result['statuses']}
+    if statuses != {200}:
+        failures.append(f"workers answered with statuses {sorted(statuses)}")
+    loaded = sorted({name for result in results for name in result['loaded']})
+    if loaded:
+        failures.append(f"serving visitors loaded deferred modules {', '.join(loaded)}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}",file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,270 @@
+'''
+Latency and throughput benchmark for the hot paths of the web tier.
+
+Seeds a synthetic catalogue, then times list_games, game_profile, game_json,
+send_rom and game_bundle as anonymous visitors, and upload_new_game and delete_games as a logged
+in developer.  Requests go through the flask test client, or with --server through
+a local threaded WSGI server over real sockets.  Results are written as JSON so
+runs can be compared with --compare.
+
+Run from the repository root:
+    python -m benchmarks.web_tier [--users 1000] [--games 10000] [--output results.json]
+'''
+import argparse
+import io
+import json
+import platform
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from benchmarks.harness import create_app,seed_catalogue,login
+from pagination import encode_cursor
+
+#clears the screen, draws a digit and loops drawing it
+SAMPLE_ROM = bytes.fromhex('00e0600061056205f029d12571067001300412061214')
+
+READ_SCENARIOS = ('list_games','game_profile','game_json','send_rom','game_bundle')
+
+
+'''
+Nearest rank percentile of an ascending list.
+'''
+def percentile(values,fraction):
+    if not values:
+        return None
+    rank = max(int(round(fraction * len(values) + 0.5)) - 1,0)
+    return values[min(rank,len(values) - 1)]
+
+def summarize(latencies,statuses,elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests':len(latencies),
+        'p50_ms':percentile(latencies,0.50) * 1000,
+        'p99_ms':percentile(latencies,0.99) * 1000,
+        'mean_ms':sum(latencies) / len(latencies) * 1000,
+        'max_ms':latencies[-1] * 1000,
+        'throughput_rps':len(latencies) / elapsed,
+        'statuses':{str(status):statuses.count(status) for status in sorted(set(statuses))},
+    }
+
+
+'''
+Minimal http client over a real socket, matching the parts of the flask test
+client the benchmark uses.  Redirects are returned instead of followed.
+'''
+class ServerClient:
+
+    class _NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self,*args,**kwargs):
+            return None
+
+    def __init__(self,base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()),self._NoRedirect())
+
+    def open(self,request):
+        try:
+            with self.opener.open(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            error.read()
+            return error.code
+
+    def get(self,path,headers=None):
+        return self.open(urllib.request.Request(self.base_url + path,headers=headers or {}))
+
+    def post(self,path,data):
+        boundary = uuid.uuid4().hex
+        body = io.BytesIO()
+        for name,value in data.items():
+            values = value if isinstance(value,list) else [value]
+            for value in values:
+                body.write(f"--{boundary}\r\n".encode())
+                if isinstance(value,tuple):
+                    stream,filename = value
+                    body.write(f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'.encode())
+                    body.write(b'Content-Type: application/octet-stream\r\n\r\n' + stream.read() + b'\r\n')
+                else:
+                    body.write(f'Content-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+        body.write(f"--{boundary}--\r\n".encode())
+        headers = {'Content-Type':f"multipart/form-data; boundary={boundary}"}
+        return self.open(urllib.request.Request(self.base_url + path,data=body.getvalue(),headers=headers,method='POST'))
+
+
+'''
+Adapts the flask test client to return status codes like ServerClient.
+'''
+class TestClient:
+
+    def __init__(self,client):
+        self.client = client
+
+    def get(self,path,headers=None):
+        return self.client.get(path,headers=headers).status_code
+
+    def post(self,path,data):
+        return self.client.post(path,data=data,content_type='multipart/form-data').status_code
+
+
+def start_server(app):
+    from werkzeug.serving import make_server,WSGIRequestHandler
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self,*args,**kwargs):
+            pass
+    server = make_server('127.0.0.1',0,app,threaded=True,request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever,daemon=True)
+    thread.start()
+    return server,f"http://127.0.0.1:{server.server_port}"
+
+'''
+Sends the requests produced by make_request, one per item, timing each one.
+make_request receives a client and an item and returns the status code.
+'''
+def run_scenario(clients,items,make_request,concurrency):
+    def timed(index_item):
+        index,item = index_item
+        start = time.perf_counter()
+        status = make_request(clients[index % len(clients)],item)
+        return time.perf_counter() - start,status
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(timed,enumerate(items)))
+    else:
+        results = [timed(index_item) for index_item in enumerate(items)]
+    elapsed = time.perf_counter() - start
+    return summarize([latency for latency,_ in results],[status for _,status in results],elapsed)
+
+def upload_form(n):
+    #vary the rom so every upload stores a new blob
+    rom = SAMPLE_ROM + n.to_bytes(4,'big')
+    return {
+        'title':f"Benchmark upload {n}",
+        'description':"Uploaded by the benchmark.\nSecond line.",
+        'instructions':"Watch the digit.",
+        'emulator_speed':'1000',
+        'key_codes-0-hex_value':'a',
+        'key_codes-0-key_code':'65',
+        'game_rom':(io.BytesIO(rom),f"upload{n}.ch8"),
+    }
+
+def compare(results,previous):
+    for name,result in results['scenarios'].items():
+        before = previous.get('scenarios',{}).get(name)
+        if before is None:
+            continue
+        changes = []
+        for metric in ('p50_ms','p99_ms','throughput_rps'):
+            if before[metric]:
+                changes.append(f"{metric} {(result[metric] - before[metric]) / before[metric] * 100:+.1f}%")
+        print(f"{name}: {', '.join(changes)}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users',type=int,default=1000)
+    parser.add_argument('--games',type=int,default=10000)
+    parser.add_argument('--requests',type=int,default=500,help='Requests per read scenario.')
+    parser.add_argument('--writes',type=int,default=100,help='Requests per write scenario.')
+    parser.add_argument('--server',action='store_true',help='Send requests over sockets to a local WSGI server.')
+    parser.add_argument('--concurrency',type=int,default=1,help='Parallel clients, only used with --server.')
+    parser.add_argument('--database-uri',help='Database to seed instead of a temporary sqlite file.')
+    parser.add_argument('--replica',action='store_true',help='Serve reads from a second sqlite file simulating a replica.')
+    parser.add_argument('--page-cache-size',type=int,help='Overrides PAGE_CACHE_SIZE, 0 disables the page cache.')
+    parser.add_argument('--seed',type=int,default=0,help='Seed for choosing which games are requested.')
+    parser.add_argument('--output',help='File to write the results to as JSON.')
+    parser.add_argument('--compare',help='Results of an earlier run to print the change against.')
+    args = parser.parse_args(argv)
+
+    config = {}
+    if args.page_cache_size is not None:
+        config['PAGE_CACHE_SIZE'] = args.page_cache_size
+    app = create_app(args.database_uri,args.replica,**config)
+    emails = seed_catalogue(app,args.users,args.games,rom=SAMPLE_ROM)
+    from models import db,Game,User
+
+    concurrency = args.concurrency if args.server else 1
+    server = None
+    if args.server:
+        server,base_url = start_server(app)
+        make_client = lambda:ServerClient(base_url)
+    else:
+        make_client = lambda:TestClient(app.test_client())
+    anonymous = [make_client() for _ in range(concurrency)]
+    developer = make_client()
+    if args.server:
+        status = developer.post('/login',{'email':emails[0],'password':'password'})
+        if status not in (200,302):
+            raise RuntimeError(f"Login failed for {emails[0]}: {status}")
+    else:
+        login(developer.client,emails[0])
+
+    with app.app_context():
+        game_ids = [row.id for row in db.session.query(Game.id)]
+        developer_id = User.query.filter_by(email=emails[0]).one().id
+    randomizer = random.Random(args.seed)
+    picks = [randomizer.choice(game_ids) for _ in range(args.requests)]
+    cursors = [None] * args.requests
+    with app.app_context():
+        #every other listing starts after a random game, the rest show the first page
+        for n in range(0,args.requests,2):
+            game = Game.query.get(picks[n])
+            cursors[n] = encode_cursor(game.created_on,game.id,'next')
+
+    #warm up lazy setup such as template compilation
+    for client in anonymous:
+        client.get('/')
+    developer.get('/game/mygames')
+
+    scenarios = {}
+    requests = {
+        'list_games':(cursors,lambda client,cursor:client.get('/games' + (f"?cursor={cursor}" if cursor else ''))),
+        'game_profile':(picks,lambda client,id:client.get(f"/game/{id}")),
+        'game_json':(picks,lambda client,id:client.get(f"/game/config/{id}")),
+        'send_rom':(picks,lambda client,id:client.get(f"/game/rom/{id}")),
+        'game_bundle':(picks,lambda client,id:client.get(f"/game/bundle/{id}")),
+    }
+    for name in READ_SCENARIOS:
+        items,make_request = requests[name]
+        scenarios[name] = run_scenario(anonymous,items,make_request,concurrency)
+
+    #writes share one session, so they run one at a time
+    scenarios['upload_new_game'] = run_scenario([developer],range(args.writes),
+                                                lambda client,n:client.post('/game/new',upload_form(n)),1)
+    with app.app_context():
+        uploaded = [row.id for row in db.session.query(Game.id).filter(Game.user_id == developer_id,Game.title.like('Benchmark upload %'))]
+    scenarios['delete_games'] = run_scenario([developer],uploaded,
+                                             lambda client,id:client.post('/game/delete',{'game_ids':[id]}),1)
+    if server is not None:
+        server.shutdown()
+
+    results = {
+        'created_on':time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python':platform.python_version(),
+        'database':app.config['SQLALCHEMY_DATABASE_URI'].split(':',1)[0],
+        'mode':'server' if args.server else 'test_client',
+        'replica':args.replica,
+        'concurrency':concurrency,
+        'users':args.users,
+        'games':args.games,
+        'scenarios':scenarios,
+    }
+    for name,result in scenarios.items():
+        print(f"{name}: p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms, "
+              f"{result['throughput_rps']:.0f} req/s, statuses {result['statuses']}")
+    if args.output:
+        with open(args.output,'w') as writer:
+            json.dump(results,writer,indent=2)
+    if args.compare:
+        with open(args.compare) as reader:
+            compare(results,json.load(reader))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,330 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+from threading import Lock
+from models import Game,ControlConfig,FileStaging,encode_key_codes,decode_key_codes,newline_to_p
+from storage import current_storage,write_atomic
+from forms import validate_game_values
+import hashlib
+import json
+import os
+import re
+import time
+import zipfile
+
+'''
+Bulk import and export of games.
+
+A collection is either a directory, a zip archive or a manifest.jsonl file.  Manifests hold
+one game per line with the keys title, description, instructions, emulator_speed, key_config
+({hex_value:key_code}, as served to the emulator) and rom, the path of the rom relative to
+the manifest.  Directories and archives without a manifest are imported as bare roms, titled
+after their file names.  Export writes a directory or zip archive with a manifest that import
+reads back.
+'''
+
+MANIFEST = 'manifest.jsonl'
+
+#error describes why an item could not be read, such as a malformed manifest line
+ImportItem = namedtuple('ImportItem',['source','title','description','instructions','emulator_speed','key_config','rom','error'],
+                        defaults=(None,))
+BulkReport = namedtuple('BulkReport',['games','skipped','failed','rom_bytes','seconds'])
+
+def _manifest_items(lines,read_rom):
+    for number,line in enumerate(lines,1):
+        line = line.strip()
+        if not line:
+            continue
+        source = f"{MANIFEST} line {number}"
+        try:
+            entry = json.loads(line)
+            if not isinstance(entry,dict):
+                raise ValueError("Expected a json object.")
+            rom = read_rom(entry['rom'])
+        except (TypeError,ValueError) as e:
+            yield ImportItem(source,None,None,None,None,{},None,f"The line could not be parsed. {e}")
+            continue
+        except KeyError:
+            yield ImportItem(source,None,None,None,None,{},None,"The rom could not be found.")
+            continue
+        except OSError as e:
+            yield ImportItem(source,None,None,None,None,{},None,f"The rom could not be read. {e.strerror or e}")
+            continue
+        yield ImportItem(
+            source=source,
+            title=entry.get('title'),
+            description=entry.get('description'),
+            instructions=entry.get('instructions'),
+            emulator_speed=entry.get('emulator_speed'),
+            key_config=entry.get('key_config') or {},
+            rom=rom
+        )
+
+def _rom_item(name,rom):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    #keep to the characters titles may contain
+    title = ' '.join(re.sub(r"[^0-9a-zA-Z\.\?\!\,\']",' ',stem).split())
+    return ImportItem(name,title,f"Imported from {os.path.basename(name)}.","No instructions were provided.",None,{},rom)
+
+'''
+Reads the games of a collection one at a time.
+'''
+def read_import_items(source):
+    if os.path.isdir(source):
+        def read_rom(path):
+            with open(os.path.join(source,path),'rb') as reader:
+                return reader.read()
+        manifest = os.path.join(source,MANIFEST)
+        if os.path.exists(manifest):
+            with open(manifest) as lines:
+                yield from _manifest_items(lines,read_rom)
+        else:
+            for name in sorted(os.listdir(source)):
+                if os.path.isfile(os.path.join(source,name)):
+                    yield _rom_item(name,read_rom(name))
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            names = archive.namelist()
+            if MANIFEST in names:
+                with archive.open(MANIFEST) as manifest:
+                    lines = (line.decode('utf-8') for line in manifest)
+                    yield from _manifest_items(lines,archive.read)
+            else:
+                for name in sorted(names):
+                    if not name.endswith('/'):
+                        yield _rom_item(name,archive.read(name))
+    else:
+        directory = os.path.dirname(os.path.abspath(source))
+        def read_rom(path):
+            with open(os.path.join(directory,path),'rb') as reader:
+                return reader.read()
+        with open(source) as lines:
+            yield from _manifest_items(lines,read_rom)
+
+'''
+:returns The item with its emulator speed and key codes as integers.
+:raises ValueError or TypeError if they are not numbers.
+'''
+def _coerce_numbers(item):
+    speed = None if item.emulator_speed is None else int(item.emulator_speed)
+    key_config = {str(hex_value).lower():int(key_code) for hex_value,key_code in item.key_config.items()}
+    return item._replace(emulator_speed=speed,key_config=key_config)
+
+def _batches(items,size):
+    items = iter(items)
+    while True:
+        batch = list(islice(items,size))
+        if not batch:
+            return
+        yield batch
+
+'''
+Inserts the games of a batch with their control configurations and jobs, and commits.
+'''
+def _insert_batch(db,jobs,user,new_rows,filenames):
+    game_table = Game.__table__
+    now = datetime.now()
+    games = []
+    for item,analysis,filename in new_rows:
+        games.append({
+            'user_id':user.id,
+            'title':item.title.strip(),
+            'description':item.description,
+            'description_html':str(newline_to_p(item.description)),
+            'instructions':item.instructions,
+            'instructions_html':str(newline_to_p(item.instructions)),
+            'filename':filename,
+            'created_on':now,
+            'instruction_count':analysis.instruction_count,
+            'invalid_opcode_count':len(analysis.invalid_opcodes),
+            'schip_required':analysis.schip_required,
+            'suggested_speed':analysis.suggested_speed,
+            'has_thumbnail':False,
+        })
+    db.session.execute(game_table.insert(),games)
+    #new games hold the highest id for their title and rom
+    ids = {(row.title,row.filename):row.id for row in db.session.query(Game.id,Game.title,Game.filename)
+           .filter(Game.user_id == user.id,Game.filename.in_(filenames)).order_by(Game.id)}
+    configs = []
+    for item,analysis,filename in new_rows:
+        speed = item.emulator_speed if item.emulator_speed is not None else analysis.suggested_speed
+        key_mapping = {key_code:hex_value for hex_value,key_code in item.key_config.items()}
+        configs.append({
+            'game_id':ids[(item.title.strip(),filename)],
+            'emulator_speed':int(speed),
+            'key_codes':encode_key_codes(key_mapping),
+        })
+    db.session.execute(ControlConfig.__table__.insert(),configs)
+    game_ids = [config['game_id'] for config in configs]
+    jobs.enqueue_many('smoke_test_game',game_ids)
+    jobs.enqueue_many('index_game',game_ids)
+    db.session.commit()
+
+
+'''
+Imports a collection for a developer in batches, each inserted with executemany in its
+own transaction.  Roms are written to storage by a thread pool before the rows that
+reference them are inserted, so a row never points at a missing rom.  When a batch fails
+to commit, the roms it added are released again, so no unreferenced roms are left behind.
+
+Games already owned by the developer with the same title and rom are skipped, so an
+interrupted import picks up where it stopped when run again.
+
+:param jobs The jobs.JobQueue that smoke tests and indexes the new games.
+:param echo Callable receiving progress and error messages.
+:returns BulkReport where games counts the imported games.
+'''
+def import_games(db,jobs,source,user,batch_size=500,workers=8,echo=print):
+    start = time.perf_counter()
+    imported = skipped = failed = rom_bytes = 0
+    game_table = Game.__table__
+    #looked up here, the pool threads have no application context
+    storage = current_storage()
+    with ThreadPoolExecutor(workers) as pool:
+        for batch in _batches(read_import_items(source),batch_size):
+            rows = []
+            for item in batch:
+                if item.error is not None:
+                    failed += 1
+                    echo(f"Skipping {item.source}. {item.error}")
+                    continue
+                try:
+                    item = _coerce_numbers(item)
+                except (AttributeError,TypeError,ValueError):
+                    failed += 1
+                    echo(f"Skipping {item.source}. The emulator speed and key codes must be numbers.")
+                    continue
+                speed = item.emulator_speed
+                errors,analysis = validate_game_values(item.title,item.description,item.instructions,
+                                                       1000 if speed is None else speed,item.key_config,item.rom)
+                if errors:
+                    failed += 1
+                    messages = '; '.join(f"{field}: {' '.join(field_errors)}" for field,field_errors in errors.items())
+                    echo(f"Skipping {item.source}. {messages}")
+                    continue
+                rows.append((item,analysis,hashlib.sha256(item.rom).hexdigest()))
+            filenames = {filename for _,_,filename in rows}
+            existing = set(db.session.query(Game.title,Game.filename)
+                           .filter(Game.user_id == user.id,Game.filename.in_(filenames))) if filenames else set()
+            new_rows = []
+            for item,analysis,filename in rows:
+                key = (item.title.strip(),filename)
+                if key in existing:
+                    skipped += 1
+                    continue
+                existing.add(key)
+                new_rows.append((item,analysis,filename))
+            if not new_rows:
+                continue
+
+            writes = {Game(filename=filename).key:(filename,item.rom) for item,_,filename in new_rows}
+            def write(key):
+                if storage.exists(key):
+                    return False
+                storage.write(key,writes[key][1])
+                return True
+            created = [key for key,wrote in zip(writes,pool.map(write,writes)) if wrote]
+            try:
+                _insert_batch(db,jobs,user,new_rows,filenames)
+            except:
+                db.session.rollback()
+                staging = FileStaging()
+                for key in created:
+                    staging.release(game_table,writes[key][0],[key])
+                staging.flush(db.engine)
+                raise
+
+            imported += len(new_rows)
+            rom_bytes += sum(len(item.rom) for item,_,_ in new_rows)
+            elapsed = time.perf_counter() - start
+            echo(f"Imported {imported} games, {imported / elapsed:.0f} games/s.")
+    return BulkReport(imported,skipped,failed,rom_bytes,time.perf_counter() - start)
+
+
+class _DirectoryWriter:
+
+    def __init__(self,path):
+        self.path = path
+        os.makedirs(path,exist_ok=True)
+
+    def write(self,name,data):
+        write_atomic(os.path.join(self.path,name),data)
+
+    def close(self):
+        pass
+
+
+class _ZipWriter:
+
+    def __init__(self,path):
+        self.archive = zipfile.ZipFile(path,'w',zipfile.ZIP_DEFLATED)
+        self._lock = Lock()
+
+    def write(self,name,data):
+        with self._lock:
+            self.archive.writestr(name,data)
+
+    def close(self):
+        self.archive.close()
+
+'''
+Exports games with their control configuration to a directory, or to a zip archive
+when destination ends in .zip.  Roms shared by several games are written once, read
+from storage by a thread pool.
+
+:param user Only export this developer's games, or every game when None.
+:returns BulkReport where games counts the exported games.
+'''
+def export_games(db,destination,user=None,batch_size=500,workers=8,echo=print):
+    start = time.perf_counter()
+    writer = _ZipWriter(destination) if destination.endswith('.zip') else _DirectoryWriter(destination)
+    query = db.session.query(Game.id,Game.title,Game.description,Game.instructions,Game.filename,
+                             ControlConfig.emulator_speed,ControlConfig.key_codes)\
+        .outerjoin(ControlConfig,ControlConfig.game_id == Game.id)\
+        .order_by(Game.id)
+    if user is not None:
+        query = query.filter(Game.user_id == user.id)
+    storage = current_storage()
+    exported = failed = rom_bytes = 0
+    written = set()
+    missing = set()
+    lines = []
+
+    def copy_rom(filename,key):
+        data = storage.read(key)
+        writer.write(f"roms/{filename}.ch8",data)
+        return len(data)
+
+    try:
+        with ThreadPoolExecutor(workers) as pool:
+            for batch in _batches(query.yield_per(batch_size),batch_size):
+                copies = {}
+                for row in batch:
+                    if row.filename not in written:
+                        copies[row.filename] = Game(filename=row.filename).key
+                        written.add(row.filename)
+                futures = {filename:pool.submit(copy_rom,filename,key) for filename,key in copies.items()}
+                for filename,future in futures.items():
+                    try:
+                        rom_bytes += future.result()
+                    except IOError:
+                        missing.add(filename)
+                for row in batch:
+                    if row.filename in missing:
+                        failed += 1
+                        echo(f"Missing rom for game {row.id}.")
+                        continue
+                    lines.append(json.dumps({
+                        'title':row.title,
+                        'description':row.description,
+                        'instructions':row.instructions,
+                        'emulator_speed':row.emulator_speed,
+                        'key_config':decode_key_codes(bytes(row.key_codes)) if row.key_codes is not None else {},
+                        'rom':f"roms/{row.filename}.ch8",
+                    }))
+                    exported += 1
+        writer.write(MANIFEST,('\n'.join(lines) + '\n').encode('utf-8'))
+    finally:
+        writer.close()
+    return BulkReport(exported,0,failed,rom_bytes,time.perf_counter() - start)
@@ -0,0 +1,84 @@
+from collections import OrderedDict
+from threading import Lock
+import json
+
+'''
+Bounded in process cache that evicts the least recently used entry
+once it holds max_size entries.
+'''
+class LRUCache:
+
+    def __init__(self,max_size=1024):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self,key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self,key,value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self,key):
+        with self._lock:
+            self._entries.pop(key,None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+'''
+Cache shared between workers and hosts through a redis server.
+Values must be json serializable.
+'''
+class RedisCache:
+
+    def __init__(self,client,prefix,timeout=None):
+        self.client = client
+        self.prefix = prefix
+        self.timeout = timeout
+
+    def _key(self,key):
+        return f"{self.prefix}:{key}"
+
+    def get(self,key):
+        value = self.client.get(self._key(key))
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def set(self,key,value):
+        self.client.set(self._key(key),json.dumps(value),ex=self.timeout)
+
+    def delete(self,key):
+        self.client.delete(self._key(key))
+
+
+'''
+Creates the cache for a named part of the application.
+Uses redis when CACHE_REDIS_URL is configured, otherwise an in process lru cache.
+
+:param app The flask application holding the configuration.
+:param name Name used to prefix keys in a shared cache.
+:param max_size Maximum number of entries held by the in process cache.
+'''
+def create_cache(app,name,max_size=1024):
+    redis_url = app.config.get('CACHE_REDIS_URL')
+    if redis_url:
+        #redis is only required when a shared cache is configured
+        import redis
+        client = redis.Redis.from_url(redis_url)
+        return RedisCache(client,name,app.config.get('CACHE_REDIS_TIMEOUT'))
+    return LRUCache(max_size)
@@ -0,0 +1,468 @@
+from collections import namedtuple
+import os
+import random
+import struct
+import zlib
+
+'''
+Headless chip 8 and super chip interpreter used to smoke test roms on the server.
+
+Mirrors static/javascript/emulator/chip8.js: fonts are loaded at the start of memory,
+roms at 0x200 and the screen is a bitplane of 16 bytes per row, of which the standard
+64x32 mode uses the first 8 bytes of the first 32 rows.  All state lives in preallocated
+bytearrays and opcodes are dispatched through tables indexed by their nibbles.
+'''
+
+PROGRAM_START = 0x200
+MEMORY_SIZE = 4096
+CHIP_8_FONT_SIZE = 80
+SUPER_CHIP_FONT_SIZE = 320
+STACK_SIZE = 16
+
+REG_WIDTH = 64
+REG_HEIGHT = 32
+SUPER_WIDTH = 128
+SUPER_HEIGHT = 64
+RAM_WIDTH_BYTES = 16
+
+FONT_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)),'static','javascript','emulator','fonts')
+
+def _read_font(filename):
+    with open(os.path.join(FONT_FOLDER,filename),'rb') as reader:
+        return reader.read()
+
+CHIP_8_FONT = _read_font('chip8.cft')
+SUPER_CHIP_FONT = _read_font('chip8super.sft')
+
+'''
+Raised when the interpreter reaches an instruction it cannot execute.
+'''
+class Chip8Error(Exception):
+    def __init__(self,message,address):
+        super().__init__(message)
+        self.address = address
+
+
+class Chip8:
+
+    def __init__(self,seed=0):
+        self.memory = bytearray(MEMORY_SIZE)
+        self.memory[0:CHIP_8_FONT_SIZE] = CHIP_8_FONT[:CHIP_8_FONT_SIZE]
+        self.memory[CHIP_8_FONT_SIZE:CHIP_8_FONT_SIZE + SUPER_CHIP_FONT_SIZE] = SUPER_CHIP_FONT[:SUPER_CHIP_FONT_SIZE]
+        self.v = bytearray(16)
+        self.rpl = bytearray(16)
+        self.keys = bytearray(16)
+        self.vram = bytearray(RAM_WIDTH_BYTES * SUPER_HEIGHT)
+        self.stack = [0] * STACK_SIZE
+        #seeded so runs of the same rom are repeatable
+        self.random = random.Random(seed)
+        self._dispatch = (
+            self._op_system,self._op_jump,self._op_call,self._op_skip_equal_value,
+            self._op_skip_not_equal_value,self._op_skip_equal_registers,self._op_load_byte,self._op_add_byte,
+            self._op_alu,self._op_skip_not_equal_registers,self._op_load_i,self._op_jump_v0,
+            self._op_random,self._op_draw,self._op_keys,self._op_misc
+        )
+        self._alu = (
+            self._alu_load,self._alu_or,self._alu_and,self._alu_xor,
+            self._alu_add,self._alu_sub,self._alu_shift_right,self._alu_sub_negative,
+            None,None,None,None,None,None,self._alu_shift_left,None
+        )
+        self._misc = {
+            0x07:self._misc_load_delay_timer,0x0A:self._misc_wait_key,0x15:self._misc_set_delay_timer,
+            0x18:self._misc_set_sound_timer,0x1E:self._misc_add_i,0x29:self._misc_font,0x30:self._misc_super_font,
+            0x33:self._misc_bcd,0x55:self._misc_store_registers,0x65:self._misc_load_registers,
+            0x75:self._misc_store_rpl,0x85:self._misc_load_rpl
+        }
+        self.reset()
+
+    def reset(self):
+        self.v[:] = bytes(16)
+        self.vram[:] = bytes(len(self.vram))
+        self.i = 0
+        self.pc = PROGRAM_START
+        self.sp = 0
+        self.dt = 0
+        self.st = 0
+        self.extended = False
+        self.cycles = 0
+        self.draw_count = 0
+        #png of the first frame that drew anything and left pixels set, later frames are often
+        #blank or game over screens
+        self.thumbnail = None
+        self._frame_draw_count = 0
+        #set when the rom jumps to itself, which it can never leave
+        self.idle = False
+        self.waiting_for_key = False
+        self.halted = False
+
+    def load_rom(self,rom):
+        rom = rom[:MEMORY_SIZE - PROGRAM_START]
+        self.memory[PROGRAM_START:] = bytes(MEMORY_SIZE - PROGRAM_START)
+        self.memory[PROGRAM_START:PROGRAM_START + len(rom)] = rom
+        self.reset()
+
+    @property
+    def width(self):
+        return SUPER_WIDTH if self.extended else REG_WIDTH
+
+    @property
+    def height(self):
+        return SUPER_HEIGHT if self.extended else REG_HEIGHT
+
+    def step(self):
+        pc = self.pc
+        memory = self.memory
+        opcode = memory[pc] << 8 | memory[(pc + 1) & 0xFFF]
+        self.pc = (pc + 2) & 0xFFF
+        self.cycles += 1
+        self._dispatch[opcode >> 12](opcode)
+
+    '''
+    Executes up to the given number of cycles, decrementing the timers every
+    cycles_per_frame cycles.  Stops early once the rom halts, idles in a jump to
+    itself or waits for a key press, since nothing would change after that.
+
+    :raises Chip8Error
+    '''
+    def run(self,cycles,cycles_per_frame=16):
+        step = self.step
+        frame_cycle = 0
+        try:
+            for _ in range(cycles):
+                step()
+                if self.halted or self.idle or self.waiting_for_key:
+                    break
+                frame_cycle += 1
+                if frame_cycle == cycles_per_frame:
+                    frame_cycle = 0
+                    self._end_frame()
+                    if self.dt:
+                        self.dt -= 1
+                    if self.st:
+                        self.st -= 1
+        finally:
+            #the last frame ends early when the rom stops or fails
+            self._end_frame()
+
+    '''
+    Captures the thumbnail at the end of the first frame that drew anything and left
+    pixels set, so it shows every sprite of that frame rather than the first one.
+    '''
+    def _end_frame(self):
+        if self.thumbnail is None and self.draw_count != self._frame_draw_count and any(self.vram):
+            self.thumbnail = self.frame_png()
+        self._frame_draw_count = self.draw_count
+
+    def _invalid(self,opcode):
+        raise Chip8Error(f"Invalid instruction {opcode:04x}",(self.pc - 2) & 0xFFF)
+
+    def _skip(self):
+        self.pc = (self.pc + 2) & 0xFFF
+
+    #0nnn
+    def _op_system(self,opcode):
+        if opcode == 0x00E0:
+            self.vram[:] = bytes(len(self.vram))
+        elif opcode == 0x00EE:
+            if self.sp == 0:
+                raise Chip8Error("Return with an empty stack",(self.pc - 2) & 0xFFF)
+            self.sp -= 1
+            self.pc = self.stack[self.sp]
+        elif opcode & 0xFFF0 == 0x00C0:
+            self._scroll_down(opcode & 0xF)
+        elif opcode == 0x00FB:
+            self._scroll_horizontal(4)
+        elif opcode == 0x00FC:
+            self._scroll_horizontal(-4)
+        elif opcode == 0x00FD:
+            self.halted = True
+        elif opcode == 0x00FE:
+            self.extended = False
+        elif opcode == 0x00FF:
+            self.extended = True
+        #any other 0nnn is a SYS call into machine code, which the player ignores too
+
+    #1nnn
+    def _op_jump(self,opcode):
+        address = opcode & 0xFFF
+        if address == (self.pc - 2) & 0xFFF:
+            self.idle = True
+        self.pc = address
+
+    #2nnn
+    def _op_call(self,opcode):
+        if self.sp == STACK_SIZE:
+            raise Chip8Error("Call stack overflow",(self.pc - 2) & 0xFFF)
+        self.stack[self.sp] = self.pc
+        self.sp += 1
+        self.pc = opcode & 0xFFF
+
+    #3xkk
+    def _op_skip_equal_value(self,opcode):
+        if self.v[opcode >> 8 & 0xF] == opcode & 0xFF:
+            self._skip()
+
+    #4xkk
+    def _op_skip_not_equal_value(self,opcode):
+        if self.v[opcode >> 8 & 0xF] != opcode & 0xFF:
+            self._skip()
+
+    #5xy0
+    def _op_skip_equal_registers(self,opcode):
+        if opcode & 0xF:
+            self._invalid(opcode)
+        if self.v[opcode >> 8 & 0xF] == self.v[opcode >> 4 & 0xF]:
+            self._skip()
+
+    #6xkk
+    def _op_load_byte(self,opcode):
+        self.v[opcode >> 8 & 0xF] = opcode & 0xFF
+
+    #7xkk
+    def _op_add_byte(self,opcode):
+        x = opcode >> 8 & 0xF
+        self.v[x] = (self.v[x] + opcode) & 0xFF
+
+    #8xyn
+    def _op_alu(self,opcode):
+        operation = self._alu[opcode & 0xF]
+        if operation is None:
+            self._invalid(opcode)
+        operation(opcode >> 8 & 0xF,opcode >> 4 & 0xF)
+
+    def _alu_load(self,x,y):
+        self.v[x] = self.v[y]
+
+    def _alu_or(self,x,y):
+        self.v[x] |= self.v[y]
+
+    def _alu_and(self,x,y):
+        self.v[x] &= self.v[y]
+
+    def _alu_xor(self,x,y):
+        self.v[x] ^= self.v[y]
+
+    def _alu_add(self,x,y):
+        total = self.v[x] + self.v[y]
+        self.v[x] = total & 0xFF
+        self.v[0xF] = total > 0xFF
+
+    def _alu_sub(self,x,y):
+        vx,vy = self.v[x],self.v[y]
+        self.v[x] = (vx - vy) & 0xFF
+        self.v[0xF] = vx >= vy
+
+    def _alu_shift_right(self,x,y):
+        vx = self.v[x]
+        self.v[x] = vx >> 1
+        self.v[0xF] = vx & 1
+
+    def _alu_sub_negative(self,x,y):
+        vx,vy = self.v[x],self.v[y]
+        self.v[x] = (vy - vx) & 0xFF
+        self.v[0xF] = vy >= vx
+
+    def _alu_shift_left(self,x,y):
+        vx = self.v[x]
+        self.v[x] = (vx << 1) & 0xFF
+        self.v[0xF] = vx >> 7
+
+    #9xy0
+    def _op_skip_not_equal_registers(self,opcode):
+        if opcode & 0xF:
+            self._invalid(opcode)
+        if self.v[opcode >> 8 & 0xF] != self.v[opcode >> 4 & 0xF]:
+            self._skip()
+
+    #Annn
+    def _op_load_i(self,opcode):
+        self.i = opcode & 0xFFF
+
+    #Bnnn
+    def _op_jump_v0(self,opcode):
+        self.pc = ((opcode & 0xFFF) + self.v[0]) & 0xFFF
+
+    #Cxkk
+    def _op_random(self,opcode):
+        self.v[opcode >> 8 & 0xF] = self.random.getrandbits(8) & opcode
+
+    #Dxyn
+    def _op_draw(self,opcode):
+        x = self.v[opcode >> 8 & 0xF]
+        y = self.v[opcode >> 4 & 0xF]
+        rows = opcode & 0xF
+        memory = self.memory
+        address = self.i
+        collision = False
+        if rows == 0 and self.extended:
+            #16x16 super chip sprite, two bytes per row
+            for row in range(16):
+                data = memory[(address + row * 2) & 0xFFF] << 8 | memory[(address + row * 2 + 1) & 0xFFF]
+                collision |= self._draw_row(x,y + row,data,2)
+        else:
+            for row in range(rows):
+                collision |= self._draw_row(x,y + row,memory[(address + row) & 0xFFF],1)
+        self.v[0xF] = collision
+        self.draw_count += 1
+
+    '''
+    XORs a row of sprite data into vram, wrapping around the screen edges.
+    :returns True if any set pixel was cleared.
+    '''
+    def _draw_row(self,x,y,data,data_bytes):
+        width_bytes = self.width >> 3
+        x %= self.width
+        row_start = (y % self.height) * RAM_WIDTH_BYTES
+        column = x >> 3
+        shift = x & 7
+        #align the sprite to byte boundaries, spilling into one extra byte
+        data <<= 8 - shift
+        vram = self.vram
+        collision = False
+        for n in range(data_bytes + 1):
+            value = (data >> (8 * (data_bytes - n))) & 0xFF
+            if value:
+                index = row_start + (column + n) % width_bytes
+                old = vram[index]
+                if old & value:
+                    collision = True
+                vram[index] = old ^ value
+        return collision
+
+    def _scroll_down(self,rows):
+        height = self.height
+        width_bytes = self.width >> 3
+        vram = self.vram
+        for y in range(height - 1,-1,-1):
+            start = y * RAM_WIDTH_BYTES
+            source = (y - rows) * RAM_WIDTH_BYTES
+            if y >= rows:
+                vram[start:start + width_bytes] = vram[source:source + width_bytes]
+            else:
+                vram[start:start + width_bytes] = bytes(width_bytes)
+
+    def _scroll_horizontal(self,pixels):
+        width_bytes = self.width >> 3
+        mask = (1 << (width_bytes * 8)) - 1
+        vram = self.vram
+        for y in range(self.height):
+            start = y * RAM_WIDTH_BYTES
+            row = int.from_bytes(vram[start:start + width_bytes],'big')
+            row = row >> pixels if pixels > 0 else (row << -pixels) & mask
+            vram[start:start + width_bytes] = row.to_bytes(width_bytes,'big')
+
+    #Exkk
+    def _op_keys(self,opcode):
+        pressed = self.keys[self.v[opcode >> 8 & 0xF] & 0xF]
+        if opcode & 0xFF == 0x9E:
+            if pressed:
+                self._skip()
+        elif opcode & 0xFF == 0xA1:
+            if not pressed:
+                self._skip()
+        else:
+            self._invalid(opcode)
+
+    #Fxkk
+    def _op_misc(self,opcode):
+        operation = self._misc.get(opcode & 0xFF)
+        if operation is None:
+            self._invalid(opcode)
+        operation(opcode >> 8 & 0xF)
+
+    def _misc_load_delay_timer(self,x):
+        self.v[x] = self.dt
+
+    def _misc_wait_key(self,x):
+        for key,pressed in enumerate(self.keys):
+            if pressed:
+                self.v[x] = key
+                self.waiting_for_key = False
+                return
+        #repeat this instruction until a key is pressed
+        self.pc = (self.pc - 2) & 0xFFF
+        self.waiting_for_key = True
+
+    def _misc_set_delay_timer(self,x):
+        self.dt = self.v[x]
+
+    def _misc_set_sound_timer(self,x):
+        self.st = self.v[x]
+
+    def _misc_add_i(self,x):
+        self.i = (self.i + self.v[x]) & 0xFFFF
+
+    def _misc_font(self,x):
+        self.i = (self.v[x] & 0xF) * 5
+
+    def _misc_super_font(self,x):
+        self.i = CHIP_8_FONT_SIZE + (self.v[x] & 0xF) * 10
+
+    def _misc_bcd(self,x):
+        value = self.v[x]
+        memory = self.memory
+        memory[self.i & 0xFFF] = value // 100
+        memory[(self.i + 1) & 0xFFF] = value // 10 % 10
+        memory[(self.i + 2) & 0xFFF] = value % 10
+
+    def _misc_store_registers(self,x):
+        for register in range(x + 1):
+            self.memory[(self.i + register) & 0xFFF] = self.v[register]
+
+    def _misc_load_registers(self,x):
+        for register in range(x + 1):
+            self.v[register] = self.memory[(self.i + register) & 0xFFF]
+
+    def _misc_store_rpl(self,x):
+        self.rpl[:(x & 7) + 1] = self.v[:(x & 7) + 1]
+
+    def _misc_load_rpl(self,x):
+        self.v[:(x & 7) + 1] = self.rpl[:(x & 7) + 1]
+
+    '''
+    :returns The visible part of the screen as a 1 bit grayscale png.
+    '''
+    def frame_png(self):
+        return encode_png(self.vram,self.width,self.height)
+
+
+def _png_chunk(kind,data):
+    return struct.pack('>I',len(data)) + kind + data + struct.pack('>I',zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+'''
+Encodes the top left width x height pixels of a vram bitplane as a 1 bit grayscale png.
+'''
+def encode_png(vram,width,height):
+    width_bytes = width >> 3
+    raw = bytearray()
+    for y in range(height):
+        start = y * RAM_WIDTH_BYTES
+        #each scanline starts with filter type 0
+        raw.append(0)
+        raw += vram[start:start + width_bytes]
+    header = struct.pack('>IIBBBBB',width,height,1,0,0,0,0)
+    return b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR',header) + _png_chunk(b'IDAT',zlib.compress(bytes(raw),9)) + _png_chunk(b'IEND',b'')
+
+
+SmokeTestResult = namedtuple('SmokeTestResult',['cycles','draw_count','error','thumbnail'])
+
+SMOKE_TEST_CYCLES = 5000
+
+'''
+Runs a rom without input for a fixed number of cycles.
+
+:returns SmokeTestResult where error describes why the rom failed or is None,
+    and thumbnail is a png of the screen at the end of the first frame that drew anything
+    and left pixels set, or None if there was no such frame.
+'''
+def smoke_test(rom,cycles=SMOKE_TEST_CYCLES,speed=1000):
+    chip = Chip8()
+    chip.load_rom(rom)
+    error = None
+    try:
+        chip.run(cycles,max(speed // 60,1))
+    except Chip8Error as e:
+        error = f"{e} at address {hex(e.address)}."
+    if error is None and chip.idle and not chip.draw_count:
+        error = "The rom loops forever without drawing anything."
+    return SmokeTestResult(chip.cycles,chip.draw_count,error,chip.thumbnail)
@@ -0,0 +1,147 @@
+from flask import current_app,has_request_context,session
+from flask_sqlalchemy import SQLAlchemy,SignallingSession
+from sqlalchemy import orm
+from sqlalchemy.sql.expression import UpdateBase
+from functools import wraps
+from contextlib import contextmanager
+import sqlite3
+import time
+
+'''
+Database layer with explicit connection pool settings and read replica routing.
+
+Server databases get their pool sized from DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW and
+DATABASE_POOL_TIMEOUT, connections are recycled after DATABASE_POOL_RECYCLE seconds and
+checked with a ping before use when DATABASE_POOL_PRE_PING is set.  Values given in
+SQLALCHEMY_ENGINE_OPTIONS still take priority.
+
+When DATABASE_REPLICA_URI is set it becomes the replica bind, and views wrapped with
+db.use_replica run their queries against it.  Flushes, inserts, updates and deletes always
+go to the primary.  A client that wrote to the primary reads from it for the next
+DATABASE_REPLICA_LAG seconds, so it sees its own changes once redirected.  Reads that fill
+caches shared by every client run in db.use_primary, since a lagging replica would put
+rows back into the cache that a write just invalidated.
+
+Pointing DATABASE_REPLICA_URI at a second sqlite file simulates a replica for testing,
+with flask database sync-replica standing in for replication.
+'''
+
+REPLICA_BIND = 'replica'
+
+#keys in session.info
+USE_REPLICA = 'use_replica'
+WROTE = 'wrote'
+
+#key in the flask session
+PRIMARY_UNTIL = '_db_primary_until'
+
+#engine option and the config key holding it, with its default
+POOL_OPTIONS = (
+    ('pool_size','DATABASE_POOL_SIZE',10),
+    ('max_overflow','DATABASE_MAX_OVERFLOW',20),
+    ('pool_timeout','DATABASE_POOL_TIMEOUT',10),
+    ('pool_recycle','DATABASE_POOL_RECYCLE',1800),
+    ('pool_pre_ping','DATABASE_POOL_PRE_PING',True),
+)
+
+
+class RoutingSession(SignallingSession):
+
+    def __init__(self,db,**options):
+        self.db = db
+        super().__init__(db,**options)
+
+    def get_bind(self,mapper=None,clause=None):
+        if isinstance(clause,UpdateBase):
+            self.info[WROTE] = True
+        elif self.info.get(USE_REPLICA) and not self._flushing:
+            return self.db.get_engine(self.app,bind=REPLICA_BIND)
+        return super().get_bind(mapper,clause)
+
+    def flush(self,objects=None):
+        if self.new or self.dirty or self.deleted:
+            self.info[WROTE] = True
+        super().flush(objects)
+
+    def commit(self):
+        super().commit()
+        if self.info.pop(WROTE,False) and has_request_context() and self.db.has_replica(self.app):
+            session[PRIMARY_UNTIL] = time.time() + self.app.config.get('DATABASE_REPLICA_LAG',5)
+
+    def rollback(self):
+        super().rollback()
+        self.info.pop(WROTE,None)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def init_app(self,app):
+        replica_uri = app.config.get('DATABASE_REPLICA_URI')
+        if replica_uri:
+            binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+            binds[REPLICA_BIND] = replica_uri
+            app.config['SQLALCHEMY_BINDS'] = binds
+        super().init_app(app)
+
+    def create_session(self,options):
+        return orm.sessionmaker(class_=RoutingSession,db=self,**options)
+
+    def apply_driver_hacks(self,app,sa_url,options):
+        #sqlite opens files directly, so pooling is left to flask-sqlalchemy
+        if not sa_url.drivername.startswith('sqlite'):
+            for option,config_key,default in POOL_OPTIONS:
+                options.setdefault(option,app.config.get(config_key,default))
+        return super().apply_driver_hacks(app,sa_url,options)
+
+    def has_replica(self,app=None):
+        app = app or current_app
+        return REPLICA_BIND in (app.config.get('SQLALCHEMY_BINDS') or {})
+
+    '''
+    Decorator running the queries of a view against the replica, unless the client
+    wrote to the primary within the last DATABASE_REPLICA_LAG seconds.
+    '''
+    def use_replica(self,view):
+        @wraps(view)
+        def wrapper(*args,**kwargs):
+            if not self.has_replica() or session.get(PRIMARY_UNTIL,0) > time.time():
+                return view(*args,**kwargs)
+            db_session = self.session()
+            db_session.info[USE_REPLICA] = True
+            try:
+                return view(*args,**kwargs)
+            finally:
+                db_session.info.pop(USE_REPLICA,None)
+        return wrapper
+
+    '''
+    Runs the queries made in the block against the primary, also inside views using the replica.
+    '''
+    @contextmanager
+    def use_primary(self):
+        db_session = self.session()
+        replica = db_session.info.pop(USE_REPLICA,None)
+        try:
+            yield
+        finally:
+            if replica:
+                db_session.info[USE_REPLICA] = replica
+
+    '''
+    Copies a sqlite primary over a sqlite replica, simulating replication for testing.
+    :raises ValueError if either database is not sqlite.
+    '''
+    def sync_sqlite_replica(self,app=None):
+        app = app or current_app
+        primary = self.get_engine(app)
+        replica = self.get_engine(app,bind=REPLICA_BIND)
+        if primary.url.get_backend_name() != 'sqlite' or replica.url.get_backend_name() != 'sqlite':
+            raise ValueError('Only sqlite replicas can be synced.')
+        replica.dispose()
+        source = sqlite3.connect(primary.url.database)
+        target = sqlite3.connect(replica.url.database)
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+            target.close()
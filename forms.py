@@ -3,8 +3,9 @@ from flask_wtf.file import FileField,FileRequired
 from wtforms import StringField,TextAreaField,IntegerField,FieldList,FormField,SelectField
 from wtforms.widgets.html5 import NumberInput
 from wtforms.fields.core import Field
-from wtforms.validators import InputRequired, NumberRange, Regexp, ValidationError,Length,Optional
+from wtforms.validators import InputRequired, NumberRange, Regexp, ValidationError,StopValidation,Length,Optional
 from werkzeug.datastructures import FileStorage
+from rom_analysis import analyze_rom,MAX_ROM_SIZE
 import re
 
 '''
@@ -29,8 +30,13 @@ class FileSize:
     
     def __call__(self,form,field):
         if field.data:
-            if type(field.data) == bytes and len(field.data) > self.max_size:
-                raise ValidationError(self.message)
+            if type(field.data) == bytes:
+                if len(field.data) > self.max_size:
+                    raise ValidationError(self.message)
+            elif hasattr(field.data.stream,'size'):
+                #counted while the upload was streamed to disk
+                if field.data.stream.size > self.max_size:
+                    raise ValidationError(self.message)
             else:
                 #get length by reading to end of stream
                 start_pos = field.data.stream.tell()
@@ -42,9 +48,36 @@ class FileSize:
                 if size > self.max_size:
                     raise ValidationError(self.message)
 
+'''
+Runs static analysis on an uploaded rom, rejecting roms that every run would crash on.
+The result is kept on the field as field.analysis for storing with the game.
+Smoke tests are slower, so they run in the background once the game is stored.
+'''
+class ValidRom:
+    def __init__(self,message=None):
+        if not message:
+            message = "The file is not a valid Chip 8 rom. Invalid instruction at address {address}."
+        self.message = message
+
+    def __call__(self,form,field):
+        field.analysis = None
+        if field.data:
+            if type(field.data) == bytes:
+                rom = field.data
+            else:
+                start_pos = field.data.stream.tell()
+                #never read more than fits in chip 8 memory
+                rom = field.data.stream.read(MAX_ROM_SIZE + 1)
+                field.data.stream.seek(start_pos)
+            field.analysis = analyze_rom(rom)
+            if field.analysis.fatal_opcode is not None:
+                address = field.analysis.fatal_opcode[0]
+                raise ValidationError(self.message.format(address=hex(address)))
+
 '''
 Validates a list of key codes mapped to chip 8 key code to verify that 
-submitted key codes are each only mapped to one chip 8 key code.
+submitted key codes are each only mapped to one chip 8 key code, and that
+each chip 8 key is mapped to only one key code, the most a stored configuration holds.
 '''
 class ConfigKeysUnique:
     '''
@@ -54,11 +87,15 @@ class ConfigKeysUnique:
     :param <string> key_code_field -- The attribute name of the key code field on the enclosing form object.
     '''
 
-    def __init__(self,chip_key_field='hex_value',key_code_field='key_code',message=None):
+    def __init__(self,chip_key_field='hex_value',key_code_field='key_code',message=None,chip_key_message=None):
         if not message:
-            self.message = "Contains keycodes mapped to multiple Chip 8 keys."
-            self.chip_key_field = chip_key_field
-            self.key_code_field = key_code_field
+            message = "Contains keycodes mapped to multiple Chip 8 keys."
+        if not chip_key_message:
+            chip_key_message = "Contains Chip 8 keys mapped to multiple keycodes."
+        self.message = message
+        self.chip_key_message = chip_key_message
+        self.chip_key_field = chip_key_field
+        self.key_code_field = key_code_field
 
     '''
     Validation method
@@ -79,6 +116,8 @@ class ConfigKeysUnique:
                 if chip_key and key_code:
                     if key_code in key_codes:
                         raise ValidationError(self.message)
+                    elif chip_key in key_codes.values():
+                        raise ValidationError(self.chip_key_message)
                     else:
                         key_codes[key_code] = chip_key
 
@@ -92,22 +131,29 @@ def strip_whitespace(text):
 
 
 
+#validation rules shared by the upload form and validate_game_values
+ROM_VALIDATORS = [FileSize(4*2**10),ValidRom()]
+TITLE_VALIDATORS = [InputRequired(),Length(min=1,max=255),Regexp("^[0-9a-zA-z \.\?\!\,\']+$",message='Only letters, numbers, spaces and the following punctuation are allowed: !?.\',')]
+DESCRIPTION_VALIDATORS = [InputRequired(),Length(min=1,max=5000)]
+INSTRUCTIONS_VALIDATORS = [InputRequired(),Length(min=1,max=5000)]
+EMULATOR_SPEED_VALIDATORS = [NumberRange(1000,16000,message='Please select a speed within the range of 1,000 to 16,000 hz.')]
+KEY_CODE_VALIDATORS = [Optional(),NumberRange(1,255,message="Please enter a valid keycode.")]
+KEY_CODES_VALIDATORS = [ConfigKeysUnique()]
+
 class KeyConfigForm(FlaskForm):
     #generate hexidecimal select choices.  Have blank option as default
     hex_choices = [(hex(i)[2],hex(i)) for i in range(0,16)]
     hex_choices.insert(0,('',''))
     hex_value = SelectField('Hex Value',validators=[Optional()],choices=hex_choices)
-    key_code = IntegerField('Key Code',validators=[Optional(),NumberRange(0,255,message="Please enter a valid keycode.")])       
+    key_code = IntegerField('Key Code',validators=KEY_CODE_VALIDATORS)       
 
 class GameUploadForm(FlaskForm):
-    game_rom = FileField('game_rom',validators=[FileSize(4*2**10)])
-    title = StringField('Title',
-                        validators=[InputRequired(),Length(min=1,max=255),Regexp("^[0-9a-zA-z \.\?\!\,\']+$",message='Only letters, numbers, spaces and the following punctuation are allowed: !?.\',')],
-                        filters=[strip_whitespace])
-    description = TextAreaField('Description',validators=[InputRequired(),Length(min=1,max=5000)])
-    instructions = TextAreaField('Instructions',validators=[InputRequired(),Length(min=1,max=5000)])
-    emulator_speed = IntegerField('Emulator Speed',validators=[NumberRange(1000,16000,message='Please select a speed within the range of 1,000 to 16,000 hz.')],widget=NumberInput(min=1000,max=16000,step=10))
-    key_codes = FieldList(FormField(KeyConfigForm),validators=[ConfigKeysUnique()],min_entries=1,max_entries=16)
+    game_rom = FileField('game_rom',validators=ROM_VALIDATORS)
+    title = StringField('Title',validators=TITLE_VALIDATORS,filters=[strip_whitespace])
+    description = TextAreaField('Description',validators=DESCRIPTION_VALIDATORS)
+    instructions = TextAreaField('Instructions',validators=INSTRUCTIONS_VALIDATORS)
+    emulator_speed = IntegerField('Emulator Speed',validators=EMULATOR_SPEED_VALIDATORS,widget=NumberInput(min=1000,max=16000,step=10))
+    key_codes = FieldList(FormField(KeyConfigForm),validators=KEY_CODES_VALIDATORS,min_entries=1,max_entries=16)
 
     
     '''
@@ -134,3 +180,78 @@ class GameUploadForm(FlaskForm):
             self.key_codes.append_entry(key_code_form)
             self.key_codes.entries[-1].form.process(data=obj)
         self.key_codes.entries.reverse()
+
+
+'''
+Stand in for a WTForms field holding a plain value, so the form validators can
+check values that did not come from a request.
+'''
+class ValueField:
+
+    def __init__(self,data,entries=()):
+        self.data = data
+        self.raw_data = [] if data is None else [data]
+        self.entries = list(entries)
+        self.errors = []
+
+    def gettext(self,string):
+        return string
+
+    def ngettext(self,singular,plural,n):
+        return singular if n == 1 else plural
+
+'''
+Runs validators against a field the way WTForms does, stopping at StopValidation.
+:returns The list of error messages.
+'''
+def run_validators(field,validators):
+    for validator in validators:
+        try:
+            validator(None,field)
+        except StopValidation as e:
+            if e.args and e.args[0]:
+                field.errors.append(e.args[0])
+            break
+        except ValidationError as e:
+            field.errors.append(e.args[0])
+    return field.errors
+
+CHIP_KEYS = {value for value,_ in KeyConfigForm.hex_choices if value}
+
+class _KeyEntry:
+    def __init__(self,hex_value,key_code):
+        self.hex_value = ValueField(hex_value)
+        self.key_code = ValueField(key_code)
+
+'''
+Checks the values of one game against the rules of GameUploadForm without building a form.
+
+:param key_config Dictionary of {hex_value:key_code}, the format the emulator uses.
+:param rom Bytes of the rom, which must not be empty.
+:returns Tuple of (errors,analysis) where errors maps field names to lists of messages
+    and analysis is the rom_analysis.RomAnalysis of the rom or None if it was not reached.
+'''
+def validate_game_values(title,description,instructions,emulator_speed,key_config,rom):
+    errors = {}
+    rom_field = ValueField(rom)
+    entries = [_KeyEntry(str(hex_value).lower(),key_code) for hex_value,key_code in key_config.items()]
+    fields = (
+        #like the FileRequired the upload form adds for new games
+        ('game_rom',rom_field,[InputRequired()] + ROM_VALIDATORS),
+        ('title',ValueField(strip_whitespace(title)),TITLE_VALIDATORS),
+        ('description',ValueField(description),DESCRIPTION_VALIDATORS),
+        ('instructions',ValueField(instructions),INSTRUCTIONS_VALIDATORS),
+        ('emulator_speed',ValueField(emulator_speed),EMULATOR_SPEED_VALIDATORS),
+        ('key_codes',ValueField(None,entries),KEY_CODES_VALIDATORS),
+    )
+    for name,field,validators in fields:
+        messages = run_validators(field,validators)
+        if messages:
+            errors[name] = messages
+    for entry in entries:
+        messages = run_validators(entry.key_code,KEY_CODE_VALIDATORS)
+        if entry.hex_value.data not in CHIP_KEYS:
+            messages.append(f"{entry.hex_value.data} is not a chip 8 key.")
+        if messages:
+            errors.setdefault('key_codes',[]).extend(messages)
+    return errors,getattr(rom_field,'analysis',None)
@@ -0,0 +1,52 @@
+from functools import lru_cache
+import hashlib
+import os
+import struct
+
+'''
+Game bundles hold everything the emulator needs to start a game, so the play page
+can launch it with one request instead of fetching the configuration, the rom and
+both fonts one after another.
+
+A bundle is the magic bytes C8BN and a version byte, followed by four sections in
+order: the json configuration, the chip 8 font, the super chip font and the rom.
+Every section is prefixed with its length as a big endian unsigned 32 bit integer.
+static/javascript/emulator/loaders.js reads them back.
+'''
+
+MAGIC = b'C8BN'
+VERSION = 1
+MIMETYPE = 'application/octet-stream'
+
+FONT_DIRECTORY = os.path.join('javascript','emulator','fonts')
+CHIP8_FONT = 'chip8.cft'
+SUPER_CHIP_FONT = 'chip8super.sft'
+
+'''
+Reads both fonts from the static folder once per process.
+:returns Tuple of (chip8_font,super_chip_font,digest) where digest changes with either font.
+'''
+@lru_cache(maxsize=None)
+def read_fonts(static_folder):
+    fonts = []
+    for name in (CHIP8_FONT,SUPER_CHIP_FONT):
+        with open(os.path.join(static_folder,FONT_DIRECTORY,name),'rb') as reader:
+            fonts.append(reader.read())
+    digest = hashlib.sha1(b''.join(fonts)).hexdigest()
+    return fonts[0],fonts[1],digest
+
+'''
+:param config_etag The etag of the game configuration.
+:param rom_filename The content hash the rom is stored under.
+:param font_digest The digest returned by read_fonts.
+:returns The etag of a bundle, computed without reading the rom.
+'''
+def bundle_etag(config_etag,rom_filename,font_digest):
+    return hashlib.sha1(f"{VERSION}:{config_etag}:{rom_filename}:{font_digest}".encode()).hexdigest()
+
+def encode_bundle(config,chip8_font,super_chip_font,rom):
+    parts = [MAGIC,struct.pack('>B',VERSION)]
+    for section in (config.encode('utf-8'),chip8_font,super_chip_font,rom):
+        parts.append(struct.pack('>I',len(section)))
+        parts.append(section)
+    return b''.join(parts)
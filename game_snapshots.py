@@ -0,0 +1,121 @@
+from flask import g,has_app_context,Markup
+from models import Game,User,ControlConfig,decode_key_codes,newline_to_p
+from datetime import datetime
+import time
+
+'''
+Read through cache of game snapshots for the views that only read a game.
+
+A snapshot is a plain copy of the fields those views and their templates use, the
+developer's name and the control configuration, loaded with one joined query.  Unlike
+an ORM instance it holds no session state, so it never lazy loads once cached.
+Snapshots are kept by game id along with their version, the time the game last changed,
+until GAME_SNAPSHOT_TTL passes or a write invalidates them.  Within a request repeated
+lookups of a game return the same snapshot, the way the session identity map does for
+instances.
+'''
+
+#columns of the game table copied into snapshots
+GAME_FIELDS = ('id','user_id','title','description','instructions','description_html','instructions_html',
+               'filename','created_on','last_updated','instruction_count','invalid_opcode_count',
+               'schip_required','suggested_speed','has_thumbnail','smoke_test_error')
+
+
+class GameSnapshot:
+
+    def __init__(self,values):
+        self.__dict__.update(values)
+
+    '''
+    :returns When the game last changed.
+    '''
+    @property
+    def last_modified(self):
+        return datetime.fromisoformat(self.version)
+
+    @property
+    def description_markup(self):
+        if self.description_html is None:
+            return newline_to_p(self.description or '')
+        return Markup(self.description_html)
+
+    @property
+    def instructions_markup(self):
+        if self.instructions_html is None:
+            return newline_to_p(self.instructions or '')
+        return Markup(self.instructions_html)
+
+    @property
+    def key(self):
+        return Game(filename=self.filename).key
+
+    @property
+    def thumbnail_key(self):
+        return Game(filename=self.filename).thumbnail_key
+
+
+class GameSnapshots:
+
+    '''
+    :param cache Cache from cache.create_cache holding the snapshots.
+    :param ttl Seconds a snapshot is served for before it is reloaded.
+    '''
+    def __init__(self,db,cache,ttl=300):
+        self.db = db
+        self.cache = cache
+        self.ttl = ttl
+
+    def _request_snapshots(self):
+        if not has_app_context():
+            return None
+        if 'game_snapshots' not in g:
+            g.game_snapshots = {}
+        return g.game_snapshots
+
+    '''
+    :returns The GameSnapshot of a game or None if it does not exist.
+    '''
+    def get(self,id):
+        snapshots = self._request_snapshots()
+        if snapshots is not None and id in snapshots:
+            return snapshots[id]
+        entry = self.cache.get(id)
+        if entry is None or entry['expires'] < time.time():
+            values = self.load(id)
+            if values is None:
+                return None
+            entry = {'values':values,'expires':time.time() + self.ttl}
+            self.cache.set(id,entry)
+        snapshot = GameSnapshot(entry['values'])
+        if snapshots is not None:
+            snapshots[id] = snapshot
+        return snapshot
+
+    '''
+    Reads from the primary, as snapshots are shared by every client.
+    :returns The json serializable values of a snapshot or None if the game does not exist.
+    '''
+    def load(self,id):
+        columns = [getattr(Game,name) for name in GAME_FIELDS]
+        with self.db.use_primary():
+            row = self.db.session.query(*columns,User.name.label('user_name'),ControlConfig.emulator_speed,ControlConfig.key_codes)\
+                .outerjoin(User,User.id == Game.user_id)\
+                .outerjoin(ControlConfig,ControlConfig.game_id == Game.id)\
+                .filter(Game.id == id).first()
+        if row is None:
+            return None
+        values = {name:getattr(row,name) for name in GAME_FIELDS}
+        values['version'] = (row.last_updated or row.created_on).isoformat()
+        values['created_on'] = row.created_on.isoformat()
+        values['last_updated'] = row.last_updated.isoformat() if row.last_updated else None
+        values['user_name'] = row.user_name
+        values['emulator_speed'] = row.emulator_speed
+        #key codes are stored in the emulator standard of hex_value:key
+        values['key_config'] = decode_key_codes(bytes(row.key_codes)) if row.key_codes is not None else None
+        return values
+
+    def invalidate(self,id):
+        self.cache.delete(id)
+        snapshots = self._request_snapshots()
+        if snapshots is not None:
+            snapshots.pop(id,None)
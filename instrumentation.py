@@ -0,0 +1,193 @@
+from flask import g,request,has_request_context,before_render_template,template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from contextlib import contextmanager
+from threading import Lock
+import cProfile
+import os
+import tempfile
+import time
+
+'''
+Opt in request instrumentation.
+
+When INSTRUMENTATION_ENABLED is set every request records its wall time, SQL query count
+and duration, template render time and file I/O time into per endpoint histograms, which
+render_metrics exposes in the Prometheus text format.  When INSTRUMENTATION_PROFILING is
+also set, a request sent with the X-Profile header runs under cProfile and the stats are
+dumped to INSTRUMENTATION_PROFILE_DIR.
+'''
+
+PROFILE_HEADER = 'X-Profile'
+
+#upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0)
+COUNT_BUCKETS = (0,1,2,3,5,10,20,50,100)
+
+#name, help text and buckets of every histogram recorded per endpoint
+HISTOGRAMS = (
+    ('request_duration_seconds','Wall time spent handling a request.',SECONDS_BUCKETS),
+    ('request_queries','SQL queries executed by a request.',COUNT_BUCKETS),
+    ('request_query_duration_seconds','Time a request spent executing SQL queries.',SECONDS_BUCKETS),
+    ('request_template_duration_seconds','Time a request spent rendering templates.',SECONDS_BUCKETS),
+    ('request_io_duration_seconds','Time a request spent reading and writing files.',SECONDS_BUCKETS),
+)
+
+METRIC_PREFIX = 'chip8_arcade_'
+
+
+class Histogram:
+
+    def __init__(self,buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self,value):
+        for index,bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+
+'''
+Per request totals, kept on flask.g while the request runs.
+'''
+class RequestStats:
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.template_time = 0.0
+        self.io_time = 0.0
+        self.template_start = None
+        self.profiler = None
+
+
+def _current_stats():
+    if not has_request_context():
+        return None
+    return g.get('request_stats')
+
+'''
+Adds the time spent in the block to the file I/O time of the current request.
+Does nothing outside of instrumented requests.
+'''
+@contextmanager
+def io_timer():
+    stats = _current_stats()
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.io_time += time.perf_counter() - start
+
+
+def _before_cursor_execute(conn,cursor,statement,parameters,context,executemany):
+    if _current_stats() is not None:
+        conn.info.setdefault('query_start',[]).append(time.perf_counter())
+
+def _after_cursor_execute(conn,cursor,statement,parameters,context,executemany):
+    stats = _current_stats()
+    starts = conn.info.get('query_start')
+    if stats is not None and starts:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - starts.pop()
+
+
+class Instrumentation:
+
+    def __init__(self,app=None):
+        self.enabled = False
+        self._histograms = {}
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self,app):
+        app.extensions['instrumentation'] = self
+        self.enabled = app.config.get('INSTRUMENTATION_ENABLED',False)
+        if not self.enabled:
+            return
+        self.profiling = app.config.get('INSTRUMENTATION_PROFILING',False)
+        self.profile_dir = app.config.get('INSTRUMENTATION_PROFILE_DIR',tempfile.gettempdir())
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_render,app)
+        template_rendered.connect(self._after_render,app)
+        #every engine, so binds added later are counted too, once for all applications
+        if not event.contains(Engine,'before_cursor_execute',_before_cursor_execute):
+            event.listen(Engine,'before_cursor_execute',_before_cursor_execute)
+            event.listen(Engine,'after_cursor_execute',_after_cursor_execute)
+
+    def _before_request(self):
+        stats = g.request_stats = RequestStats()
+        if self.profiling and PROFILE_HEADER in request.headers:
+            stats.profiler = cProfile.Profile()
+            stats.profiler.enable()
+
+    def _before_render(self,sender,template,context,**extra):
+        stats = _current_stats()
+        if stats is not None:
+            stats.template_start = time.perf_counter()
+
+    def _after_render(self,sender,template,context,**extra):
+        stats = _current_stats()
+        if stats is not None and stats.template_start is not None:
+            stats.template_time += time.perf_counter() - stats.template_start
+            stats.template_start = None
+
+    def _after_request(self,response):
+        stats = g.pop('request_stats',None)
+        if stats is None:
+            return response
+        duration = time.perf_counter() - stats.start
+        if stats.profiler is not None:
+            stats.profiler.disable()
+            response.headers['X-Profile-File'] = self._dump_profile(stats.profiler)
+        endpoint = request.endpoint or 'unmatched'
+        values = (duration,stats.queries,stats.query_time,stats.template_time,stats.io_time)
+        with self._lock:
+            for (name,_,buckets),value in zip(HISTOGRAMS,values):
+                histogram = self._histograms.get((name,endpoint))
+                if histogram is None:
+                    histogram = self._histograms[(name,endpoint)] = Histogram(buckets)
+                histogram.observe(value)
+        return response
+
+    def _dump_profile(self,profiler):
+        os.makedirs(self.profile_dir,exist_ok=True)
+        endpoint = request.endpoint or 'unmatched'
+        path = os.path.join(self.profile_dir,f"{endpoint}-{time.time():.6f}.prof")
+        profiler.dump_stats(path)
+        return path
+
+    '''
+    :returns The histograms of this process in the Prometheus text exposition format.
+    '''
+    def render_metrics(self):
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            for name,help_text,_ in HISTOGRAMS:
+                metric = METRIC_PREFIX + name
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} histogram")
+                for (histogram_name,endpoint),histogram in histograms:
+                    if histogram_name != name:
+                        continue
+                    cumulative = 0
+                    for bound,count in zip(histogram.buckets,histogram.counts):
+                        cumulative += count
+                        lines.append(f'{metric}_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{metric}_bucket{{endpoint="{endpoint}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{metric}_sum{{endpoint="{endpoint}"}} {histogram.sum}')
+                    lines.append(f'{metric}_count{{endpoint="{endpoint}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,235 @@
+from flask import current_app,has_app_context
+from sqlalchemy import or_,and_
+from datetime import datetime,timedelta
+import multiprocessing
+import os
+import socket
+import time
+import traceback
+
+'''
+Database backed queue for work that should not hold up a request.
+
+Jobs are rows of the job table keyed by a task name and the id of the row they work on.
+They are added on the caller's session, so a job only becomes visible to workers when the
+request that queued it commits.  Workers claim a job with a conditional update, which
+succeeds for exactly one of them on both MySQL and SQLite, and hold it for a lease.  A job
+whose worker dies is claimed again once the lease runs out.
+
+Tasks must be idempotent, since a job can run more than once: they are retried with an
+exponential backoff when they raise, and a job that expired mid run is run again.
+'''
+
+QUEUED = 'queued'
+RUNNING = 'running'
+FAILED = 'failed'
+
+#key in session.info holding the callbacks of the running task
+AFTER_COMMIT = 'job_after_commit'
+
+
+class JobQueue:
+
+    '''
+    :param lease Seconds a worker may hold a job before other workers can claim it.
+    :param max_attempts Runs of a job before it is marked as failed.
+    :param retry_delay Seconds to wait before the first retry, doubled for every retry after.
+    '''
+    def __init__(self,db,model,lease=300,max_attempts=5,retry_delay=10):
+        self.db = db
+        self.model = model
+        self.defaults = {'lease':lease,'max_attempts':max_attempts}
+        self.retry_delay = retry_delay
+        self.tasks = {}
+
+    '''
+    Reads JOB_LEASE and JOB_MAX_ATTEMPTS from the application configuration.  The queue
+    is shared by every application, so the settings are kept on the application.
+    '''
+    def init_app(self,app):
+        app.extensions['jobs'] = {
+            'lease':app.config.get('JOB_LEASE',self.defaults['lease']),
+            'max_attempts':app.config.get('JOB_MAX_ATTEMPTS',self.defaults['max_attempts']),
+        }
+
+    def _settings(self):
+        if has_app_context():
+            return current_app.extensions.get('jobs',self.defaults)
+        return self.defaults
+
+    @property
+    def lease(self):
+        return self._settings()['lease']
+
+    @property
+    def max_attempts(self):
+        return self._settings()['max_attempts']
+
+    '''
+    Registers a function as the task with the given name.  The function is called
+    with the key of the job inside an application context.
+    '''
+    def task(self,name):
+        def register(function):
+            self.tasks[name] = function
+            return function
+        return register
+
+    '''
+    Queues a task on the current session unless the same task is already queued
+    for the key.  The job is stored when the session commits.
+
+    :param delay Seconds to wait before the job is due.
+    :param session Session to queue the job on instead of the current one.
+    '''
+    def enqueue(self,name,key,delay=0,session=None):
+        if name not in self.tasks:
+            raise KeyError(f"Unknown task {name}.")
+        model = self.model
+        session = session or self.db.session
+        queued = session.query(model.id).filter(model.name == name,model.key == key,model.status == QUEUED).first()
+        if queued is None:
+            run_after = datetime.now() + timedelta(seconds=delay)
+            session.add(model(name=name,key=key,status=QUEUED,attempts=0,run_after=run_after))
+
+    '''
+    Queues a task for many keys with a single executemany insert, without checking for
+    duplicates.  Meant for rows that were just created, which cannot have jobs yet.
+    '''
+    def enqueue_many(self,name,keys):
+        if name not in self.tasks:
+            raise KeyError(f"Unknown task {name}.")
+        now = datetime.now()
+        rows = [{'name':name,'key':key,'status':QUEUED,'attempts':0,'run_after':now,'created_on':now} for key in keys]
+        if rows:
+            self.db.session.execute(self.model.__table__.insert(),rows)
+
+    def _claimable(self,now):
+        model = self.model
+        return and_(model.attempts < self.max_attempts,
+                    or_(and_(model.status == QUEUED,model.run_after <= now),
+                        and_(model.status == RUNNING,model.locked_until < now)))
+
+    '''
+    Takes the oldest job that is due, or whose lease has expired, for the worker.
+    :returns The claimed job or None if there is nothing to do.
+    '''
+    def claim(self,worker):
+        model = self.model
+        session = self.db.session
+        now = datetime.now()
+        #jobs that ran out of attempts while their worker was away never finish
+        session.query(model).filter(model.status == RUNNING,model.locked_until < now,model.attempts >= self.max_attempts)\
+            .update({model.status:FAILED,model.last_error:"Lease expired on the final attempt."},synchronize_session=False)
+        candidates = [row.id for row in session.query(model.id).filter(self._claimable(now)).order_by(model.id).limit(10)]
+        for id in candidates:
+            claimed = session.query(model).filter(model.id == id,self._claimable(now)).update({
+                model.status:RUNNING,
+                model.worker:worker,
+                model.locked_until:now + timedelta(seconds=self.lease),
+                model.attempts:model.attempts + 1,
+            },synchronize_session=False)
+            if claimed:
+                session.commit()
+                return session.query(model).get(id)
+        session.commit()
+        return None
+
+    '''
+    Calls function once the changes of the running task have committed, for work such as
+    invalidating caches, which would otherwise be refilled from the state before the task.
+    Dropped if the task fails.
+    '''
+    def after_commit(self,function):
+        self.db.session.info.setdefault(AFTER_COMMIT,[]).append(function)
+
+    '''
+    Runs a claimed job.  The task's changes and the removal of the job commit together,
+    so a finished job is never run again.  When the task raises its changes are rolled
+    back and the job is queued for a retry, or marked as failed after its last attempt.
+
+    :returns True if the task succeeded.
+    '''
+    def run(self,job):
+        session = self.db.session
+        id = job.id
+        try:
+            task = self.tasks[job.name]
+            task(job.key)
+            session.delete(job)
+            session.commit()
+        except Exception:
+            error = traceback.format_exc()
+            session.rollback()
+            session.info.pop(AFTER_COMMIT,None)
+        else:
+            for function in session.info.pop(AFTER_COMMIT,[]):
+                function()
+            return True
+        job = session.query(self.model).get(id)
+        job.last_error = error
+        job.locked_until = None
+        if job.attempts >= self.max_attempts:
+            job.status = FAILED
+        else:
+            job.status = QUEUED
+            job.run_after = datetime.now() + timedelta(seconds=self.retry_delay * 2 ** (job.attempts - 1))
+        session.commit()
+        return False
+
+    '''
+    Queues every failed job again with a fresh set of attempts.
+    :returns Number of jobs queued.
+    '''
+    def retry_failed(self):
+        model = self.model
+        return self.db.session.query(model).filter(model.status == FAILED).update({
+            model.status:QUEUED,
+            model.attempts:0,
+            model.run_after:datetime.now(),
+        },synchronize_session=False)
+
+    '''
+    Claims and runs jobs until stopped.
+    :param burst Return once no job is due instead of polling for more.
+    :returns Number of jobs run.
+    '''
+    def work(self,worker=None,burst=False,poll_interval=1.0):
+        worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+        processed = 0
+        while True:
+            job = self.claim(worker)
+            if job is None:
+                if burst:
+                    return processed
+                time.sleep(poll_interval)
+                continue
+            self.run(job)
+            processed += 1
+
+    '''
+    Runs work in a pool of worker processes, each with its own database connections.
+    '''
+    def work_pool(self,app,processes,burst=False,poll_interval=1.0):
+        if processes == 1:
+            self._work_process(app,burst,poll_interval)
+            return
+        with app.app_context():
+            #connections must not be shared with the forked workers
+            self.db.engine.dispose()
+        workers = [multiprocessing.Process(target=self._work_process,args=(app,burst,poll_interval)) for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+
+    def _work_process(self,app,burst,poll_interval):
+        with app.app_context():
+            try:
+                self.work(burst=burst,poll_interval=poll_interval)
+            except KeyboardInterrupt:
+                pass
@@ -0,0 +1,91 @@
+from models import HighScore,User
+from sqlalchemy import and_
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime
+import time
+
+'''
+High score leaderboards.
+
+Every player keeps a single high score per game, replaced whenever they beat it, so the
+top scores of a game are read in order from the (game_id,score descending,achieved_on)
+index with no grouping or sorting.  Leaderboards are cached by game id for LEADERBOARD_TTL
+seconds, and dropped when a player on this worker improves their score.  Scores are
+reported by the player and cannot be verified by the server.
+'''
+
+#largest score accepted, the range of the score column
+MAX_SCORE = 2**31 - 1
+
+
+class Leaderboards:
+
+    '''
+    :param cache Cache from cache.create_cache holding the leaderboards.
+    :param size Number of scores shown on a leaderboard.
+    :param ttl Seconds a leaderboard is served for before it is reloaded.
+    '''
+    def __init__(self,db,cache,size=10,ttl=60):
+        self.db = db
+        self.cache = cache
+        self.size = size
+        self.ttl = ttl
+
+    '''
+    :returns The top scores of a game, best first, as json serializable dictionaries.
+    '''
+    def get(self,game_id):
+        entry = self.cache.get(game_id)
+        if entry is None or entry['expires'] < time.time():
+            entry = {'scores':self.load(game_id),'expires':time.time() + self.ttl}
+            self.cache.set(game_id,entry)
+        return entry['scores']
+
+    '''
+    Reads from the primary, as leaderboards are shared by every client.
+    '''
+    def load(self,game_id):
+        with self.db.use_primary():
+            rows = self.db.session.query(User.name,HighScore.score,HighScore.achieved_on)\
+                .join(User,User.id == HighScore.user_id)\
+                .filter(HighScore.game_id == game_id)\
+                .order_by(HighScore.score.desc(),HighScore.achieved_on.asc())\
+                .limit(self.size).all()
+        return [{'rank':rank,'name':name,'score':score,'achieved_on':achieved_on.isoformat()}
+                for rank,(name,score,achieved_on) in enumerate(rows,1)]
+
+    '''
+    Records a score, keeping it only if it beats the player's best, and commits.  The best
+    score is only ever raised by a conditional update, so concurrent submissions cannot
+    replace a higher score with a lower one.  A first score that loses the race to insert
+    is compared against the winner instead.
+
+    :returns Tuple of (best,improved) where best is the player's high score after recording.
+    '''
+    def record(self,game_id,user_id,score):
+        session = self.db.session
+        table = HighScore.__table__
+        player = and_(table.c.game_id == game_id,table.c.user_id == user_id)
+        for retry in (True,False):
+            now = datetime.now()
+            improved = session.execute(table.update().where(and_(player,table.c.score < score))
+                                       .values(score=score,achieved_on=now)).rowcount
+            if improved:
+                session.commit()
+                return score,True
+            best = session.query(table.c.score).filter(player).scalar()
+            if best is not None:
+                session.rollback()
+                return best,False
+            try:
+                session.execute(table.insert().values(game_id=game_id,user_id=user_id,score=score,achieved_on=now))
+                session.commit()
+                return score,True
+            except IntegrityError:
+                #another submission stored the player's first score
+                session.rollback()
+                if not retry:
+                    raise
+
+    def invalidate(self,game_id):
+        self.cache.delete(game_id)
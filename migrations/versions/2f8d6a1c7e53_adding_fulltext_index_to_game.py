@@ -0,0 +1,36 @@
+"""Adding fulltext index over game title, description and instructions.
+
+MySQL uses a FULLTEXT index, SQLite an FTS5 table kept up to date by search.py.
+
+Revision ID: 2f8d6a1c7e53
+Revises: e71d4b5a0c96
+Create Date: 2026-10-18 12:21:14.093552
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2f8d6a1c7e53'
+down_revision = 'e71d4b5a0c96'
+branch_labels = None
+depends_on = None
+
+def dialect():
+    return op.get_bind().dialect.name
+
+
+def upgrade():
+    if dialect() == 'mysql':
+        op.create_index('ix_game_fulltext', 'game', ['title', 'description', 'instructions'], unique=False, mysql_prefix='FULLTEXT')
+    elif dialect() == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE game_search USING fts5(title,description,instructions)")
+        op.execute("INSERT INTO game_search(rowid,title,description,instructions) SELECT id,title,description,instructions FROM game")
+
+
+def downgrade():
+    if dialect() == 'mysql':
+        op.drop_index('ix_game_fulltext', table_name='game')
+    elif dialect() == 'sqlite':
+        op.execute("DROP TABLE game_search")
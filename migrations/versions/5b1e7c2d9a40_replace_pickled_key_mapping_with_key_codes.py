@@ -0,0 +1,75 @@
+"""Replacing pickled key_mapping with fixed width key_codes column.
+
+Revision ID: 5b1e7c2d9a40
+Revises: 9af9f203aeaf
+Create Date: 2026-10-18 10:12:31.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1e7c2d9a40'
+down_revision = '9af9f203aeaf'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+CHIP8_KEY_COUNT = 16
+
+control_config = sa.table('control_config',
+    sa.column('id',sa.Integer),
+    sa.column('key_mapping',sa.PickleType),
+    sa.column('key_codes',sa.LargeBinary)
+)
+
+
+def encode_key_codes(key_mapping):
+    key_codes = bytearray(CHIP8_KEY_COUNT)
+    for key_code,hex_value in (key_mapping or {}).items():
+        chip_key = int(str(hex_value),16)
+        key_code = int(key_code)
+        if 0 <= chip_key < CHIP8_KEY_COUNT and 0 < key_code <= 255:
+            key_codes[chip_key] = key_code
+    return bytes(key_codes)
+
+def decode_key_codes(key_codes):
+    return {key_code:format(chip_key,'x') for chip_key,key_code in enumerate(key_codes or b'') if key_code}
+
+'''
+Walks the table in primary key order, converting one batch of rows at a time.
+'''
+def convert_rows(source,target,convert):
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select([control_config.c.id,control_config.c[source]])
+            .where(control_config.c.id > last_id)
+            .order_by(control_config.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            connection.execute(
+                control_config.update()
+                .where(control_config.c.id == row[0])
+                .values({target:convert(row[1])})
+            )
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    op.add_column('control_config', sa.Column('key_codes', sa.LargeBinary(length=16), nullable=True))
+    convert_rows('key_mapping','key_codes',encode_key_codes)
+    with op.batch_alter_table('control_config') as batch_op:
+        batch_op.drop_column('key_mapping')
+
+
+def downgrade():
+    op.add_column('control_config', sa.Column('key_mapping', sa.PickleType(), nullable=True))
+    convert_rows('key_codes','key_mapping',decode_key_codes)
+    with op.batch_alter_table('control_config') as batch_op:
+        batch_op.drop_column('key_codes')
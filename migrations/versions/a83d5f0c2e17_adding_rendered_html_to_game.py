@@ -0,0 +1,64 @@
+"""Adding rendered html of description and instructions to game model.
+
+Revision ID: a83d5f0c2e17
+Revises: 4e9b1f3a6c85
+Create Date: 2026-10-18 16:05:44.618230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from markupsafe import Markup
+
+
+# revision identifiers, used by Alembic.
+revision = 'a83d5f0c2e17'
+down_revision = '4e9b1f3a6c85'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+game = sa.table('game',
+    sa.column('id',sa.Integer),
+    sa.column('description',sa.Text),
+    sa.column('instructions',sa.Text),
+    sa.column('description_html',sa.Text),
+    sa.column('instructions_html',sa.Text)
+)
+
+
+def newline_to_p(text):
+    if text is None:
+        return None
+    lines_sanitized = [Markup.escape(line) for line in text.splitlines()]
+    return f"<p>{'</p><p>'.join(lines_sanitized)}</p>"
+
+
+def upgrade():
+    op.add_column('game', sa.Column('description_html', sa.Text(), nullable=True))
+    op.add_column('game', sa.Column('instructions_html', sa.Text(), nullable=True))
+    #render existing games in primary key order, one batch at a time
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select([game.c.id,game.c.description,game.c.instructions])
+            .where(game.c.id > last_id)
+            .order_by(game.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            connection.execute(
+                game.update()
+                .where(game.c.id == row[0])
+                .values(description_html=newline_to_p(row[1]),instructions_html=newline_to_p(row[2]))
+            )
+        last_id = rows[-1][0]
+
+
+def downgrade():
+    with op.batch_alter_table('game') as batch_op:
+        batch_op.drop_column('instructions_html')
+        batch_op.drop_column('description_html')
@@ -0,0 +1,28 @@
+"""Adding composite created_on,id index to game for keyset pagination.
+
+Revision ID: c3a9f0e4b812
+Revises: 5b1e7c2d9a40
+Create Date: 2026-10-18 11:02:47.518340
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from datetime import datetime
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a9f0e4b812'
+down_revision = '5b1e7c2d9a40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    #games created before timestamps were added have no created_on and cannot be paged by cursor
+    game = sa.table('game',sa.column('created_on',sa.DateTime))
+    op.execute(game.update().where(game.c.created_on == None).values(created_on=datetime(1970,1,1)))
+    op.create_index('ix_game_created_on_id', 'game', ['created_on', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_game_created_on_id', table_name='game')
@@ -0,0 +1,24 @@
+"""Adding user_id,created_on index to game for developer listings.
+
+Revision ID: e71d4b5a0c96
+Revises: c3a9f0e4b812
+Create Date: 2026-10-18 11:40:05.861274
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e71d4b5a0c96'
+down_revision = 'c3a9f0e4b812'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_game_user_id_created_on', 'game', ['user_id', 'created_on'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_game_user_id_created_on', table_name='game')
@@ -1,72 +1,198 @@
 from abc import abstractmethod
 from operator import attrgetter
-from flask import current_app
-from flask_sqlalchemy import SQLAlchemy,event
+from functools import lru_cache,partial
+from flask import Markup
+from flask_sqlalchemy import event
 from flask_security.models import fsqla_v2 as fsqla
-from sqlalchemy.orm import backref
+from sqlalchemy.orm import backref,Session,object_session
 from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy import select,func
 from datetime import datetime
-import os
-import uuid
+from instrumentation import io_timer
+from database import RoutingSQLAlchemy
+from storage import current_storage
+import hashlib
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 
 roles_users = db.Table('roles_users',
     db.Column('user_id',db.Integer,db.ForeignKey('user.id')),
     db.Column('role_id',db.Integer,db.ForeignKey('role.id'))
 )
 
+'''
+Renders text as html with one paragraph per line, escaping each line.
+'''
+def newline_to_p(text):
+    lines_sanitized = [Markup.escape(line) for line in text.splitlines()]
+    return Markup(f"<p>{'</p><p>'.join(lines_sanitized)}</p>")
+
+'''
+:returns The sha256 hex digest of bytes or of a streamed upload.
+'''
+def file_digest(file):
+    if hasattr(file,'hexdigest'):
+        return file.hexdigest()
+    return hashlib.sha256(file).hexdigest()
+
 class FileSaveMixin:
+    #bytes or an uploads.UploadedFile
     file = None
-    #used for deleting old files when a new file is uploaded
-    old_path = None
-    
+    #used for releasing the old blob when a new file is uploaded
+    old_filename = None
+
     @property
-    def path(self):
-        #make sure directory exists and make one if it doesn't
+    def key_prefix(self):
         #attempt to get per class configuration
-        classname = self.__class__.__name__.lower()
-        basedir = os.path.join(current_app.config['UPLOAD_FOLDER'],classname)
-        if not hasattr(self,'_path'):
+        return self.__class__.__name__.lower()
+
+    @property
+    def key(self):
+        #make sure that setting filename changes key
+        return self.key_for(self.filename)
+
+    '''
+    Files are stored by content hash and sharded by the first two
+    hex digits of the hash to keep directory sizes small.
+    :returns The storage key of a file, see storage.py.
+    '''
+    def key_for(self,filename):
+        filename = str(filename)
+        return f"{self.key_prefix}/{filename[:2]}/{filename}"
 
-            #attempt to create directory if it does not exit
-            if not os.path.isdir(basedir):
-                os.mkdir(basedir)
-        #make sure that setting filename changes path
-        self._path = os.path.join(basedir,str(self.filename))
-        return self._path
+    '''
+    :returns Every key stored for a filename, including files derived from it.
+    '''
+    def keys_for(self,filename):
+        return [self.key_for(filename)]
 
+    '''
+    :returns Dictionary of key:bytes for files derived from the uploaded file.
+    '''
+    def derived_files(self):
+        return {}
+
+    '''
+    Stores the uploaded file under the given key.
+    Called after the transaction that stored the row has committed.
+    '''
     @abstractmethod
-    def save(self):
+    def save(self,key):
         pass
 
 
 '''
-Generates a unique filename whenever a new file is uploaded.
-If update, saves old path for later deletion
+Buffers file writes and deletes made during a session's transaction.
+Nothing touches the disk until the transaction commits, and a rollback
+simply discards the buffer.
+'''
+class FileStaging:
+
+    def __init__(self):
+        #key -> callable that writes the file when given the key
+        self.writes = {}
+        #(table,filename,keys) of files that may no longer be referenced
+        self.releases = []
+
+    def write(self,key,writer):
+        self.writes[key] = writer
+
+    def release(self,table,filename,keys):
+        self.releases.append((table,filename,keys))
+
+    '''
+    Performs all staged writes, then removes released files that no committed
+    row references.
+
+    An upload of the same file can commit while the files are being removed, and it
+    skips writing them if they still existed when it checked.  So the references are
+    counted again once the files are gone, and the files are put back when a row
+    points at them again.
+    '''
+    def flush(self,engine):
+        storage = current_storage()
+        with io_timer():
+            for key,writer in self.writes.items():
+                if not storage.exists(key):
+                    writer(key)
+        if not self.releases:
+            return
+        #games sharing a rom release it once each, one reference count is enough
+        releases = {(table,filename):keys for table,filename,keys in self.releases}
+        with engine.connect() as connection:
+            for (table,filename),keys in releases.items():
+                keys = [key for key in keys if key not in self.writes]
+                if not keys or count_file_references(table,connection,filename):
+                    continue
+                removed = {}
+                with io_timer():
+                    for key in keys:
+                        try:
+                            removed[key] = storage.read(key)
+                        except FileNotFoundError:
+                            continue
+                        storage.delete(key)
+                if removed and count_file_references(table,connection,filename):
+                    with io_timer():
+                        for key,data in removed.items():
+                            storage.write(key,data)
+
+'''
+:returns The file staging buffer for the session the object belongs to.
+'''
+def staged_files(target):
+    session = object_session(target)
+    return session.info.setdefault('staged_files',FileStaging())
+
+@event.listens_for(Session,'after_commit')
+def flush_staged_files(session):
+    staging = session.info.pop('staged_files',None)
+    if staging is not None:
+        staging.flush(db.engine)
+
+@event.listens_for(Session,'after_rollback')
+def discard_staged_files(session):
+    session.info.pop('staged_files',None)
+
+
+'''
+Generates the content addressed filename whenever a new file is uploaded.
+If update, saves old filename so the old blob can be released.
 '''
 def generate_filename(mapper,connection,target):
     if target.file is not None:
-        #save path for later deletion
-        if target.filename is not None:
-            target.old_path = target.path
-        target.filename = uuid.uuid4().hex
+        filename = file_digest(target.file)
+        #save filename for later deletion
+        if target.filename is not None and target.filename != filename:
+            target.old_filename = target.filename
+        target.filename = filename
 
 event.listen(FileSaveMixin,'before_insert',generate_filename,propagate=True)
 event.listen(FileSaveMixin,'before_update',generate_filename,propagate=True)
 
 
+'''
+Counts the rows of a table that point at a stored file.  Every count runs in a
+transaction of its own, so it sees rows committed since the previous one.
+'''
+def count_file_references(table,connection,filename):
+    query = select([func.count()]).select_from(table).where(table.c.filename == filename)
+    with connection.begin():
+        return connection.scalar(query)
 
 '''
-Save new file if one has been uploaded.
-Delete old file during update if one exists
+Stage new file if one has been uploaded.
+Stage release of old file during update if one exists
 '''        
 def save_file(mapper,connection,target):
-    if target.file is not None:    
-        target.save()
-        if target.old_path is not None and os.path.exists(target.old_path):
-           os.remove(target.old_path)
-           target.old_path=None
+    if target.file is not None:
+        staging = staged_files(target)
+        staging.write(target.key,target.save)
+        for key,data in target.derived_files().items():
+            staging.write(key,partial(current_storage().write,data=data))
+        if target.old_filename is not None:
+            staging.release(mapper.local_table,target.old_filename,target.keys_for(target.old_filename))
+            target.old_filename = None
 
 
 event.listen(FileSaveMixin,'after_insert',save_file,propagate=True)
@@ -74,8 +200,8 @@ event.listen(FileSaveMixin,'after_update',save_file,propagate=True)
 
 @event.listens_for(FileSaveMixin,'after_delete',propagate=True)
 def delete_file(mapper,connection,target):
-    if target.path and os.path.exists(target.path):
-        os.remove(target.path)
+    if target.filename:
+        staged_files(target).release(mapper.local_table,target.filename,target.keys_for(target.filename))
 
 class User(db.Model,fsqla.FsUserMixin):
 
@@ -94,34 +220,243 @@ class Role(db.Model,fsqla.FsRoleMixin):
     description = db.Column(db.Text)
 
 class Game(db.Model,FileSaveMixin):
+    #png of the first screen drawn by a newly uploaded rom
+    thumbnail = None
+
     id = db.Column(db.Integer,primary_key=True)
     user_id = db.Column(db.Integer,db.ForeignKey('user.id'))
     title = db.Column(db.String(255),nullable=False)
     description = db.Column(db.Text)
     instructions = db.Column(db.Text)
+    #description and instructions rendered by newline_to_p whenever they are set
+    description_html = db.Column(db.Text)
+    instructions_html = db.Column(db.Text)
     filename = db.Column(db.String(255),nullable=False)
     created_on = db.Column(db.DateTime,default=datetime.now)
     last_updated = db.Column(db.DateTime,onupdate=datetime.now)
+    #results of static rom analysis, see rom_analysis.py
+    instruction_count = db.Column(db.Integer)
+    invalid_opcode_count = db.Column(db.Integer)
+    schip_required = db.Column(db.Boolean)
+    suggested_speed = db.Column(db.Integer)
+    has_thumbnail = db.Column(db.Boolean,default=False)
+    #outcome of the most recent smoke test, None when the rom passed
+    smoke_test_error = db.Column(db.Text)
+    validated_on = db.Column(db.DateTime)
+    #rolled up from play_tally by telemetry.roll_up_plays
+    play_count = db.Column(db.Integer,nullable=False,default=0,server_default='0')
+    play_seconds = db.Column(db.Integer,nullable=False,default=0,server_default='0')
     user = db.relationship('User',backref=db.backref('games',lazy='dynamic'))
 
-    def save(self):
-        hex = self.file.hex()
-        with open(self.path,'w') as writer:
-            writer.write(hex)
+    __table_args__ = (
+        #supports keyset pagination of game listings
+        db.Index('ix_game_created_on_id','created_on','id'),
+        #supports the developer dashboard and bulk delete
+        db.Index('ix_game_user_id_created_on','user_id','created_on'),
+        #supports keyset pagination of the most played games
+        db.Index('ix_game_play_count_id','play_count','id'),
+        #full text search on MySQL, see search.py.  Other databases get a plain index
+        db.Index('ix_game_fulltext','title','description','instructions',mysql_prefix='FULLTEXT'),
+    )
+
+    def save(self,key):
+        current_storage().store(key,self.file)
+
+    @property
+    def description_markup(self):
+        if self.description_html is None:
+            return newline_to_p(self.description or '')
+        return Markup(self.description_html)
+
+    @property
+    def instructions_markup(self):
+        if self.instructions_html is None:
+            return newline_to_p(self.instructions or '')
+        return Markup(self.instructions_html)
+
+    @property
+    def thumbnail_key(self):
+        return self.thumbnail_key_for(self.filename)
+
+    '''
+    Thumbnails are rendered from the rom, so they are stored under the rom's content hash.
+    '''
+    def thumbnail_key_for(self,filename):
+        filename = str(filename)
+        return f"thumbnail/{filename[:2]}/{filename}.png"
+
+    def keys_for(self,filename):
+        return [self.key_for(filename),self.thumbnail_key_for(filename)]
+
+    def derived_files(self):
+        if self.thumbnail is None:
+            return {}
+        return {self.thumbnail_key:self.thumbnail}
+
+    '''
+    Records the results of chip8.smoke_test for the current rom.
+    '''
+    def apply_smoke_test(self,result):
+        self.thumbnail = result.thumbnail
+        self.has_thumbnail = result.thumbnail is not None
+        self.smoke_test_error = result.error
+        self.validated_on = datetime.now()
 
+    '''
+    Forgets the smoke test results of the previous rom until the new one is tested.
+    '''
+    def clear_smoke_test(self):
+        self.has_thumbnail = False
+        self.smoke_test_error = None
+        self.validated_on = None
+
+    '''
+    Records the results of rom_analysis.analyze_rom for the current rom.
+    '''
+    def apply_analysis(self,analysis):
+        self.instruction_count = analysis.instruction_count
+        self.invalid_opcode_count = len(analysis.invalid_opcodes)
+        self.schip_required = analysis.schip_required
+        self.suggested_speed = analysis.suggested_speed
+
+
+@event.listens_for(Game.description,'set')
+def render_description(target,value,oldvalue,initiator):
+    target.description_html = None if value is None else str(newline_to_p(value))
+
+@event.listens_for(Game.instructions,'set')
+def render_instructions(target,value,oldvalue,initiator):
+    target.instructions_html = None if value is None else str(newline_to_p(value))
+
+
+CHIP8_KEY_COUNT = 16
+
+'''
+Encodes a {key_code:hex_value} mapping as 16 bytes, where byte n holds the
+key code mapped to chip 8 key n and zero marks an unmapped key.
+Each chip 8 key holds a single key code, matching the emulator's hex_value:key format.
+:raises ValueError if a hex value or key code is out of range or a chip 8 key is mapped twice.
+'''
+def encode_key_codes(key_mapping):
+    key_codes = bytearray(CHIP8_KEY_COUNT)
+    for key_code,hex_value in key_mapping.items():
+        chip_key = int(str(hex_value),16)
+        key_code = int(key_code)
+        if not 0 <= chip_key < CHIP8_KEY_COUNT:
+            raise ValueError(f"{hex_value} is not a chip 8 key.")
+        if not 0 < key_code <= 255:
+            raise ValueError(f"{key_code} is not a valid key code.")
+        if key_codes[chip_key]:
+            raise ValueError(f"Chip 8 key {hex_value} is mapped to more than one key code.")
+        key_codes[chip_key] = key_code
+    return bytes(key_codes)
+
+'''
+Decodes stored key codes into the emulator format of {hex_value:key_code}.
+Results are memoized by value, so repeated reads do not rebuild the mapping.
+'''
+@lru_cache(maxsize=4096)
+def decode_key_codes(key_codes):
+    return {format(chip_key,'x'):key_code for chip_key,key_code in enumerate(key_codes) if key_code}
 
 class ControlConfig(db.Model):
     id = db.Column(db.Integer,primary_key=True)
     game_id = db.Column(db.Integer,db.ForeignKey('game.id'))
     emulator_speed = db.Column(db.Integer,default=1000)
-    key_mapping = db.Column(db.PickleType())
+    key_codes = db.Column(db.LargeBinary(CHIP8_KEY_COUNT))
     game = db.relationship('Game',uselist=False,backref=db.backref('control_config',lazy='dynamic'))
 
+    '''
+    :returns Dictionary of key codes indexed by chip 8 hex value.
+    '''
+    @property
+    def key_map(self):
+        if self.key_codes is None:
+            return {}
+        return dict(decode_key_codes(bytes(self.key_codes)))
+
+    '''
+    :returns Dictionary of chip 8 hex values indexed by key code, as used by the upload form.
+    '''
+    @property
+    def key_mapping(self):
+        return {key_code:hex_value for hex_value,key_code in self.key_map.items()}
+
+    @key_mapping.setter
+    def key_mapping(self,key_mapping):
+        self.key_codes = encode_key_codes(key_mapping)
 
-    
 
+'''
+Background work queued by requests, see jobs.py.
+'''
+class Job(db.Model):
+    id = db.Column(db.Integer,primary_key=True)
+    #task name and the id of the row it works on
+    name = db.Column(db.String(64),nullable=False)
+    key = db.Column(db.Integer,nullable=False)
+    status = db.Column(db.String(16),nullable=False)
+    attempts = db.Column(db.Integer,nullable=False,default=0)
+    run_after = db.Column(db.DateTime,nullable=False,default=datetime.now)
+    #worker holding the job and when its claim expires
+    worker = db.Column(db.String(255))
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_on = db.Column(db.DateTime,default=datetime.now)
 
+    __table_args__ = (
+        #supports claiming the next due job and finding queued duplicates
+        db.Index('ix_job_status_run_after','status','run_after'),
+        db.Index('ix_job_name_key','name','key'),
+    )
 
 
+'''
+Plays and seconds played of a game, added by one telemetry flush and not yet rolled up
+into the game.  Rows are only ever inserted and then deleted by the roll up, so busy
+games never make requests wait on locks of their game row.
+'''
+class PlayTally(db.Model):
+    id = db.Column(db.Integer,primary_key=True)
+    game_id = db.Column(db.Integer,nullable=False)
+    plays = db.Column(db.Integer,nullable=False)
+    seconds = db.Column(db.Integer,nullable=False)
+    created_on = db.Column(db.DateTime,default=datetime.now)
+
+
+'''
+Emulator state a player saved in one of their slots for a game, encoded by
+save_states.encode_state against the rom named by filename.
+'''
+class SaveState(db.Model):
+    id = db.Column(db.Integer,primary_key=True)
+    user_id = db.Column(db.Integer,db.ForeignKey('user.id',ondelete='CASCADE'),nullable=False)
+    game_id = db.Column(db.Integer,db.ForeignKey('game.id',ondelete='CASCADE'),nullable=False)
+    slot = db.Column(db.Integer,nullable=False)
+    #the rom the state was saved against, states of a replaced rom cannot be restored
+    filename = db.Column(db.String(255),nullable=False)
+    data = db.Column(db.LargeBinary,nullable=False)
+    created_on = db.Column(db.DateTime,default=datetime.now)
+    last_updated = db.Column(db.DateTime,onupdate=datetime.now)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id','game_id','slot',name='uq_save_state_user_id_game_id_slot'),
+    )
+
+
+'''
+The best score of a player in a game, see leaderboards.py.
+'''
+class HighScore(db.Model):
+    id = db.Column(db.Integer,primary_key=True)
+    game_id = db.Column(db.Integer,db.ForeignKey('game.id',ondelete='CASCADE'),nullable=False)
+    user_id = db.Column(db.Integer,db.ForeignKey('user.id',ondelete='CASCADE'),nullable=False)
+    score = db.Column(db.Integer,nullable=False)
+    achieved_on = db.Column(db.DateTime,nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('game_id','user_id',name='uq_high_score_game_id_user_id'),
+    )
 
-        
+#supports the top scores of a game, best first with ties going to whoever got there first
+db.Index('ix_high_score_game_id_score',HighScore.game_id,HighScore.score.desc(),HighScore.achieved_on)
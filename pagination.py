@@ -0,0 +1,120 @@
+from sqlalchemy import and_,or_
+from datetime import datetime
+from threading import Lock
+import base64
+import time
+
+#column a listing can be ordered by and how its cursor values are read back
+SORT_PARSERS = {
+    'created_on':datetime.fromisoformat,
+    'play_count':int,
+}
+
+'''
+Encodes a position in a sort column,id ordering as an opaque url safe token.
+:param value Value of the sort column, a datetime or an integer.
+'''
+def encode_cursor(value,id,direction):
+    if isinstance(value,datetime):
+        value = value.isoformat()
+    raw = f"{direction}|{value}|{id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+'''
+:param parse Reads the sort column value back from its string.
+:returns Tuple of (direction,value,id) or None if the token is not a valid cursor.
+'''
+def decode_cursor(token,parse=datetime.fromisoformat):
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        direction,value,id = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        if direction not in ('next','prev'):
+            return None
+        return direction,parse(value),int(id)
+    except ValueError:
+        return None
+
+
+'''
+Keyset pagination over a query ordered descending by a sort column and id, newest
+first by created_on unless sort names another column of SORT_PARSERS.
+Pages are located by comparing against the last seen row instead of an offset,
+so deep pages cost the same as the first one when backed by an index on (sort,id).
+
+Exposes has_prev, has_next, prev_cursor and next_cursor for _pagination.html.
+'''
+class KeysetPagination:
+
+    def __init__(self,query,model,cursor=None,per_page=20,total=None,sort='created_on'):
+        self.per_page = per_page
+        self.total = total
+        self.sort = sort
+        column = getattr(model,sort)
+        id = model.id
+        position = decode_cursor(cursor,SORT_PARSERS[sort])
+        if position is None:
+            rows = query.order_by(column.desc(),id.desc()).limit(per_page + 1).all()
+            self.has_prev = False
+            self.has_next = len(rows) > per_page
+            self.items = rows[:per_page]
+        else:
+            direction,last_value,last_id = position
+            if direction == 'next':
+                query = query.filter(or_(column < last_value,and_(column == last_value,id < last_id)))
+                rows = query.order_by(column.desc(),id.desc()).limit(per_page + 1).all()
+                self.has_prev = True
+                self.has_next = len(rows) > per_page
+                self.items = rows[:per_page]
+            else:
+                query = query.filter(or_(column > last_value,and_(column == last_value,id > last_id)))
+                rows = query.order_by(column.asc(),id.asc()).limit(per_page + 1).all()
+                self.has_prev = len(rows) > per_page
+                self.has_next = True
+                #rows were read in ascending order so flip back to descending
+                self.items = list(reversed(rows[:per_page]))
+
+    @property
+    def next_cursor(self):
+        if not self.has_next or not self.items:
+            return None
+        last = self.items[-1]
+        return encode_cursor(getattr(last,self.sort),last.id,'next')
+
+    @property
+    def prev_cursor(self):
+        if not self.has_prev or not self.items:
+            return None
+        first = self.items[0]
+        return encode_cursor(getattr(first,self.sort),first.id,'prev')
+
+
+'''
+Caches row counts for a number of seconds so listings can show an
+approximate total without running COUNT(*) on every page view.
+'''
+class ApproximateCounter:
+
+    def __init__(self,ttl=300):
+        self.ttl = ttl
+        self._counts = {}
+        self._lock = Lock()
+
+    def count(self,key,query):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._counts.get(key)
+        if cached is not None and now - cached[1] < self.ttl:
+            return cached[0]
+        total = query.order_by(None).count()
+        with self._lock:
+            self._counts[key] = (total,now)
+        return total
+
+    def invalidate(self,key=None):
+        with self._lock:
+            if key is None:
+                self._counts.clear()
+            else:
+                self._counts.pop(key,None)
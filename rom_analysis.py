@@ -0,0 +1,207 @@
+from array import array
+from collections import namedtuple
+
+'''
+Static analysis of chip 8 roms.
+
+Every 16 bit opcode is decoded once, at import, into a lookup table of instruction ids,
+so analysing a rom is a table lookup per reachable instruction.  Control flow is
+followed from the program start to find reachable code without executing it.
+'''
+
+PROGRAM_START = 0x200
+MEMORY_SIZE = 4096
+MAX_ROM_SIZE = MEMORY_SIZE - PROGRAM_START
+
+#how control leaves an instruction
+NEXT = 0        #falls through to the next instruction
+SKIP = 1        #may skip the next instruction
+JUMP = 2        #jumps to the encoded address
+CALL = 3        #calls the encoded address and returns to the next instruction
+RETURN = 4      #returns to the caller
+INDIRECT = 5    #jumps to an address computed at runtime
+HALT = 6        #stops the interpreter
+
+Instruction = namedtuple('Instruction',['mnemonic','flow','schip'])
+
+INSTRUCTIONS = (
+    Instruction('INVALID',HALT,False),
+    Instruction('CLS',NEXT,False),
+    Instruction('RET',RETURN,False),
+    #calls machine code on the original interpreters, emulators ignore it
+    Instruction('SYS addr',NEXT,False),
+    Instruction('JP addr',JUMP,False),
+    Instruction('CALL addr',CALL,False),
+    Instruction('SE Vx, byte',SKIP,False),
+    Instruction('SNE Vx, byte',SKIP,False),
+    Instruction('SE Vx, Vy',SKIP,False),
+    Instruction('LD Vx, byte',NEXT,False),
+    Instruction('ADD Vx, byte',NEXT,False),
+    Instruction('LD Vx, Vy',NEXT,False),
+    Instruction('OR Vx, Vy',NEXT,False),
+    Instruction('AND Vx, Vy',NEXT,False),
+    Instruction('XOR Vx, Vy',NEXT,False),
+    Instruction('ADD Vx, Vy',NEXT,False),
+    Instruction('SUB Vx, Vy',NEXT,False),
+    Instruction('SHR Vx',NEXT,False),
+    Instruction('SUBN Vx, Vy',NEXT,False),
+    Instruction('SHL Vx',NEXT,False),
+    Instruction('SNE Vx, Vy',SKIP,False),
+    Instruction('LD I, addr',NEXT,False),
+    Instruction('JP V0, addr',INDIRECT,False),
+    Instruction('RND Vx, byte',NEXT,False),
+    Instruction('DRW Vx, Vy, nibble',NEXT,False),
+    Instruction('SKP Vx',SKIP,False),
+    Instruction('SKNP Vx',SKIP,False),
+    Instruction('LD Vx, DT',NEXT,False),
+    Instruction('LD Vx, K',NEXT,False),
+    Instruction('LD DT, Vx',NEXT,False),
+    Instruction('LD ST, Vx',NEXT,False),
+    Instruction('ADD I, Vx',NEXT,False),
+    Instruction('LD F, Vx',NEXT,False),
+    Instruction('LD B, Vx',NEXT,False),
+    Instruction('LD [I], Vx',NEXT,False),
+    Instruction('LD Vx, [I]',NEXT,False),
+    #super chip extensions
+    Instruction('SCD nibble',NEXT,True),
+    Instruction('SCR',NEXT,True),
+    Instruction('SCL',NEXT,True),
+    Instruction('EXIT',HALT,True),
+    Instruction('LOW',NEXT,True),
+    Instruction('HIGH',NEXT,True),
+    Instruction('DRW Vx, Vy, 0',NEXT,True),
+    Instruction('LD HF, Vx',NEXT,True),
+    Instruction('LD R, Vx',NEXT,True),
+    Instruction('LD Vx, R',NEXT,True),
+)
+
+INSTRUCTION_IDS = {instruction.mnemonic:id for id,instruction in enumerate(INSTRUCTIONS)}
+
+ALU_OPERATIONS = {0x0:'LD Vx, Vy',0x1:'OR Vx, Vy',0x2:'AND Vx, Vy',0x3:'XOR Vx, Vy',0x4:'ADD Vx, Vy',
+                  0x5:'SUB Vx, Vy',0x6:'SHR Vx',0x7:'SUBN Vx, Vy',0xE:'SHL Vx'}
+KEY_OPERATIONS = {0x9E:'SKP Vx',0xA1:'SKNP Vx'}
+MISC_OPERATIONS = {0x07:'LD Vx, DT',0x0A:'LD Vx, K',0x15:'LD DT, Vx',0x18:'LD ST, Vx',0x1E:'ADD I, Vx',
+                   0x29:'LD F, Vx',0x30:'LD HF, Vx',0x33:'LD B, Vx',0x55:'LD [I], Vx',0x65:'LD Vx, [I]',
+                   0x75:'LD R, Vx',0x85:'LD Vx, R'}
+SYSTEM_OPERATIONS = {0x0E0:'CLS',0x0EE:'RET',0x0FB:'SCR',0x0FC:'SCL',0x0FD:'EXIT',0x0FE:'LOW',0x0FF:'HIGH'}
+
+def _decode_slow(opcode):
+    group = opcode >> 12
+    low_nibble = opcode & 0xF
+    low_byte = opcode & 0xFF
+    if group == 0x0:
+        if opcode & 0xFF0 == 0x0C0:
+            return 'SCD nibble'
+        return SYSTEM_OPERATIONS.get(opcode & 0xFFF,'SYS addr')
+    if group == 0x5:
+        return 'SE Vx, Vy' if low_nibble == 0 else 'INVALID'
+    if group == 0x8:
+        return ALU_OPERATIONS.get(low_nibble,'INVALID')
+    if group == 0x9:
+        return 'SNE Vx, Vy' if low_nibble == 0 else 'INVALID'
+    if group == 0xD:
+        return 'DRW Vx, Vy, 0' if low_nibble == 0 else 'DRW Vx, Vy, nibble'
+    if group == 0xE:
+        return KEY_OPERATIONS.get(low_byte,'INVALID')
+    if group == 0xF:
+        return MISC_OPERATIONS.get(low_byte,'INVALID')
+    return ('JP addr','CALL addr','SE Vx, byte','SNE Vx, byte',None,'LD Vx, byte','ADD Vx, byte',
+            None,None,'LD I, addr','JP V0, addr','RND Vx, byte')[group - 1]
+
+#instruction id for every possible opcode
+DECODE_TABLE = array('B',(INSTRUCTION_IDS[_decode_slow(opcode)] for opcode in range(0x10000)))
+
+'''
+:returns The Instruction an opcode decodes to.
+'''
+def decode(opcode):
+    return INSTRUCTIONS[DECODE_TABLE[opcode]]
+
+
+RomAnalysis = namedtuple('RomAnalysis',['instruction_count','schip_required','invalid_opcodes','fatal_opcode','indirect_jumps','suggested_speed'])
+
+#super chip games were written for the faster HP48 calculators
+DEFAULT_SPEED = 1000
+SCHIP_SPEED = 2000
+
+'''
+Follows the path every run of the rom takes, from the program start up to the first
+instruction whose outcome depends on runtime state.
+:returns (address,opcode) of an invalid opcode on that path or None.
+'''
+def _find_fatal_opcode(memory,end):
+    visited = set()
+    address = PROGRAM_START
+    while address not in visited:
+        visited.add(address)
+        if address + 1 >= end:
+            return (address,None)
+        offset = address - PROGRAM_START
+        opcode = memory[offset] << 8 | memory[offset + 1]
+        instruction = INSTRUCTIONS[DECODE_TABLE[opcode]]
+        if instruction.mnemonic == 'INVALID':
+            return (address,opcode)
+        if instruction.flow == NEXT:
+            address += 2
+        elif instruction.flow in (JUMP,CALL):
+            address = opcode & 0xFFF
+            if address < PROGRAM_START:
+                return (address,None)
+        else:
+            return None
+    return None
+
+'''
+Decodes every instruction reachable from the program start.
+
+:param rom Bytes of the rom as loaded at 0x200.
+:returns RomAnalysis where invalid_opcodes is a list of (address,opcode) tuples for
+    reachable opcodes that no interpreter supports, including execution running off the end of the rom,
+    and fatal_opcode is the first of those that every run of the rom executes.
+'''
+def analyze_rom(rom):
+    memory = bytes(rom[:MAX_ROM_SIZE])
+    end = PROGRAM_START + len(memory)
+    decode_table = DECODE_TABLE
+    instructions = INSTRUCTIONS
+    visited = set()
+    invalid_opcodes = []
+    schip_required = False
+    indirect_jumps = 0
+    pending = [PROGRAM_START]
+    while pending:
+        address = pending.pop()
+        if address in visited:
+            continue
+        visited.add(address)
+        if address < PROGRAM_START or address + 1 >= end:
+            invalid_opcodes.append((address,None))
+            continue
+        offset = address - PROGRAM_START
+        opcode = memory[offset] << 8 | memory[offset + 1]
+        instruction = instructions[decode_table[opcode]]
+        schip_required = schip_required or instruction.schip
+        flow = instruction.flow
+        if flow == NEXT:
+            pending.append(address + 2)
+        elif flow == SKIP:
+            pending.append(address + 2)
+            pending.append(address + 4)
+        elif flow == JUMP:
+            pending.append(opcode & 0xFFF)
+        elif flow == CALL:
+            pending.append(opcode & 0xFFF)
+            pending.append(address + 2)
+        elif flow == INDIRECT:
+            indirect_jumps += 1
+        elif instruction.mnemonic == 'INVALID':
+            invalid_opcodes.append((address,opcode))
+    instruction_count = len(visited) - len(invalid_opcodes)
+    return RomAnalysis(
+        instruction_count=instruction_count,
+        schip_required=schip_required,
+        invalid_opcodes=sorted(invalid_opcodes,key=lambda entry:entry[0]),
+        fatal_opcode=_find_fatal_opcode(memory,end),
+        indirect_jumps=indirect_jumps,
+        suggested_speed=SCHIP_SPEED if schip_required else DEFAULT_SPEED
+    )
@@ -0,0 +1,143 @@
+from chip8 import CHIP_8_FONT,SUPER_CHIP_FONT,CHIP_8_FONT_SIZE,SUPER_CHIP_FONT_SIZE,MEMORY_SIZE,PROGRAM_START
+from collections import namedtuple
+import struct
+import zlib
+
+'''
+Save states of the emulator and the compact encoding they are stored in.
+
+The player uploads and downloads states in the raw layout written by Chip8.saveState in
+static/javascript/emulator/chip8.js, fields in big endian order:
+
+    pc, i, sp       unsigned 16 bit, sp counting the return addresses that follow
+    dt, st          unsigned 8 bit timers
+    flags           unsigned 8 bit, bit 0 set in super chip extended mode
+    v               16 bytes of registers
+    stack           sp unsigned 16 bit return addresses
+    vram            1024 bytes, the screen bitplane
+    memory          4096 bytes
+
+Stored states are the magic bytes C8SS and a version byte followed by a zlib stream of
+the same layout, except that memory is replaced by a 16 bit mask of the 256 byte pages
+that differ from the memory the rom starts with and those pages alone.  Fonts, code and
+untouched memory cost nothing, so a stored state is usually a few hundred bytes.
+Decoding needs the rom the state was saved against.
+'''
+
+MAGIC = b'C8SS'
+VERSION = 1
+
+HEADER = struct.Struct('>HHHBBB')
+REGISTER_COUNT = 16
+#size of the call stack in chip8.js
+MAX_STACK_DEPTH = 256
+VRAM_SIZE = 16 * 64
+PAGE_SIZE = 256
+PAGE_COUNT = MEMORY_SIZE // PAGE_SIZE
+EXTENDED_FLAG = 0x01
+
+MAX_RAW_SIZE = HEADER.size + REGISTER_COUNT + 2 * MAX_STACK_DEPTH + VRAM_SIZE + MEMORY_SIZE
+
+EmulatorState = namedtuple('EmulatorState',('pc','i','dt','st','extended','v','stack','vram','memory'))
+
+'''
+:returns The memory of the emulator right after the rom is loaded.
+'''
+def initial_memory(rom):
+    memory = bytearray(MEMORY_SIZE)
+    memory[0:CHIP_8_FONT_SIZE] = CHIP_8_FONT[:CHIP_8_FONT_SIZE]
+    memory[CHIP_8_FONT_SIZE:CHIP_8_FONT_SIZE + SUPER_CHIP_FONT_SIZE] = SUPER_CHIP_FONT[:SUPER_CHIP_FONT_SIZE]
+    rom = rom[:MEMORY_SIZE - PROGRAM_START]
+    memory[PROGRAM_START:PROGRAM_START + len(rom)] = rom
+    return bytes(memory)
+
+'''
+Reads the registers, stack and screen, returning the offset memory or the page mask starts at.
+'''
+def _parse_registers(data):
+    if len(data) < HEADER.size + REGISTER_COUNT:
+        raise ValueError('The save state is truncated.')
+    pc,i,sp,dt,st,flags = HEADER.unpack_from(data)
+    if pc >= MEMORY_SIZE or i >= MEMORY_SIZE:
+        raise ValueError('The save state holds an address outside of memory.')
+    if sp > MAX_STACK_DEPTH:
+        raise ValueError('The save state holds too many return addresses.')
+    offset = HEADER.size
+    v = bytes(data[offset:offset + REGISTER_COUNT])
+    offset += REGISTER_COUNT
+    if len(data) < offset + 2 * sp + VRAM_SIZE:
+        raise ValueError('The save state is truncated.')
+    stack = struct.unpack_from(f">{sp}H",data,offset)
+    offset += 2 * sp
+    vram = bytes(data[offset:offset + VRAM_SIZE])
+    offset += VRAM_SIZE
+    return EmulatorState(pc,i,dt,st,bool(flags & EXTENDED_FLAG),v,stack,vram,None),offset
+
+def _pack_registers(state):
+    return b''.join((
+        HEADER.pack(state.pc,state.i,len(state.stack),state.dt,state.st,EXTENDED_FLAG if state.extended else 0),
+        state.v,
+        struct.pack(f">{len(state.stack)}H",*state.stack),
+        state.vram,
+    ))
+
+'''
+:param data State in the raw layout.
+:raises ValueError if the data is not a complete state.
+'''
+def parse_state(data):
+    state,offset = _parse_registers(data)
+    if len(data) != offset + MEMORY_SIZE:
+        raise ValueError(f"A save state holds {MEMORY_SIZE} bytes of memory.")
+    return state._replace(memory=bytes(data[offset:]))
+
+'''
+:returns The state in the raw layout.
+'''
+def serialize_state(state):
+    return _pack_registers(state) + state.memory
+
+'''
+:param rom The rom the game was running, which memory pages are compared against.
+:returns The stored encoding of a state.
+'''
+def encode_state(state,rom):
+    base = initial_memory(rom)
+    mask = 0
+    pages = []
+    for page in range(PAGE_COUNT):
+        start = page * PAGE_SIZE
+        if state.memory[start:start + PAGE_SIZE] != base[start:start + PAGE_SIZE]:
+            mask |= 1 << page
+            pages.append(state.memory[start:start + PAGE_SIZE])
+    payload = _pack_registers(state) + struct.pack('>H',mask) + b''.join(pages)
+    return MAGIC + struct.pack('>B',VERSION) + zlib.compress(payload,9)
+
+'''
+:param rom The rom the state was saved against.
+:raises ValueError if data is not a stored state of this version.
+'''
+def decode_state(data,rom):
+    if data[:len(MAGIC)] != MAGIC or len(data) < len(MAGIC) + 1 or data[len(MAGIC)] != VERSION:
+        raise ValueError('Not a version 1 save state.')
+    #bounded, so a corrupt stream cannot inflate without limit
+    decompressor = zlib.decompressobj()
+    try:
+        payload = decompressor.decompress(data[len(MAGIC) + 1:],MAX_RAW_SIZE + 2)
+    except zlib.error as e:
+        raise ValueError('The save state is corrupt.') from e
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise ValueError('The save state is corrupt.')
+    state,offset = _parse_registers(payload)
+    if len(payload) < offset + 2:
+        raise ValueError('The save state is truncated.')
+    mask, = struct.unpack_from('>H',payload,offset)
+    offset += 2
+    memory = bytearray(initial_memory(rom))
+    for page in range(PAGE_COUNT):
+        if mask & 1 << page:
+            if len(payload) < offset + PAGE_SIZE:
+                raise ValueError('The save state is truncated.')
+            memory[page * PAGE_SIZE:(page + 1) * PAGE_SIZE] = payload[offset:offset + PAGE_SIZE]
+            offset += PAGE_SIZE
+    return state._replace(memory=bytes(memory))
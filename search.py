@@ -0,0 +1,162 @@
+from sqlalchemy import text,bindparam,event,DDL
+import re
+
+'''
+Full text search over game titles, descriptions and instructions.
+
+MySQL databases use the FULLTEXT index on the game table, which the server keeps
+up to date on its own.  SQLite databases use an FTS5 table, created alongside the
+game table, that is updated by the same write paths that store games.
+'''
+
+#title matches count more than description matches, which count more than instructions
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 2.0
+INSTRUCTIONS_WEIGHT = 1.0
+
+'''
+Splits user input into search terms, dropping any search engine operators.
+'''
+def tokenize(query):
+    return re.findall(r'\w+',query.lower())
+
+#innodb_ft_min_token_size and the InnoDB default stopword list, words the FULLTEXT index
+#holds no entries for, so a required term made of one would match nothing
+MYSQL_MIN_TOKEN_SIZE = 3
+MYSQL_STOPWORDS = frozenset(('a','about','an','are','as','at','be','by','com','de','en','for','from','how','i','in',
+                             'is','it','la','of','on','or','that','the','this','to','was','what','when','where',
+                             'who','will','with','und','www'))
+
+
+class MySQLSearchBackend:
+
+    match = "MATCH(title,description,instructions) AGAINST(:query IN BOOLEAN MODE)"
+
+    '''
+    :param min_token_size The server's innodb_ft_min_token_size, or ft_min_word_len for MyISAM tables.
+    :param stopwords The server's stopword list.
+    '''
+    def __init__(self,min_token_size=MYSQL_MIN_TOKEN_SIZE,stopwords=MYSQL_STOPWORDS):
+        self.min_token_size = min_token_size
+        self.stopwords = stopwords
+
+    def search(self,session,terms,offset,limit):
+        terms = [term for term in terms if len(term) >= self.min_token_size and term not in self.stopwords]
+        if not terms:
+            return []
+        #every term is required and matches as a prefix
+        query = ' '.join(f"+{term}*" for term in terms)
+        statement = text(f"SELECT id FROM game WHERE {self.match} ORDER BY {self.match} DESC, id DESC LIMIT :limit OFFSET :offset")
+        return [row[0] for row in session.execute(statement,{'query':query,'limit':limit,'offset':offset})]
+
+    #the FULLTEXT index is maintained by the server
+    def index_game(self,session,game):
+        pass
+
+    def remove_games(self,session,ids):
+        pass
+
+    def rebuild(self,session):
+        pass
+
+
+class SQLiteSearchBackend:
+
+    table = 'game_search'
+    create_table = DDL(f"CREATE VIRTUAL TABLE {table} USING fts5(title,description,instructions)")
+    drop_table = DDL(f"DROP TABLE IF EXISTS {table}")
+
+    def rebuild(self,session):
+        session.execute(text(f"DELETE FROM {self.table}"))
+        session.execute(text(f"INSERT INTO {self.table}(rowid,title,description,instructions) SELECT id,title,description,instructions FROM game"))
+
+    def search(self,session,terms,offset,limit):
+        #quoted terms followed by * are prefix queries, implicitly joined by AND
+        query = ' '.join(f'"{term}"*' for term in terms)
+        statement = text(f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH :query "
+                         f"ORDER BY bm25({self.table},{TITLE_WEIGHT},{DESCRIPTION_WEIGHT},{INSTRUCTIONS_WEIGHT}), rowid DESC "
+                         "LIMIT :limit OFFSET :offset")
+        return [row[0] for row in session.execute(statement,{'query':query,'limit':limit,'offset':offset})]
+
+    def index_game(self,session,game):
+        self.remove_games(session,[game.id])
+        session.execute(text(f"INSERT INTO {self.table}(rowid,title,description,instructions) VALUES (:id,:title,:description,:instructions)"),
+                        {'id':game.id,'title':game.title,'description':game.description,'instructions':game.instructions})
+
+    def remove_games(self,session,ids):
+        statement = text(f"DELETE FROM {self.table} WHERE rowid IN :ids").bindparams(bindparam('ids',expanding=True))
+        session.execute(statement,{'ids':list(ids)})
+
+
+'''
+Chooses a search backend by the dialect of the database holding the game table.
+Index updates run on the caller's session so they commit or roll back with the game.
+'''
+class GameSearch:
+
+    def __init__(self,db,table):
+        self.db = db
+        self._backends = {}
+        #create and drop the FTS5 table whenever the game table is
+        event.listen(table,'after_create',SQLiteSearchBackend.create_table.execute_if(dialect='sqlite'))
+        event.listen(table,'before_drop',SQLiteSearchBackend.drop_table.execute_if(dialect='sqlite'))
+
+    def _backend(self):
+        dialect = self.db.session.get_bind().dialect.name
+        if dialect not in self._backends:
+            if dialect == 'mysql':
+                self._backends[dialect] = MySQLSearchBackend()
+            elif dialect == 'sqlite':
+                self._backends[dialect] = SQLiteSearchBackend()
+            else:
+                raise RuntimeError(f"Full text search is not supported for {dialect} databases.")
+        return self._backends[dialect]
+
+    '''
+    :returns List of matching game ids ordered by relevance.
+    '''
+    def search(self,query,offset=0,limit=20):
+        terms = tokenize(query)
+        if not terms:
+            return []
+        return self._backend().search(self.db.session,terms,offset,limit)
+
+    '''
+    Adds or refreshes a game in the index.  The game must have been flushed so it has an id.
+    '''
+    def index_game(self,game):
+        self._backend().index_game(self.db.session,game)
+
+    def remove_games(self,ids):
+        if ids:
+            self._backend().remove_games(self.db.session,ids)
+
+    def rebuild(self):
+        self._backend().rebuild(self.db.session)
+
+
+'''
+Offset pagination for ranked search results.  Fetches one extra id to find out
+whether a next page exists instead of counting every match.  The cursors are page
+numbers, passed as the page argument rather than the keyset cursor of pagination.py.
+'''
+class SearchPagination:
+
+    def __init__(self,game_search,model,query,page=1,per_page=20):
+        self.page = max(page,1)
+        self.per_page = per_page
+        self.total = None
+        ids = game_search.search(query,(self.page - 1) * per_page,per_page + 1)
+        self.has_prev = self.page > 1
+        self.has_next = len(ids) > per_page
+        ids = ids[:per_page]
+        games = {game.id:game for game in model.query.filter(model.id.in_(ids))} if ids else {}
+        self.items = [games[id] for id in ids if id in games]
+
+    @property
+    def prev_cursor(self):
+        return self.page - 1 if self.has_prev else None
+
+    @property
+    def next_cursor(self):
+        return self.page + 1 if self.has_next else None
@@ -4,6 +4,7 @@ export {Chip8, VRam};
 const CHIP_8_FONT_SIZE = 80;
 const SUPER_CHIP_FONT_SIZE = 320;
 const programOffset = 0x200;
+const SAVE_STATE_EXTENDED_FLAG = 0x01;
 export default class Chip8{
 
     constructor(){
@@ -117,6 +118,71 @@ export default class Chip8{
         this._pressedKeys.fill(false);
     }
 
+    /**
+     * Captures the registers, stack, screen and memory in the raw save state
+     * layout described in save_states.py.
+     * @returns {Uint8Array}
+     */
+    saveState(){
+        const depth = Math.min(this.sp,this.callStack.length);
+        const headerSize = 9;
+        const state = new Uint8Array(headerSize + this.vReg.length + 2 * depth + this.vram.ram.length + this.ram.length);
+        const view = new DataView(state.buffer);
+        view.setUint16(0,this._pc);
+        view.setUint16(2,this._i);
+        view.setUint16(4,depth);
+        view.setUint8(6,this._dt);
+        view.setUint8(7,this._st);
+        view.setUint8(8,this.vram.extendedMode ? SAVE_STATE_EXTENDED_FLAG : 0);
+        let offset = headerSize;
+        state.set(this.vReg,offset);
+        offset += this.vReg.length;
+        for(let i = 0; i < depth; i++){
+            view.setUint16(offset,this.callStack[i]);
+            offset += 2;
+        }
+        state.set(this.vram.ram,offset);
+        offset += this.vram.ram.length;
+        state.set(this.ram,offset);
+        return state;
+    }
+
+    /**
+     * Restores a state captured by saveState.
+     * @param {Uint8Array} state
+     */
+    loadState(state){
+        const view = new DataView(state.buffer,state.byteOffset,state.byteLength);
+        const depth = view.getUint16(4);
+        const headerSize = 9;
+        let offset = headerSize;
+        if(state.length !== headerSize + this.vReg.length + 2 * depth + this.vram.ram.length + 4096){
+            throw new Error('The save state is not in a supported format.');
+        }
+        this.reset();
+        this._pc = view.getUint16(0);
+        this._i = view.getUint16(2);
+        this.sp = depth;
+        if(view.getUint8(8) & SAVE_STATE_EXTENDED_FLAG){
+            this.vram.enableExtendedMode();
+        }
+        else{
+            this.vram.disableExtendedMode();
+        }
+        this.vReg.set(state.subarray(offset,offset + this.vReg.length));
+        offset += this.vReg.length;
+        for(let i = 0; i < depth; i++){
+            this.callStack[i] = view.getUint16(offset);
+            offset += 2;
+        }
+        this.vram.ram.set(state.subarray(offset,offset + this.vram.ram.length));
+        offset += this.vram.ram.length;
+        this.ram = new Uint8Array(state.subarray(offset));
+        //the setters start the countdown of running timers
+        this.dt = view.getUint8(6);
+        this.st = view.getUint8(7);
+    }
+
     get i(){
         return this._i;
     }
@@ -88,6 +88,20 @@ export class Chip8Emulator{
 
     }
 
+    /**
+     * @returns {Uint8Array} The running game's state, see Chip8.saveState.
+     */
+    saveState(){
+        return this.cpu.saveState();
+    }
+
+    /**
+     * @param {Uint8Array} state A state returned by saveState.
+     */
+    loadState(state){
+        this.cpu.loadState(state);
+    }
+
     addCallback(func){
         this.cpu.addCallback(func);
     }
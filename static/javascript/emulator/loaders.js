@@ -1,4 +1,4 @@
-export {loadGame};
+export {loadGame,loadBundle};
 
 async function downloadBinaryFile(fileURL){
     const response = await fetch(fileURL);
@@ -37,25 +37,65 @@ export default function loadGame(emulator,chip8FontURL,superChipFontURL,romURL){
             emulator.superChipFont = await downloadBinaryFile(superChipFontURL);        }());
     }
     promises.push(async function(){
-        let response = await fetch(romURL);
-        if(!response.ok){
-            throw new Error(`Unable to download rom ${romURL}`);
-        }
-        let romHexString = await response.text();
-        emulator.rom = hexStringToBinary(romHexString);
-
+        emulator.rom = await downloadBinaryFile(romURL);
     }());
     return Promise.all(promises).then(()=>{emulator.startRom()});
     
 }
 
-function hexStringToBinary(hexString){
-    //hex strings are double the file size of original binary representation
-    let binary = new Uint8Array(Math.ceil(hexString.length/2));
-    for(let i = 0; i < binary.length; i++){
-        let stringStart = i*2;
-        let stringEnd = stringStart+2;
-        binary[i] = parseInt(hexString.slice(stringStart,stringEnd),16);
+
+const BUNDLE_MAGIC = 'C8BN';
+const BUNDLE_VERSION = 1;
+
+/**
+ * Splits a game bundle into its sections.  The layout is described in game_bundle.py.
+ *
+ * @param {ArrayBuffer} buffer
+ * @return {Object} The parsed config and the fonts and rom as Uint8Arrays.
+ */
+function parseBundle(buffer){
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(...new Uint8Array(buffer,0,BUNDLE_MAGIC.length));
+    if(magic !== BUNDLE_MAGIC || view.getUint8(BUNDLE_MAGIC.length) !== BUNDLE_VERSION){
+        throw new Error('The game bundle is not in a supported format.');
+    }
+    let offset = BUNDLE_MAGIC.length + 1;
+    const sections = [];
+    for(let i = 0; i < 4; i++){
+        const length = view.getUint32(offset);
+        offset += 4;
+        sections.push(new Uint8Array(buffer,offset,length));
+        offset += length;
+    }
+    return {
+        config: JSON.parse(new TextDecoder().decode(sections[0])),
+        chip8Font: sections[1],
+        superChipFont: sections[2],
+        rom: sections[3]
+    };
+}
+
+/**
+ * Downloads the configuration, fonts and rom of a game in one request,
+ * configures the emulator and starts the game.
+ *
+ * @param {Chip8Emulator} emulator
+ * @param {String} bundleURL
+ * @return {Promise}
+ */
+async function loadBundle(emulator,bundleURL){
+    const response = await fetch(bundleURL);
+    if(!response.ok){
+        throw new Error(`Unable to download the game. Response Code: ${response.status}`);
     }
-    return binary
-}
\ No newline at end of file
+    const bundle = parseBundle(await response.arrayBuffer());
+    if(!bundle.config.hasOwnProperty('key_config')) throw new Error('Keyboard configuration not detected.');
+    else if(!bundle.config.hasOwnProperty('emulator_speed')) throw new Error('Emulation clock speed not configured.');
+
+    emulator.loadKeyMap(bundle.config['key_config']);
+    emulator.clockSpeed = bundle.config['emulator_speed'];
+    emulator.chip8Font = bundle.chip8Font;
+    emulator.superChipFont = bundle.superChipFont;
+    emulator.rom = bundle.rom;
+    emulator.startRom();
+}
@@ -0,0 +1,73 @@
+export {uploadState,downloadState,submitScore,fetchLeaderboard};
+
+/**
+ * Save states and high scores of the signed in player, stored by the server.
+ * Requests that change anything carry the csrf token of the page.
+ */
+
+/**
+ * Saves the running game's state to a slot.
+ *
+ * @param {Chip8Emulator} emulator
+ * @param {String} slotURL
+ * @param {String} csrfToken
+ * @return {Promise}
+ */
+async function uploadState(emulator,slotURL,csrfToken){
+    const response = await fetch(slotURL,{
+        method: 'PUT',
+        headers: {'Content-Type': 'application/octet-stream','X-CSRFToken': csrfToken},
+        body: emulator.saveState()
+    });
+    if(!response.ok){
+        throw new Error(`Unable to save the game. ${await response.text()}`);
+    }
+}
+
+/**
+ * Restores the state saved in a slot.
+ *
+ * @param {Chip8Emulator} emulator
+ * @param {String} slotURL
+ * @return {Promise}
+ */
+async function downloadState(emulator,slotURL){
+    const response = await fetch(slotURL);
+    if(response.status === 404){
+        throw new Error('Nothing has been saved in this slot.');
+    }
+    else if(!response.ok){
+        throw new Error(`Unable to load the saved game. ${await response.text()}`);
+    }
+    emulator.loadState(new Uint8Array(await response.arrayBuffer()));
+}
+
+/**
+ * @param {String} scoresURL
+ * @param {Number} score
+ * @param {String} csrfToken
+ * @return {Promise} Resolves to the player's best score and whether this score improved it.
+ */
+async function submitScore(scoresURL,score,csrfToken){
+    const response = await fetch(scoresURL,{
+        method: 'POST',
+        headers: {'Content-Type': 'application/json','X-CSRFToken': csrfToken},
+        body: JSON.stringify({score: score})
+    });
+    if(!response.ok){
+        throw new Error(`Unable to submit the score. ${await response.text()}`);
+    }
+    return response.json();
+}
+
+/**
+ * @param {String} scoresURL
+ * @return {Promise} Resolves to the top scores, best first.
+ */
+async function fetchLeaderboard(scoresURL){
+    const response = await fetch(scoresURL);
+    if(!response.ok){
+        throw new Error(`Unable to download the leaderboard. Response Code: ${response.status}`);
+    }
+    return response.json();
+}
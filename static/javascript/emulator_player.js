@@ -1,25 +1,76 @@
 import {Chip8Emulator} from "./emulator/chip8emulator.js";
-import {loadGame} from "./emulator/loaders.js";
+import {loadBundle} from "./emulator/loaders.js";
+import {uploadState,downloadState,submitScore,fetchLeaderboard} from "./emulator/saves.js";
 
 const canvas = document.getElementById('emulator_screen');
 const emulator = new Chip8Emulator(canvas);
-//get the api url from the calling script tag
-const gameUrl = document.querySelector("script[data-gameurl]").dataset.gameurl;
-fetch(gameUrl).then(
-    async function(response){
-    if(response.ok){
-        const config = await response.json();
-        if(config.hasOwnProperty('error')) throw new Error('Game could not be found on the server.');        
-        else if(!config.hasOwnProperty('key_config')) throw new Error('Keyboard configuration not detected.');
-        else if(!config.hasOwnProperty('emulator_speed')) throw new Error('Emulation clock speed not configured.');
-        
-        const keys = config['key_config'];
-        const clockSpeed = config['emulator_speed']
-        emulator.loadKeyMap(keys);
-        emulator.clockSpeed = clockSpeed;
-        return loadGame(emulator,config['chip8_font'],config['super_chip_font'],config['rom']);
-    }
-    else{
-        throw new Error(`Unable to download configuration. Response Code: ${response.status}`)
-    }
-}).catch(error => alert(error));
\ No newline at end of file
+//get the bundle and telemetry urls from the calling script tag
+const script = document.querySelector("script[data-bundleurl]");
+const bundleUrl = script.dataset.bundleurl;
+const telemetryUrl = script.dataset.telemetryurl;
+const gameId = parseInt(script.dataset.gameid);
+
+//sendBeacon survives the page unloading, plain text avoids a cors preflight
+function sendPlayEvent(event,duration){
+    const body = JSON.stringify({events:[{game_id:gameId,event:event,duration:duration}]});
+    navigator.sendBeacon(telemetryUrl,new Blob([body],{type:'text/plain'}));
+}
+
+//save slots are only on the page for signed in players
+function setUpSaveSlots(){
+    const slots = document.getElementById('save_slots');
+    if(!slots) return;
+    const csrfToken = slots.dataset.csrftoken;
+    slots.querySelectorAll('[data-sloturl]').forEach((slot)=>{
+        const slotUrl = slot.dataset.sloturl;
+        slot.querySelector('.save_state').addEventListener('click',()=>{
+            uploadState(emulator,slotUrl,csrfToken).catch(error => alert(error));
+        });
+        slot.querySelector('.load_state').addEventListener('click',()=>{
+            downloadState(emulator,slotUrl).catch(error => alert(error));
+        });
+    });
+}
+
+function showLeaderboard(){
+    const leaderboard = document.getElementById('leaderboard');
+    fetchLeaderboard(leaderboard.dataset.scoresurl).then((scores)=>{
+        leaderboard.replaceChildren();
+        for(const entry of scores){
+            const item = document.createElement('li');
+            item.textContent = `${entry.name} ${entry.score}`;
+            leaderboard.appendChild(item);
+        }
+    }).catch(error => console.log(error));
+}
+
+//games keep score on their own screen, so signed in players enter the score they reached
+function setUpScoreForm(){
+    const form = document.getElementById('score_form');
+    if(!form) return;
+    const result = form.querySelector('.score_result');
+    form.addEventListener('submit',(event)=>{
+        event.preventDefault();
+        const score = parseInt(form.elements.score.value);
+        submitScore(form.dataset.scoresurl,score,form.dataset.csrftoken).then((response)=>{
+            if(response.improved){
+                result.textContent = `New high score of ${response.best}!`;
+                showLeaderboard();
+            }
+            else{
+                result.textContent = `Your high score is still ${response.best}.`;
+            }
+        }).catch(error => alert(error));
+    });
+}
+
+//the config, fonts and rom arrive together, usually from the preload started in the page head
+loadBundle(emulator,bundleUrl).then(() => {
+    const started = performance.now();
+    sendPlayEvent('start');
+    //pagehide fires on navigation, closing the tab and the page entering the back forward cache
+    window.addEventListener('pagehide',() => sendPlayEvent('end',(performance.now() - started) / 1000),{once:true});
+    setUpSaveSlots();
+}).catch(error => alert(error));
+showLeaderboard();
+setUpScoreForm();
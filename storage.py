@@ -0,0 +1,253 @@
+from flask import current_app
+from threading import Lock
+import io
+import mimetypes
+import os
+import tempfile
+
+'''
+Storage backends for uploaded files.
+
+Files are addressed by keys such as game/ab/<sha256>, the same layout the upload store has
+always used on disk.  STORAGE_BACKEND picks the backend:
+
+local   Files under UPLOAD_FOLDER, served by the application.  The default.
+s3      An S3 compatible object store such as AWS S3 or MinIO, through boto3.  Configured by
+        STORAGE_S3_BUCKET, STORAGE_S3_PREFIX, STORAGE_S3_ENDPOINT_URL and STORAGE_S3_REGION,
+        with credentials found the usual boto3 way.  Downloads are redirected to presigned
+        urls valid for STORAGE_URL_EXPIRY seconds, or to STORAGE_PUBLIC_URL when the bucket
+        is public, so file bytes never pass through the web workers.  Browsers follow the
+        redirects from the emulator, so the bucket needs a CORS rule allowing GET.
+memory  The s3 backend against an in process fake of the object store, for tests and
+        benchmarks.  Its objects are lost when the process exits and are not shared with
+        job workers.  Nothing serves the fake over http, so the application sends its files.
+
+Uploads are still streamed to UPLOAD_FOLDER/tmp while the request is parsed, whatever
+the backend.
+'''
+
+#files are stored by content hash, so the bytes behind a key never change
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+'''
+Writes data to a path by way of a temporary file in the same directory,
+so readers never see a partially written file.
+'''
+def write_atomic(path,data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory,exist_ok=True)
+    fd,temp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd,'wb') as writer:
+            writer.write(data)
+        os.replace(temp_path,path)
+    except:
+        os.remove(temp_path)
+        raise
+
+def _content_type(key):
+    return mimetypes.guess_type(key)[0] or 'application/octet-stream'
+
+
+class LocalStorage:
+
+    def __init__(self,root):
+        self.root = root
+
+    def path(self,key):
+        return os.path.join(self.root,*key.split('/'))
+
+    def exists(self,key):
+        return os.path.exists(self.path(key))
+
+    '''
+    :raises FileNotFoundError if nothing is stored under the key.
+    '''
+    def read(self,key):
+        with open(self.path(key),'rb') as reader:
+            return reader.read()
+
+    def write(self,key,data):
+        write_atomic(self.path(key),data)
+
+    '''
+    Stores bytes or an uploads.UploadedFile, which is moved into place.
+    '''
+    def store(self,key,file):
+        if hasattr(file,'move_to'):
+            file.move_to(self.path(key))
+        else:
+            self.write(key,file)
+
+    def delete(self,key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    '''
+    :returns None, local files are served by the application.
+    '''
+    def url(self,key):
+        return None
+
+
+class S3Storage:
+
+    #error codes boto3 reports for a missing object
+    MISSING_CODES = ('404','NoSuchKey','NotFound')
+
+    '''
+    :param client A boto3 s3 client or an InMemoryS3Client.
+    :param prefix Prepended to every key, for sharing a bucket.
+    :param url_expiry Seconds presigned urls stay valid for.
+    :param public_url Base url of a public bucket, used instead of presigned urls.
+    :param redirect False when browsers cannot download from the object store, so the
+        application sends files itself.
+    '''
+    def __init__(self,client,bucket,prefix='',url_expiry=300,public_url=None,redirect=True):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.url_expiry = url_expiry
+        self.public_url = public_url
+        self.redirect = redirect
+
+    def _is_missing(self,error):
+        return getattr(error,'response',{}).get('Error',{}).get('Code') in self.MISSING_CODES
+
+    def exists(self,key):
+        try:
+            self.client.head_object(Bucket=self.bucket,Key=self.prefix + key)
+        except Exception as e:
+            if self._is_missing(e):
+                return False
+            raise
+        return True
+
+    '''
+    :raises FileNotFoundError if nothing is stored under the key.
+    '''
+    def read(self,key):
+        try:
+            return self.client.get_object(Bucket=self.bucket,Key=self.prefix + key)['Body'].read()
+        except Exception as e:
+            if self._is_missing(e):
+                raise FileNotFoundError(key) from e
+            raise
+
+    def write(self,key,data):
+        self.client.put_object(Bucket=self.bucket,Key=self.prefix + key,Body=data,
+                               ContentType=_content_type(key),CacheControl=IMMUTABLE_CACHE_CONTROL)
+
+    '''
+    Stores bytes or an uploads.UploadedFile.
+    '''
+    def store(self,key,file):
+        if hasattr(file,'move_to'):
+            file.seek(0)
+            file = file.read()
+        self.write(key,file)
+
+    def delete(self,key):
+        self.client.delete_object(Bucket=self.bucket,Key=self.prefix + key)
+
+    '''
+    :returns Url the object can be downloaded from without going through the application,
+        or None if the application has to send it.
+    '''
+    def url(self,key):
+        if not self.redirect:
+            return None
+        if self.public_url:
+            return f"{self.public_url.rstrip('/')}/{self.prefix}{key}"
+        return self.client.generate_presigned_url('get_object',Params={'Bucket':self.bucket,'Key':self.prefix + key},
+                                                  ExpiresIn=self.url_expiry)
+
+    '''
+    Cache-Control for redirects to url, which must not outlive a presigned url.
+    '''
+    @property
+    def url_cache_control(self):
+        if self.public_url:
+            return IMMUTABLE_CACHE_CONTROL
+        return f"public, max-age={self.url_expiry // 2}"
+
+
+class MissingObjectError(Exception):
+
+    def __init__(self,key):
+        super().__init__(f"No object is stored under {key}.")
+        #the shape of botocore's ClientError.response
+        self.response = {'Error':{'Code':'NoSuchKey'}}
+
+
+'''
+Stand in for a boto3 s3 client keeping objects in memory, implementing the calls S3Storage makes.
+'''
+class InMemoryS3Client:
+
+    def __init__(self,endpoint_url='https://s3.memory.invalid'):
+        self.endpoint_url = endpoint_url
+        self.objects = {}
+        self._lock = Lock()
+
+    def _get(self,Bucket,Key):
+        with self._lock:
+            stored = self.objects.get((Bucket,Key))
+        if stored is None:
+            raise MissingObjectError(Key)
+        return stored
+
+    def put_object(self,Bucket,Key,Body,**metadata):
+        if hasattr(Body,'read'):
+            Body = Body.read()
+        with self._lock:
+            self.objects[(Bucket,Key)] = dict(metadata,Body=bytes(Body))
+        return {}
+
+    def head_object(self,Bucket,Key):
+        stored = self._get(Bucket,Key)
+        return {'ContentLength':len(stored['Body']),'ContentType':stored.get('ContentType')}
+
+    def get_object(self,Bucket,Key):
+        stored = self._get(Bucket,Key)
+        return {'Body':io.BytesIO(stored['Body']),'ContentLength':len(stored['Body']),'ContentType':stored.get('ContentType')}
+
+    def delete_object(self,Bucket,Key):
+        with self._lock:
+            self.objects.pop((Bucket,Key),None)
+        return {}
+
+    def generate_presigned_url(self,ClientMethod,Params,ExpiresIn=3600):
+        return f"{self.endpoint_url}/{Params['Bucket']}/{Params['Key']}?X-Amz-Expires={ExpiresIn}"
+
+
+'''
+Creates the storage backend chosen by STORAGE_BACKEND and registers it on the application.
+'''
+def create_storage(app):
+    backend = app.config.get('STORAGE_BACKEND','local')
+    if backend == 'local':
+        storage = LocalStorage(app.config['UPLOAD_FOLDER'])
+    elif backend in ('s3','memory'):
+        if backend == 's3':
+            #boto3 is only required when an object store is configured
+            import boto3
+            client = boto3.client('s3',endpoint_url=app.config.get('STORAGE_S3_ENDPOINT_URL'),
+                                  region_name=app.config.get('STORAGE_S3_REGION'))
+        else:
+            client = InMemoryS3Client()
+        storage = S3Storage(client,app.config.get('STORAGE_S3_BUCKET','chip8-arcade'),app.config.get('STORAGE_S3_PREFIX',''),
+                            app.config.get('STORAGE_URL_EXPIRY',300),app.config.get('STORAGE_PUBLIC_URL'),
+                            redirect=backend == 's3')
+    else:
+        raise ValueError(f"Unknown STORAGE_BACKEND {backend}.")
+    app.extensions['storage'] = storage
+    return storage
+
+'''
+:returns The storage backend of the current application.
+'''
+def current_storage():
+    return current_app.extensions['storage']
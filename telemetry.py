@@ -0,0 +1,158 @@
+from sqlalchemy import func,bindparam
+from sqlalchemy.orm import Session
+from datetime import datetime
+from threading import Lock
+import time
+
+'''
+Play telemetry.
+
+The emulator player posts a start event when a game begins and an end event with the
+seconds played when the page is left.  PlayTelemetry adds the events up per game in
+memory and flushes the totals as one executemany insert into play_tally every
+TELEMETRY_FLUSH_INTERVAL seconds, or sooner once TELEMETRY_BUFFER_SIZE games are pending.
+Every flush queues the roll_up_plays job, due TELEMETRY_ROLLUP_INTERVAL seconds later,
+which folds the tallies into the play_count and play_seconds of each game in one pass.
+Totals buffered by a process that dies before flushing are lost, which popularity counts
+can live with.
+'''
+
+EVENTS = ('start','end')
+MAX_EVENTS_PER_REQUEST = 20
+#longest session counted, so a tab left open overnight does not dominate
+MAX_SESSION_SECONDS = 4 * 60 * 60
+
+'''
+:param event Dictionary with the game_id, the event name and for end events the duration in seconds.
+:returns Tuple of (game_id,event,duration).
+:raises ValueError if the event is malformed.
+'''
+def parse_play_event(event):
+    if not isinstance(event,dict) or event.get('event') not in EVENTS:
+        raise ValueError('Unknown play event.')
+    game_id = event.get('game_id')
+    if type(game_id) != int or game_id < 1:
+        raise ValueError('Play events need the id of a game.')
+    duration = event.get('duration')
+    if event['event'] == 'end':
+        if type(duration) not in (int,float) or duration < 0:
+            raise ValueError('End events need the seconds played.')
+        duration = min(duration,MAX_SESSION_SECONDS)
+    else:
+        duration = None
+    return game_id,event['event'],duration
+
+
+class PlayTelemetry:
+
+    '''
+    :param model The PlayTally model flushes insert into.
+    :param jobs The jobs.JobQueue running roll_up_plays.
+    :param flush_interval Seconds between flushes.
+    :param buffer_size Games with pending totals that trigger an early flush.
+    :param rollup_interval Seconds a flush waits before rolling up the tallies.
+    '''
+    def __init__(self,db,model,jobs,flush_interval=10,buffer_size=1000,rollup_interval=60,app=None):
+        self.db = db
+        self.model = model
+        self.jobs = jobs
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.rollup_interval = rollup_interval
+        #game id -> [plays,seconds]
+        self._totals = {}
+        self._lock = Lock()
+        self._last_flush = time.monotonic()
+        if app is not None:
+            self.init_app(app)
+
+    '''
+    Reads TELEMETRY_FLUSH_INTERVAL, TELEMETRY_BUFFER_SIZE and TELEMETRY_ROLLUP_INTERVAL
+    from the application configuration.
+    '''
+    def init_app(self,app):
+        app.extensions['telemetry'] = self
+        self.flush_interval = app.config.get('TELEMETRY_FLUSH_INTERVAL',self.flush_interval)
+        self.buffer_size = app.config.get('TELEMETRY_BUFFER_SIZE',self.buffer_size)
+        self.rollup_interval = app.config.get('TELEMETRY_ROLLUP_INTERVAL',self.rollup_interval)
+
+    def _add(self,game_id,plays,seconds):
+        totals = self._totals.setdefault(game_id,[0,0.0])
+        totals[0] += plays
+        totals[1] += seconds
+
+    '''
+    Adds an event to the buffer, flushing it when due.
+    '''
+    def record(self,game_id,event,duration=None):
+        with self._lock:
+            if event == 'start':
+                self._add(game_id,1,0)
+            else:
+                self._add(game_id,0,duration)
+            due = len(self._totals) >= self.buffer_size or time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    '''
+    Inserts the buffered totals and queues a roll up.  Runs on a session of its own,
+    so it never commits or rolls back the changes of the request it runs in.  If the
+    insert fails the totals go back into the buffer for the next flush.
+
+    :returns Number of games flushed.
+    '''
+    def flush(self):
+        with self._lock:
+            totals,self._totals = self._totals,{}
+            self._last_flush = time.monotonic()
+        if not totals:
+            return 0
+        now = datetime.now()
+        rows = [{'game_id':game_id,'plays':plays,'seconds':int(round(seconds)),'created_on':now}
+                for game_id,(plays,seconds) in totals.items()]
+        session = Session(bind=self.db.engine)
+        try:
+            session.execute(self.model.__table__.insert(),rows)
+            self.jobs.enqueue('roll_up_plays',0,delay=self.rollup_interval,session=session)
+            session.commit()
+        except:
+            session.rollback()
+            with self._lock:
+                for game_id,(plays,seconds) in totals.items():
+                    self._add(game_id,plays,seconds)
+            raise
+        finally:
+            session.close()
+        return len(rows)
+
+
+'''
+Adds the tallies to the play counters of their games and deletes them, on the current
+session.  Tallies for deleted games are dropped.
+
+:returns Number of games updated.
+:raises RuntimeError if another roll up took some of the tallies first.  The caller must
+    roll back, which the job queue does before retrying.
+'''
+def roll_up_plays(db,model,game_model):
+    session = db.session
+    last_id = session.query(func.max(model.id)).scalar()
+    if last_id is None:
+        return 0
+    tallies = model.id <= last_id
+    count = session.query(func.count(model.id)).filter(tallies).scalar()
+    totals = session.query(model.game_id,func.sum(model.plays),func.sum(model.seconds))\
+        .filter(tallies).group_by(model.game_id).all()
+    game = game_model.__table__
+    update = game.update().where(game.c.id == bindparam('tally_game_id')).values(
+        play_count=game.c.play_count + bindparam('tally_plays'),
+        play_seconds=game.c.play_seconds + bindparam('tally_seconds'),
+        #play counts are not edits, so keep onupdate from touching last_updated
+        last_updated=game.c.last_updated)
+    session.execute(update,[{'tally_game_id':game_id,'tally_plays':int(plays),'tally_seconds':int(seconds)}
+                            for game_id,plays,seconds in totals])
+    #a concurrent roll up or a tally committed out of id order shows up as a count mismatch
+    deleted = session.query(model).filter(tallies).delete(synchronize_session=False)
+    if deleted != count:
+        raise RuntimeError(f"Expected to roll up {count} tallies but deleted {deleted}.")
+    return len(totals)
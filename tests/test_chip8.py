@@ -0,0 +1,40 @@
+from chip8 import Chip8,smoke_test
+from batch_chip8 import batch_smoke_test
+
+#draws the digits 0, 1 and 2 side by side within the first frame
+DRAW_DIGITS = bytes.fromhex('00e0'
+                            '600062006305f029d235'
+                            '600162086305f029d235'
+                            '600262106305f029d235')
+#waits for the delay timer to run out, so the digits stay up for a frame
+WAIT_FRAME = bytes.fromhex('6401f415f40734001224')
+#clears the screen and loops forever
+CLEAR_AND_IDLE = bytes.fromhex('00e0122c')
+
+'''
+:returns The png of the screen once the rom has run until it idles.
+'''
+def final_frame(rom):
+    chip = Chip8()
+    chip.load_rom(rom)
+    chip.run(1000)
+    return chip.frame_png()
+
+def test_thumbnail_holds_every_sprite_of_the_first_frame():
+    rom = DRAW_DIGITS + WAIT_FRAME + CLEAR_AND_IDLE
+    digits = final_frame(DRAW_DIGITS + bytes.fromhex('1220'))
+    result = smoke_test(rom)
+    assert result.error is None
+    assert result.draw_count == 3
+    assert result.thumbnail == digits
+    #the screen is blank at the end of the run
+    assert final_frame(rom) != digits
+
+def test_batch_thumbnail_matches_single_machine():
+    roms = [DRAW_DIGITS + WAIT_FRAME + CLEAR_AND_IDLE,DRAW_DIGITS + bytes.fromhex('1220'),bytes.fromhex('1200')]
+    assert batch_smoke_test(roms) == [smoke_test(rom) for rom in roms]
+
+def test_no_thumbnail_without_pixels():
+    result = smoke_test(bytes.fromhex('1200'))
+    assert result.thumbnail is None
+    assert result.error == "The rom loops forever without drawing anything."
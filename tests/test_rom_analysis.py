@@ -0,0 +1,23 @@
+from rom_analysis import analyze_rom,decode
+from chip8 import smoke_test
+
+def test_sys_calls_fall_through():
+    assert decode(0x0123).mnemonic == 'SYS addr'
+    assert decode(0x00E0).mnemonic == 'CLS'
+    assert decode(0x00EE).mnemonic == 'RET'
+    assert decode(0x00C4).mnemonic == 'SCD nibble'
+    assert decode(0x00FD).mnemonic == 'EXIT'
+
+def test_rom_starting_with_sys_call_is_valid():
+    #SYS 123, then draw the digit 0 and loop forever
+    rom = bytes.fromhex('012300e06000f029d0051208')
+    analysis = analyze_rom(rom)
+    assert analysis.fatal_opcode is None
+    assert analysis.invalid_opcodes == []
+    result = smoke_test(rom)
+    assert result.error is None
+    assert result.draw_count > 0
+
+def test_invalid_opcode_on_startup_path_is_fatal():
+    analysis = analyze_rom(bytes.fromhex('00e05001'))
+    assert analysis.fatal_opcode == (0x202,0x5001)
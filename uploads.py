@@ -0,0 +1,58 @@
+from flask import Request,current_app
+import hashlib
+import os
+import tempfile
+
+'''
+Streaming upload handling.
+
+Werkzeug hands every file in a multipart body to the stream returned by
+Request._get_file_stream as it parses the body.  UploadRequest returns an UploadedFile,
+which writes the chunks straight to a temporary file in the upload store while hashing
+and counting them, so neither the size check nor the content hash needs another read,
+and storing the file in local storage is a rename.
+'''
+
+class UploadedFile:
+
+    def __init__(self,directory):
+        os.makedirs(directory,exist_ok=True)
+        fd,self.path = tempfile.mkstemp(dir=directory,suffix='.upload')
+        self._file = os.fdopen(fd,'w+b')
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self,data):
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    '''
+    Moves the file to its final location.  The upload store and its temporary
+    directory share a filesystem, so the move is atomic.
+    '''
+    def move_to(self,path):
+        self._file.flush()
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        os.replace(self.path,path)
+
+    '''
+    Closes the file, removing it unless it has been moved.
+    '''
+    def close(self):
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    #reading and seeking are used by the form validators
+    def __getattr__(self,name):
+        return getattr(self._file,name)
+
+
+class UploadRequest(Request):
+
+    def _get_file_stream(self,total_content_length,content_type,filename=None,content_length=None):
+        return UploadedFile(os.path.join(current_app.config['UPLOAD_FOLDER'],'tmp'))